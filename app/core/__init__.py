@@ -1,4 +1,17 @@
-from app.core.db import create_db, dispose_engine, init_engine
+from app.core.db import (
+    create_db,
+    create_session,
+    current_session,
+    dispose_engine,
+    init_engine,
+    session_stats,
+)
 from app.core.loader import create_bot, create_dispatcher
 from app.core.modules import Module, ModuleRegistry
-from app.core.security import AccessMiddleware, ContextInjectorMiddleware, RateLimitMiddleware
+from app.core.security import (
+    AccessMiddleware,
+    ContextInjectorMiddleware,
+    DbSessionMiddleware,
+    HandlerTagMiddleware,
+    RateLimitMiddleware,
+)
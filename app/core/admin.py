@@ -0,0 +1,106 @@
+"""Служебные команды администраторов (``ADMIN_USERS``).
+
+``/profile [cpu|sample|mem] [N]`` — профилирует процесс N секунд и присылает отчёт
+файлом (см. ``app/core/profiling.py``). ``/memory`` — память процесса по подсистемам
+(``app/core/memory.py``). Для остальных пользователей команды не существуют:
+сообщение уходит дальше по роутерам, как обычный текст.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Iterable, Set
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.filters import Command, Filter
+from aiogram.types import BufferedInputFile, Message
+
+from app.core import profiling
+from app.core.memory import format_report, memory
+from config import Settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = 300
+PROFILE_USAGE = (
+    "Использование: /profile [cpu|sample|mem] [N]\n"
+    "cpu — cProfile, sample — сэмплирование стека, mem — прирост памяти (tracemalloc); "
+    f"N — длительность в секундах (по умолчанию {PROFILE_DEFAULT_SECONDS}, "
+    f"максимум {PROFILE_MAX_SECONDS})."
+)
+
+router = Router(name="admin")
+# Фоновые задачи профилирования: ссылка нужна, чтобы задачу не собрал GC.
+_TASKS: Set[asyncio.Task] = set()
+
+
+class AdminFilter(Filter):
+    """Пропускает сообщения только от пользователей из ``admin_ids``."""
+
+    def __init__(self, admin_ids: Iterable[int]):
+        self.admin_ids = frozenset(admin_ids)
+
+    async def __call__(self, message: Message) -> bool:
+        return message.from_user is not None and message.from_user.id in self.admin_ids
+
+
+@router.message(Command("profile"))
+async def profile(message: Message):
+    args = (message.text or "").split()[1:]
+    mode = args[0].lower() if args else "sample"
+    duration = args[1] if len(args) > 1 else str(PROFILE_DEFAULT_SECONDS)
+    if mode not in profiling.PROFILERS or len(args) > 2 or not duration.isdigit():
+        await message.answer(PROFILE_USAGE)
+        return
+    seconds = min(max(1, int(duration)), PROFILE_MAX_SECONDS)
+    if profiling.busy():
+        await message.answer("Профилирование уже идёт, дождитесь отчёта.")
+        return
+
+    await message.answer(f"Профилирование {mode} на {seconds} с...")
+    # Хэндлер не ждёт окончания: иначе все это время он держал бы воркер планировщика
+    # апдейтов и очередь сообщений администратора.
+    task = asyncio.create_task(_profile_and_send(message, mode, seconds))
+    _TASKS.add(task)
+    task.add_done_callback(_TASKS.discard)
+
+
+async def _profile_and_send(message: Message, mode: str, seconds: int) -> None:
+    try:
+        report = await profiling.run_profile(mode, seconds)
+    except profiling.ProfilerBusy:
+        await message.answer("Профилирование уже идёт, дождитесь отчёта.")
+        return
+    except Exception as exc:  # pragma: no cover - например, активен другой профилировщик
+        logger.exception("Ошибка профилирования", exc_info=exc)
+        await message.answer(f"Не удалось выполнить профилирование: {exc}")
+        return
+    filename = f"profile-{mode}-{time.strftime('%Y%m%d-%H%M%S')}.txt"
+    await message.answer_document(
+        BufferedInputFile(report.encode(), filename=filename),
+        caption=f"Профилирование {mode}, {seconds} с",
+    )
+
+
+@router.message(Command("memory"))
+async def memory_usage(message: Message):
+    await message.answer(format_report(memory.snapshot()))
+
+
+async def notify_admins(bot: Bot, admin_ids: Iterable[int], text: str) -> None:
+    """Отправляет служебное сообщение всем администраторам."""
+
+    for admin_id in admin_ids:
+        try:
+            await bot.send_message(admin_id, text)
+        except Exception as exc:  # pragma: no cover - администратор мог заблокировать бота
+            logger.warning("Не удалось отправить сообщение администратору %s: %s", admin_id, exc)
+
+
+def setup(dispatcher: Dispatcher, settings: Settings) -> None:
+    """Подключает команды администраторов. Без ``ADMIN_USERS`` они недоступны никому."""
+
+    router.message.filter(AdminFilter(settings.admin_users))
+    dispatcher.include_router(router)
@@ -24,7 +24,7 @@ class ContextManager:
     ) -> None:
         message = ContextMessage(user_id=user_id, role=role, content=content)
         session.add(message)
-        await session.commit()
+        await session.flush()
         await self.trim_history(session, user_id)
 
     async def get_history(self, session: AsyncSession, user_id: int) -> List[ContextMessage]:
@@ -36,12 +36,13 @@ class ContextManager:
         return list(result.scalars())
 
     async def trim_history(self, session: AsyncSession, user_id: int) -> None:
+        # Фиксацию выполняет DbSessionMiddleware, здесь только flush.
         history = await self.get_history(session, user_id)
         while len(history) > self.max_messages or self._length(history) > self.max_chars:
             oldest = history.pop(0)
             await session.delete(oldest)
-            await session.commit()
             logger.debug("Удалено сообщение %s из контекста пользователя %s", oldest.id, user_id)
+        await session.flush()
 
     @staticmethod
     def _length(messages: List[ContextMessage]) -> int:
@@ -1,49 +1,172 @@
 """Инициализация базы данных и сессий SQLAlchemy."""
-from typing import AsyncGenerator
-
+import hashlib
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncGenerator, Iterator, Optional
+
+from sqlalchemy import MetaData, delete, event, inspect, insert, select
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import DeclarativeBase, Session
+
+from app.core.sql_stats import query_stats
+
+logger = logging.getLogger(__name__)
 
 
 class Base(DeclarativeBase):
     """Базовый класс моделей."""
 
 
+@dataclass
+class SessionStats:
+    """Счётчики сессий и выдачи соединений из пула.
+
+    ``checkouts`` растёт при каждом начале транзакции на соединении, то есть при
+    каждом фактическом получении соединения сессией. При корректном unit of work на
+    один апдейт приходится не больше одного checkout.
+    """
+
+    sessions: int = 0
+    checkouts: int = 0
+    units_of_work: int = 0
+    multi_checkout_units: int = 0
+
+
 _engine = None
 _session_factory: async_sessionmaker[AsyncSession] | None = None
+session_stats = SessionStats()
+# Сессия апдейта, открытая DbSessionMiddleware (для хранилищ без доступа к data).
+_current_session: ContextVar[Optional[AsyncSession]] = ContextVar("db_session", default=None)
+
 
+def _count_checkout(session: Session, transaction, connection) -> None:
+    session.info["checkouts"] = session.info.get("checkouts", 0) + 1
+    session_stats.checkouts += 1
 
-def init_engine(database_url: str):
+
+def init_engine(
+    database_url: str, slow_query_ms: float = 200, n_plus_one_threshold: int = 10
+):
     """Создает движок и фабрику сессий.
 
     Вызывается один раз при старте приложения. Для миграции на PostgreSQL/MySQL
-    достаточно поменять ``database_url``.
+    достаточно поменять ``database_url``. Здесь же подключается сбор статистики
+    запросов (``query_stats``).
     """
 
     global _engine, _session_factory
     _engine = create_async_engine(database_url, echo=False, future=True)
     _session_factory = async_sessionmaker(_engine, expire_on_commit=False)
+    query_stats.configure(slow_query_ms, n_plus_one_threshold)
+    query_stats.attach(_engine)
+    if not event.contains(Session, "after_begin", _count_checkout):
+        event.listen(Session, "after_begin", _count_checkout)
 
 
-async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    """Зависимость для получения сессии."""
+def get_engine():
+    """Возвращает движок (для фоновых задач обслуживания)."""
+
+    if _engine is None:
+        raise RuntimeError("База данных не инициализирована. Вызовите init_engine().")
+    return _engine
+
+
+def create_session() -> AsyncSession:
+    """Создает новую сессию (соединение берётся из пула только при первом запросе)."""
 
     if _session_factory is None:
         raise RuntimeError("База данных не инициализирована. Вызовите init_engine().")
-    async with _session_factory() as session:
+    session_stats.sessions += 1
+    return _session_factory()
+
+
+def current_session() -> Optional[AsyncSession]:
+    """Сессия обрабатываемого апдейта или ``None`` вне обработки апдейта."""
+
+    return _current_session.get()
+
+
+@contextmanager
+def bind_session(session: AsyncSession) -> Iterator[AsyncSession]:
+    """Делает ``session`` текущей сессией апдейта на время блока."""
+
+    token = _current_session.set(session)
+    try:
         yield session
+    finally:
+        _current_session.reset(token)
+
 
+async def get_session() -> AsyncGenerator[AsyncSession, None]:
+    """Зависимость для получения сессии вне обработки апдейтов (фоновые задачи)."""
 
-async def create_db():
-    """Создает таблицы (миграции можно добавить позднее)."""
+    async with create_session() as session:
+        yield session
+
+
+def schema_fingerprint(metadata: MetaData, *options: object) -> str:
+    """Хеш описания таблиц, колонок и индексов моделей (и опций создания схемы)."""
+
+    parts = [repr(options)]
+    for table in sorted(metadata.tables.values(), key=lambda t: t.name):
+        parts.append(table.name)
+        parts.extend(
+            f"{column.name}:{column.type!r}:{column.nullable}:{column.primary_key}"
+            for column in table.columns
+        )
+        parts.extend(
+            sorted(f"{index.name}:{[c.name for c in index.columns]}" for index in table.indexes)
+        )
+        parts.extend(
+            sorted(
+                f"{type(constraint).__name__}:{constraint.name}:"
+                f"{sorted(column.name for column in constraint.columns)}"
+                for constraint in table.constraints
+            )
+        )
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+async def create_db(partition_context_history: bool = False) -> bool:
+    """Создает таблицы (миграции можно добавить позднее).
+
+    ``partition_context_history`` на PostgreSQL создаёт ``context_history``
+    секционированной по времени (если таблицы ещё нет).
+
+    ``create_all`` с отражением всех таблиц выполняется, только если отпечаток
+    моделей отличается от записанного в ``schema_version``; иначе запуск обходится
+    одним запросом. Возвращает ``True``, если схема проверялась.
+    """
 
     if _engine is None:
         raise RuntimeError("База данных не инициализирована. Вызовите init_engine().")
 
     from app.models import Base as ModelBase  # локальный импорт чтобы избежать циклов
+    from app.models import SchemaVersion
 
+    fingerprint = schema_fingerprint(
+        ModelBase.metadata, _engine.dialect.name, partition_context_history
+    )
+    table = SchemaVersion.__table__
     async with _engine.begin() as conn:
+        if await conn.run_sync(lambda sync: inspect(sync).has_table(table.name)):
+            recorded = await conn.scalar(select(table.c.fingerprint).where(table.c.id == 1))
+            if recorded == fingerprint:
+                return False
+        if partition_context_history and _engine.dialect.name == "postgresql":
+            from app.core.maintenance import create_partitioned_context_table
+
+            await create_partitioned_context_table(conn)
         await conn.run_sync(ModelBase.metadata.create_all)
+        await conn.execute(delete(table))
+        await conn.execute(
+            insert(table).values(id=1, fingerprint=fingerprint, updated_at=datetime.utcnow())
+        )
+    logger.info("Схема БД проверена, отпечаток %s", fingerprint[:12])
+    return True
 
 
 async def dispose_engine() -> None:
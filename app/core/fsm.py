@@ -0,0 +1,118 @@
+"""Хранилище FSM aiogram в таблице ``fsm_state``.
+
+Позволяет запускать бота в нескольких репликах без Redis: состояние
+многошаговых диалогов лежит в общей БД. Внутри обработки апдейта запись идёт в
+сессию апдейта (``current_session``), поэтому смена состояния фиксируется вместе
+с данными хэндлера и откатывается вместе с ними. Записи живут ``ttl`` секунд с
+последнего изменения; просроченные считаются пустыми и периодически удаляются.
+"""
+from __future__ import annotations
+
+import json
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.db import create_session, current_session
+from app.models import FSMRecord
+
+logger = logging.getLogger(__name__)
+
+_PURGE_INTERVAL = timedelta(hours=1)
+
+
+def _storage_key(key: StorageKey) -> str:
+    return ":".join(
+        str(part) if part is not None else ""
+        for part in (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            key.thread_id,
+            key.business_connection_id,
+            key.destiny,
+        )
+    )
+
+
+class SQLStorage(BaseStorage):
+    """``BaseStorage`` поверх существующего движка SQLAlchemy."""
+
+    def __init__(self, ttl_seconds: int = 86400):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self._next_purge = datetime.utcnow()
+
+    @asynccontextmanager
+    async def _session(self) -> AsyncIterator[AsyncSession]:
+        session = current_session()
+        if session is not None:
+            # Фиксирует DbSessionMiddleware вместе с остальной работой апдейта.
+            yield session
+            await session.flush()
+            return
+        async with create_session() as own:
+            yield own
+            await own.commit()
+
+    async def _load(self, session: AsyncSession, key: StorageKey) -> Optional[FSMRecord]:
+        record = await session.get(FSMRecord, _storage_key(key))
+        if record is None or record.expires_at <= datetime.utcnow():
+            return None
+        return record
+
+    async def _update(self, key: StorageKey, **changes: Any) -> None:
+        """Меняет ``state`` и/или ``data`` и продлевает срок жизни записи."""
+
+        now = datetime.utcnow()
+        async with self._session() as session:
+            record = await session.get(FSMRecord, _storage_key(key))
+            is_new = record is None
+            if record is None:
+                record = FSMRecord(key=_storage_key(key), state=None, data="{}")
+            elif record.expires_at <= now:
+                record.state, record.data = None, "{}"
+            if "state" in changes:
+                record.state = changes["state"]
+            if "data" in changes:
+                record.data = json.dumps(changes["data"], ensure_ascii=False, default=str)
+            record.expires_at = now + self.ttl
+            # Пустой диалог (после state.clear()) не храним.
+            if record.state is None and record.data == "{}":
+                if not is_new:
+                    await session.delete(record)
+            elif is_new:
+                session.add(record)
+            if now >= self._next_purge:
+                await self._purge(session, now)
+
+    async def _purge(self, session: AsyncSession, now: datetime) -> None:
+        self._next_purge = now + _PURGE_INTERVAL
+        result = await session.execute(delete(FSMRecord).where(FSMRecord.expires_at <= now))
+        if result.rowcount:
+            logger.info("FSM: удалено брошенных диалогов %s", result.rowcount)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._update(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        async with self._session() as session:
+            record = await self._load(session, key)
+            return record.state if record is not None else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._update(key, data=dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        async with self._session() as session:
+            record = await self._load(session, key)
+            return json.loads(record.data) if record is not None else {}
+
+    async def close(self) -> None:
+        return None
+
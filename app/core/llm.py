@@ -0,0 +1,48 @@
+"""Клиент OpenAI-совместимого API, создаваемый при первом обращении.
+
+Импорт ``openai`` (вместе с ``httpx`` и ``pydantic``-моделями SDK) заметно
+удлиняет запуск, поэтому SDK импортируется только при первом запросе к LLM.
+Модули с одинаковыми ключом и адресом API используют один клиент и один пул
+HTTP-соединений.
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, Optional, Tuple, Type
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+    from config import Settings
+
+_clients: Dict[Tuple[str, str], "AsyncOpenAI"] = {}
+
+
+def openai_client(settings: "Settings") -> Optional["AsyncOpenAI"]:
+    """Клиент для ``OPENAI_API_KEY``/``OPENAI_BASE_URL`` или ``None`` без ключа."""
+
+    if not settings.openai_api_key:
+        return None
+    key = (settings.openai_api_key, settings.openai_base_url)
+    client = _clients.get(key)
+    if client is None:
+        from openai import AsyncOpenAI
+
+        client = _clients[key] = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url,
+        )
+    return client
+
+
+def llm_errors() -> Tuple[Type[BaseException], ...]:
+    """Ошибки клиента LLM (сеть, таймаут, ответ API) для ``except llm_errors()``.
+
+    Выражение в ``except`` вычисляется только при исключении, поэтому SDK по-прежнему
+    импортируется лениво; без установленного ``openai`` ошибок клиента быть не может.
+    """
+
+    try:
+        from openai import APIError
+    except ImportError:
+        return ()
+    return (APIError,)
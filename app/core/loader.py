@@ -1,12 +1,85 @@
 """Создание экземпляров бота и диспетчера."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Iterable, Optional
+
 from aiogram import Bot, Dispatcher
+from aiogram import BaseMiddleware
 from aiogram.client.default import DefaultBotProperties
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app.core.memory import MemoryUsage, estimate_size
+
+if TYPE_CHECKING:
+    from config import Settings
 
 
 def create_bot(token: str) -> Bot:
     return Bot(token=token, default=DefaultBotProperties(parse_mode="HTML"))
 
 
-def create_dispatcher() -> Dispatcher:
-    # Диспетчер можно конфигурировать здесь (Middlewares, storage и т.д.)
-    return Dispatcher()
+def create_fsm_storage(settings: "Settings") -> BaseStorage:
+    """Хранилище состояний FSM по настройке ``FSM_STORAGE``.
+
+    - ``memory`` — в процессе: диалоги теряются при перезапуске, одна реплика;
+    - ``redis`` — ``RedisStorage`` aiogram (``REDIS_URL``), TTL на состояние и данные;
+    - ``sql`` — таблица ``fsm_state`` в основной БД с тем же TTL.
+    """
+
+    kind = settings.fsm_storage.lower()
+    if kind == "memory":
+        return MemoryStorage()
+    if kind == "redis":
+        if not settings.redis_url:
+            raise ValueError("Для FSM_STORAGE=redis необходимо задать REDIS_URL")
+        from aiogram.fsm.storage.redis import RedisStorage  # требует пакет redis
+
+        return RedisStorage.from_url(
+            settings.redis_url,
+            state_ttl=settings.fsm_ttl_seconds,
+            data_ttl=settings.fsm_ttl_seconds,
+        )
+    if kind == "sql":
+        from app.core.fsm import SQLStorage  # локальный импорт чтобы избежать циклов
+
+        return SQLStorage(ttl_seconds=settings.fsm_ttl_seconds)
+    raise ValueError(f"Неизвестный FSM_STORAGE: {kind}")
+
+
+def fsm_memory_usage(storage: BaseStorage) -> Optional[MemoryUsage]:
+    """Записи FSM в памяти процесса; ``None`` для redis и sql.
+
+    ``MemoryStorage`` не удаляет записи завершённых диалогов, поэтому их число
+    растёт с числом пользователей, когда-либо начинавших диалог.
+    """
+
+    if not isinstance(storage, MemoryStorage):
+        return None
+    return MemoryUsage(len(storage.storage), estimate_size(storage.storage))
+
+
+def create_dispatcher(
+    settings: "Settings", before_fsm: Iterable[BaseMiddleware] = ()
+) -> Dispatcher:
+    """Диспетчер с outer-middleware апдейтов, идущими до чтения состояния FSM.
+
+    Порядок: ``UserContextMiddleware`` aiogram, ``UpdateScheduler``, ``before_fsm``,
+    ``FSMContextMiddleware``. ``Dispatcher`` регистрирует FSM-middleware сразу после ``UserContextMiddleware``,
+    и ``outer_middleware()`` добавил бы новые уже после чтения состояния. Поэтому
+    диспетчер создаётся с ``disable_fsm=True``, а ``dispatcher.fsm`` подключается
+    последним через тот же публичный ``outer_middleware()``.
+    """
+
+    from app.core.scheduling import UpdateScheduler
+
+    dispatcher = Dispatcher(storage=create_fsm_storage(settings), disable_fsm=True)
+    # Апдейт ждёт своей очереди до чтения состояния FSM и до открытия сессии БД:
+    # иначе второе сообщение пользователя увидело бы состояние до первого.
+    scheduler = UpdateScheduler(workers=settings.update_workers)
+    dispatcher.update.outer_middleware(scheduler)
+    for middleware in before_fsm:
+        dispatcher.update.outer_middleware(middleware)
+    dispatcher.update.outer_middleware(dispatcher.fsm)
+    dispatcher["update_scheduler"] = scheduler
+    return dispatcher
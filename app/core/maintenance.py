@@ -0,0 +1,270 @@
+"""Фоновое обслуживание истории контекста: срок хранения, лимиты и компактизация."""
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.models.context import ContextMessage
+
+logger = logging.getLogger(__name__)
+
+_TABLE = ContextMessage.__tablename__
+# Страниц, освобождаемых за один проход incremental_vacuum (SQLite).
+_VACUUM_PAGES = 2000
+
+_PARTITIONED_DDL = f"""
+CREATE TABLE IF NOT EXISTS {_TABLE} (
+    id BIGSERIAL,
+    user_id BIGINT NOT NULL,
+    role VARCHAR(32) NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp)
+"""
+
+
+def _month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(moment: datetime) -> datetime:
+    return _month_start(_month_start(moment) + timedelta(days=32))
+
+
+def _partition_name(month: datetime) -> str:
+    return f"{_TABLE}_p{month:%Y%m}"
+
+
+_DEFAULT_PARTITION = f"{_TABLE}_default"
+
+
+async def enable_incremental_vacuum(engine: AsyncEngine) -> None:
+    """SQLite: включает ``auto_vacuum=INCREMENTAL`` при запуске, до приёма апдейтов.
+
+    Режим вступает в силу только после полного ``VACUUM``, который блокирует все
+    записи на время перестройки файла, поэтому он выполняется один раз при старте,
+    а не в фоновом обслуживании работающего бота.
+    """
+
+    if engine.dialect.name != "sqlite":
+        return
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if (await conn.execute(text("PRAGMA auto_vacuum"))).scalar() == 2:
+            return
+        logger.info("Включаем auto_vacuum=INCREMENTAL для SQLite (однократный VACUUM)")
+        await conn.execute(text("PRAGMA auto_vacuum=INCREMENTAL"))
+        await conn.execute(text("VACUUM"))
+
+
+async def create_partitioned_context_table(conn: AsyncConnection) -> None:
+    """Создает секционированную по времени ``context_history`` (только PostgreSQL).
+
+    Вызывается до ``create_all``: существующую таблицу SQLAlchemy не пересоздаёт.
+    Первичный ключ включает ``timestamp``, как того требует PostgreSQL.
+    """
+
+    await conn.execute(text(_PARTITIONED_DDL))
+    await conn.execute(
+        text(f"CREATE INDEX IF NOT EXISTS ix_{_TABLE}_user_id ON {_TABLE} (user_id)")
+    )
+    await conn.execute(
+        text(f"CREATE TABLE IF NOT EXISTS {_DEFAULT_PARTITION} PARTITION OF {_TABLE} DEFAULT")
+    )
+
+
+class ContextMaintenance:
+    """Периодически чистит ``context_history``.
+
+    - удаляет историю пользователей, не писавших дольше ``ttl_days``;
+    - одним запросом обрезает историю каждого пользователя до ``max_rows_per_user``;
+    - SQLite: ``incremental_vacuum`` и ``PRAGMA optimize``, чтобы файл уменьшался
+      (режим включает ``enable_incremental_vacuum`` при запуске);
+    - PostgreSQL с секционированием: создаёт месячные секции и удаляет устаревшие
+      целиком вместо построчного удаления; строки секции по умолчанию удаляются
+      построчно по тому же сроку.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        ttl_days: int,
+        max_rows_per_user: int,
+        interval_seconds: int,
+        partitioning: bool = False,
+    ):
+        self.engine = engine
+        self.ttl_days = ttl_days
+        self.max_rows_per_user = max_rows_per_user
+        self.interval_seconds = interval_seconds
+        self.partitioning = partitioning
+
+    async def run_forever(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as exc:  # pragma: no cover - обслуживание не должно ронять бота
+                logger.exception("Ошибка обслуживания context_history", exc_info=exc)
+            await asyncio.sleep(self.interval_seconds)
+
+    async def run_once(self) -> None:
+        dialect = self.engine.dialect.name
+        cutoff = datetime.utcnow() - timedelta(days=self.ttl_days)
+
+        async with self.engine.begin() as conn:
+            partitioned = dialect == "postgresql" and await self._is_partitioned(conn)
+            if partitioned:
+                dropped = await self._rotate_partitions(conn, cutoff)
+                expired = await self._expire_default_partition(conn, cutoff)
+            else:
+                expired = await self._expire_idle(conn, cutoff)
+                dropped = 0
+            capped = await self._cap_per_user(conn)
+
+        logger.info(
+            "Обслуживание context_history: удалено неактивных %s, сверх лимита %s, секций %s",
+            expired,
+            capped,
+            dropped,
+        )
+        await self._compact(dialect)
+
+    async def _expire_idle(self, conn: AsyncConnection, cutoff: datetime) -> int:
+        idle_users = (
+            select(ContextMessage.user_id)
+            .group_by(ContextMessage.user_id)
+            .having(func.max(ContextMessage.timestamp) < cutoff)
+            .subquery()
+        )
+        result = await conn.execute(
+            delete(ContextMessage).where(
+                ContextMessage.user_id.in_(select(idle_users.c.user_id))
+            )
+        )
+        return result.rowcount or 0
+
+    async def _cap_per_user(self, conn: AsyncConnection) -> int:
+        ranked = select(
+            ContextMessage.id,
+            func.row_number()
+            .over(partition_by=ContextMessage.user_id, order_by=ContextMessage.id.desc())
+            .label("rn"),
+        ).subquery()
+        result = await conn.execute(
+            delete(ContextMessage).where(
+                ContextMessage.id.in_(
+                    select(ranked.c.id).where(ranked.c.rn > self.max_rows_per_user)
+                )
+            )
+        )
+        return result.rowcount or 0
+
+    async def _compact(self, dialect: str) -> None:
+        # VACUUM/ANALYZE нельзя выполнять внутри транзакции.
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            if dialect == "sqlite":
+                mode = (await conn.execute(text("PRAGMA auto_vacuum"))).scalar()
+                # Без INCREMENTAL (его включает только запуск) pragma ничего не освобождает.
+                if mode == 2:
+                    await conn.execute(text(f"PRAGMA incremental_vacuum({_VACUUM_PAGES})"))
+                await conn.execute(text("PRAGMA optimize"))
+            elif dialect == "postgresql":
+                await conn.execute(text(f"ANALYZE {_TABLE}"))
+            else:
+                await conn.execute(text(f"ANALYZE TABLE {_TABLE}"))
+
+    async def _is_partitioned(self, conn: AsyncConnection) -> bool:
+        if not self.partitioning:
+            return False
+        result = await conn.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table p "
+                "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :name"
+            ),
+            {"name": _TABLE},
+        )
+        if result.first() is None:
+            logger.warning(
+                "CONTEXT_PARTITIONING включено, но %s не секционирована; "
+                "используется построчное удаление",
+                _TABLE,
+            )
+            return False
+        return True
+
+    async def _rotate_partitions(self, conn: AsyncConnection, cutoff: datetime) -> int:
+        """Создает секции на текущий и следующий месяц, удаляет полностью устаревшие."""
+
+        current = _month_start(datetime.utcnow())
+        for month in (current, _next_month(current)):
+            await self._create_partition(conn, month)
+
+        result = await conn.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :name"
+            ),
+            {"name": _TABLE},
+        )
+        dropped = 0
+        prefix = f"{_TABLE}_p"
+        for (name,) in result.all():
+            if not name.startswith(prefix):
+                continue
+            try:
+                month = datetime.strptime(name[len(prefix):], "%Y%m")
+            except ValueError:
+                continue
+            if _next_month(month) <= cutoff:
+                await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                dropped += 1
+        return dropped
+
+    async def _create_partition(self, conn: AsyncConnection, month: datetime) -> None:
+        """Создает секцию месяца, перенося в неё строки этого месяца из секции DEFAULT.
+
+        ``CREATE TABLE ... PARTITION OF`` не выполняется, если в DEFAULT уже есть строки
+        из диапазона (пропущенная ротация, включение секционирования на живых данных).
+        Поэтому секция создаётся отдельной таблицей, строки переносятся в неё и она
+        подключается через ``ATTACH PARTITION`` — всё в одной транзакции.
+        """
+
+        name = _partition_name(month)
+        exists = await conn.scalar(text("SELECT to_regclass(:name)"), {"name": name})
+        if exists is not None:
+            return
+        bounds = {"start": month, "end": _next_month(month)}
+        await conn.execute(
+            text(f"CREATE TABLE {name} (LIKE {_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        )
+        moved = await conn.execute(
+            text(
+                f"WITH moved AS (DELETE FROM {_DEFAULT_PARTITION} "
+                "WHERE timestamp >= :start AND timestamp < :end RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved"
+            ),
+            bounds,
+        )
+        await conn.execute(
+            text(
+                f"ALTER TABLE {_TABLE} ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_next_month(month):%Y-%m-%d}')"
+            )
+        )
+        if moved.rowcount:
+            logger.info("Секция %s: перенесено строк из DEFAULT %s", name, moved.rowcount)
+
+    async def _expire_default_partition(self, conn: AsyncConnection, cutoff: datetime) -> int:
+        # Строки вне месячных секций не удаляются вместе с ними: срок хранения построчно.
+        result = await conn.execute(
+            text(f"DELETE FROM {_DEFAULT_PARTITION} WHERE timestamp < :cutoff"),
+            {"cutoff": cutoff},
+        )
+        return result.rowcount or 0
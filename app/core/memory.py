@@ -0,0 +1,267 @@
+"""Учёт памяти, которую занимают структуры внутри процесса.
+
+Подсистемы с растущим состоянием (счётчики rate limit, FSM в памяти, очереди,
+кэши писем, метрики) регистрируют функцию-отчёт::
+
+    memory.register("ratelimit", backend.memory_usage)
+
+Отчёт возвращает ``MemoryUsage`` — число элементов и примерный размер в байтах
+(``estimate_size``) — или ``None``, если данных в процессе нет. ``MemoryMonitor``
+периодически пишет сводку в лог вместе с RSS процесса и приростом с прошлой
+сводки, а при превышении порога предупреждает администраторов: утечка видна
+раньше, чем контейнер убьёт OOM killer. Порог по умолчанию сравнивается с памятью
+всего контейнера (cgroup), а не с RSS одного воркера: лимит общий для всех
+процессов.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass
+from itertools import islice
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Из больших контейнеров оценивается столько элементов, остальное экстраполируется.
+SAMPLE_ITEMS = 64
+# Атрибуты объекта лежат в его __dict__, поэтому каждый объект — два уровня обхода.
+MAX_DEPTH = 10
+_ATOMIC = (str, bytes, bytearray, int, float, complex, bool, type(None))
+# Общие для всего процесса объекты: их размер не относится ни к одной подсистеме.
+_SHARED = (
+    type,
+    ModuleType,
+    FunctionType,
+    BuiltinFunctionType,
+    MethodType,
+    asyncio.AbstractEventLoop,
+    logging.Logger,
+)
+
+
+@dataclass
+class MemoryUsage:
+    items: int = 0
+    bytes: int = 0
+
+
+Reporter = Callable[[], Optional[MemoryUsage]]
+
+
+def estimate_size(obj: object, sample: int = SAMPLE_ITEMS, depth: int = MAX_DEPTH) -> int:
+    """Примерный размер объекта вместе с вложенными объектами, байт.
+
+    Обходит контейнеры, ``__dict__`` и ``__slots__`` не глубже ``depth`` уровней. Из
+    контейнера длиннее ``sample`` измеряются первые ``sample`` элементов, а их размер
+    масштабируется на весь контейнер, поэтому оценка дешёвая и для больших словарей.
+    Объект, на который ссылаются несколько раз, учитывается один раз.
+    """
+
+    seen: Set[int] = set()
+
+    def size(value: object, level: int) -> float:
+        if id(value) in seen or isinstance(value, _SHARED):
+            return 0
+        seen.add(id(value))
+        total = float(sys.getsizeof(value, 0))
+        if level >= depth or isinstance(value, _ATOMIC):
+            return total
+        children: Iterable[Any]
+        if isinstance(value, dict):
+            count = len(value)
+            children = (part for pair in islice(value.items(), sample) for part in pair)
+        elif isinstance(value, (list, tuple, set, frozenset, deque)):
+            count = len(value)
+            children = islice(value, sample)
+        else:
+            count = 0
+            attributes = [getattr(value, "__dict__", None)]
+            for cls in type(value).__mro__:
+                for slot in getattr(cls, "__slots__", ()):
+                    attributes.append(getattr(value, slot, None))
+            children = attributes
+        nested = sum(size(child, level + 1) for child in children if child is not None)
+        if count > sample:
+            nested *= count / sample
+        return total + nested
+
+    return int(size(obj, 0))
+
+
+def resident_bytes() -> Optional[int]:
+    """Текущий RSS процесса (Linux) или ``None``, если узнать его нельзя."""
+
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _read_cgroup(*paths: str) -> Optional[str]:
+    # Первый существующий файл: cgroup v2, затем v1.
+    for path in paths:
+        try:
+            with open(path) as cgroup_file:
+                return cgroup_file.read().strip()
+        except OSError:
+            continue
+    return None
+
+
+def container_limit() -> Optional[int]:
+    """Лимит памяти cgroup (v2 или v1), если он задан."""
+
+    value = _read_cgroup(
+        "/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"
+    )
+    # «max» в v2 и огромное число в v1 означают отсутствие лимита.
+    if value is not None and value.isdigit() and int(value) < 1 << 60:
+        return int(value)
+    return None
+
+
+def container_usage() -> Optional[int]:
+    """Память, занятая всеми процессами cgroup (v2 или v1), если её можно узнать."""
+
+    value = _read_cgroup(
+        "/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory/memory.usage_in_bytes"
+    )
+    return int(value) if value is not None and value.isdigit() else None
+
+
+def _format_bytes(value: float) -> str:
+    for unit in ("Б", "КБ", "МБ"):
+        if abs(value) < 1024:
+            return f"{value:.0f} {unit}" if unit == "Б" else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} ГБ"
+
+
+class MemoryRegistry:
+    """Функции-отчёты подсистем по именам."""
+
+    def __init__(self) -> None:
+        self._reporters: Dict[str, Reporter] = {}
+
+    def register(self, name: str, reporter: Reporter) -> None:
+        self._reporters[name] = reporter
+
+    def snapshot(self) -> Dict[str, MemoryUsage]:
+        """Текущие отчёты; подсистемы без данных в процессе пропускаются."""
+
+        usage: Dict[str, MemoryUsage] = {}
+        for name, reporter in self._reporters.items():
+            try:
+                report = reporter()
+            except Exception as exc:  # pragma: no cover - сбой отчёта не ломает остальные
+                logger.warning("Отчёт о памяти %s завершился ошибкой: %s", name, exc)
+                continue
+            if report is not None:
+                usage[name] = report
+        return usage
+
+
+def _tasks_usage() -> MemoryUsage:
+    # Незавершённые задачи: растущее число — задачи, которые никто не дожидается.
+    tasks = asyncio.all_tasks()
+    return MemoryUsage(len(tasks), estimate_size(tasks, depth=1))
+
+
+memory = MemoryRegistry()
+memory.register("asyncio_tasks", _tasks_usage)
+
+
+def format_report(
+    usage: Dict[str, MemoryUsage], previous: Optional[Dict[str, MemoryUsage]] = None
+) -> str:
+    """Строки «подсистема: элементы, байты» по убыванию размера, с приростом."""
+
+    rss = resident_bytes()
+    limit = container_limit()
+    header = f"RSS: {_format_bytes(rss)}" if rss is not None else "RSS: неизвестно"
+    if limit is not None:
+        used = container_usage()
+        used_text = _format_bytes(used) if used is not None else "неизвестно"
+        header += f", контейнер: {used_text} из {_format_bytes(limit)}"
+    lines = [header]
+    for name, report in sorted(usage.items(), key=lambda item: item[1].bytes, reverse=True):
+        line = f"{name}: {report.items} шт., ~{_format_bytes(report.bytes)}"
+        before = (previous or {}).get(name)
+        if before is not None and (before.items, before.bytes) != (report.items, report.bytes):
+            line += (
+                f" ({report.items - before.items:+} шт., "
+                f"{'+' if report.bytes >= before.bytes else '-'}"
+                f"{_format_bytes(abs(report.bytes - before.bytes))})"
+            )
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class MemoryMonitor:
+    """Периодическая сводка по памяти и предупреждение при превышении порога.
+
+    ``alert_bytes`` — порог RSS этого процесса. ``None`` — 90% лимита контейнера,
+    который сравнивается с памятью всего контейнера (``container_usage``): у
+    нескольких воркеров RSS каждого до общего лимита не дорос бы. Такую проверку
+    ведёт один процесс (``watch_container``), иначе предупреждение пришло бы от
+    каждого воркера. ``notify`` получает текст предупреждения (например, рассылка
+    администраторам); повторно оно отправляется не чаще раза в ``cooldown`` секунд.
+    """
+
+    def __init__(
+        self,
+        registry: MemoryRegistry,
+        interval_seconds: float = 300.0,
+        alert_bytes: Optional[int] = None,
+        notify: Optional[Callable[[str], Awaitable[None]]] = None,
+        cooldown: float = 3600.0,
+        watch_container: bool = True,
+    ):
+        self.registry = registry
+        self.interval_seconds = interval_seconds
+        self.container = alert_bytes is None
+        if alert_bytes is None and watch_container:
+            limit = container_limit()
+            alert_bytes = int(limit * 0.9) if limit is not None else None
+        self.alert_bytes = alert_bytes
+        self.notify = notify
+        self.cooldown = cooldown
+        self._previous: Optional[Dict[str, MemoryUsage]] = None
+        self._alerted_at: Optional[float] = None
+
+    async def run_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.check()
+            except Exception as exc:  # pragma: no cover - сводка не должна останавливать бота
+                logger.warning("Не удалось собрать сводку по памяти: %s", exc)
+
+    async def check(self) -> None:
+        usage = self.registry.snapshot()
+        report = format_report(usage, self._previous)
+        self._previous = usage
+        logger.info("Память:\n%s", report)
+
+        used = container_usage() if self.container else resident_bytes()
+        if self.alert_bytes is None or used is None or used < self.alert_bytes:
+            return
+        now = time.monotonic()
+        if self._alerted_at is not None and now - self._alerted_at < self.cooldown:
+            return
+        self._alerted_at = now
+        scope = "контейнера" if self.container else "процесса"
+        text = f"Память {scope} выше порога {_format_bytes(self.alert_bytes)}.\n{report}"
+        logger.warning(text)
+        if self.notify is not None:
+            try:
+                await self.notify(text)
+            except Exception as exc:  # pragma: no cover - сеть
+                logger.warning("Не удалось отправить предупреждение о памяти: %s", exc)
@@ -0,0 +1,358 @@
+"""Метрики в текстовом формате Prometheus и HTTP-эндпоинт ``/metrics``.
+
+Собственные метрики (счётчики и гистограммы с метками) создаются через
+``metrics.counter``/``metrics.histogram``. Статистика, которую уже ведут другие
+подсистемы (``query_stats``, ``session_stats``, очередь исходящих, реестр модулей,
+кэш анализа писем), не дублируется: её отдают коллекторы — функции, которые при
+каждом запросе ``/metrics`` превращают текущие значения в семейства метрик.
+
+Гистограммы хранятся в миллисекундах (``LatencyHistogram``) и при выводе
+переводятся в секунды, как принято в Prometheus.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+from app.core.memory import MemoryRegistry, MemoryUsage, estimate_size, resident_bytes
+from app.core.sql_stats import LATENCY_BUCKETS_MS, LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+Value = Union[float, LatencyHistogram]
+
+
+def _labels(values: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in values.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+@dataclass
+class MetricFamily:
+    """Метрика с набором значений по меткам. ``kind``: counter, gauge или histogram."""
+
+    name: str
+    kind: str
+    help: str
+    samples: List[Tuple[Labels, Value]] = field(default_factory=list)
+
+    def add(self, value: Value, **labels: object) -> "MetricFamily":
+        self.samples.append((_labels(labels), value))
+        return self
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.samples:
+            if isinstance(value, LatencyHistogram):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS_MS, value.buckets):
+                    cumulative += count
+                    le = f'le="{bound / 1000:g}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(labels, le)} {cumulative}")
+                infinity = _format_labels(labels, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{infinity} {value.count}")
+                total = value.total_ms / 1000
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {total:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {value.count}")
+            else:
+                lines.append(f"{self.name}{_format_labels(labels)} {value:g}")
+        return lines
+
+
+class Counter:
+    def __init__(self, family: MetricFamily):
+        self.family = family
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        key = _labels(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> MetricFamily:
+        return MetricFamily(
+            self.family.name, "counter", self.family.help, list(self._values.items())
+        )
+
+
+class Histogram:
+    def __init__(self, family: MetricFamily):
+        self.family = family
+        self._values: Dict[Labels, LatencyHistogram] = {}
+
+    def observe(self, elapsed_ms: float, **labels: object) -> None:
+        key = _labels(labels)
+        histogram = self._values.get(key)
+        if histogram is None:
+            histogram = self._values[key] = LatencyHistogram()
+        histogram.observe(elapsed_ms)
+
+    @contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe((time.perf_counter() - started) * 1000, **labels)
+
+    def collect(self) -> MetricFamily:
+        return MetricFamily(
+            self.family.name, "histogram", self.family.help, list(self._values.items())
+        )
+
+
+Collector = Callable[[], Iterable[MetricFamily]]
+
+
+class MetricsRegistry:
+    """Собственные метрики процесса и коллекторы чужой статистики."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Union[Counter, Histogram]] = {}
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = Counter(MetricFamily(name, "counter", help))
+        return metric  # type: ignore[return-value]
+
+    def histogram(self, name: str, help: str) -> Histogram:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = Histogram(MetricFamily(name, "histogram", help))
+        return metric  # type: ignore[return-value]
+
+    def register_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def memory_usage(self) -> MemoryUsage:
+        """Наборы меток собственных метрик: каждый новый набор — новая запись."""
+
+        values = [metric._values for metric in self._metrics.values()]
+        return MemoryUsage(sum(len(series) for series in values), estimate_size(values))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect().render())
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as exc:  # pragma: no cover - сбой коллектора не ломает остальные
+                logger.warning("Коллектор метрик %r завершился ошибкой: %s", collector, exc)
+                continue
+            for family in families:
+                lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+handler_latency = metrics.histogram(
+    "bot_handler_duration_seconds", "Длительность обработки события хэндлером"
+)
+handler_errors = metrics.counter(
+    "bot_handler_errors_total", "Исключения, вышедшие из хэндлеров"
+)
+requests_denied = metrics.counter(
+    "bot_requests_denied_total", "Сообщения, отклонённые по ALLOWED_USERS"
+)
+requests_rate_limited = metrics.counter(
+    "bot_requests_rate_limited_total", "Сообщения, отклонённые rate limit"
+)
+llm_latency = metrics.histogram(
+    "bot_llm_request_duration_seconds", "Длительность запросов к LLM по назначению"
+)
+mail_latency = metrics.histogram(
+    "bot_mail_operation_duration_seconds", "Длительность операций с почтовым сервером"
+)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Замеряет длительность хэндлеров с метками ``router`` и ``handler``."""
+
+    async def __call__(self, handler, event, data):  # type: ignore[override]
+        router = data.get("event_router")
+        callback = getattr(data.get("handler"), "callback", None)
+        labels = {
+            "router": getattr(router, "name", None) or "-",
+            "handler": getattr(callback, "__name__", None) or "unknown",
+        }
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(**labels)
+            raise
+        finally:
+            handler_latency.observe((time.perf_counter() - started) * 1000, **labels)
+
+
+def _family(name: str, kind: str, help: str, value: Value, **labels: object) -> MetricFamily:
+    return MetricFamily(name, kind, help).add(value, **labels)
+
+
+def db_metrics() -> Iterable[MetricFamily]:
+    """Коллектор: задержки SQL (все шаблоны вместе), медленные запросы, сессии."""
+
+    from app.core.db import session_stats  # локальный импорт чтобы избежать циклов
+    from app.core.sql_stats import query_stats
+
+    total = LatencyHistogram()
+    for histogram in list(query_stats.histograms.values()):
+        total.count += histogram.count
+        total.total_ms += histogram.total_ms
+        total.max_ms = max(total.max_ms, histogram.max_ms)
+        total.buckets = [a + b for a, b in zip(total.buckets, histogram.buckets)]
+    return [
+        _family("bot_db_query_duration_seconds", "histogram", "Длительность SQL-запросов", total),
+        _family(
+            "bot_db_slow_queries_total",
+            "counter",
+            "Запросы медленнее DB_SLOW_QUERY_MS",
+            query_stats.slow_queries,
+        ),
+        _family(
+            "bot_db_n_plus_one_total",
+            "counter",
+            "Подозрения на N+1",
+            query_stats.n_plus_one_detected,
+        ),
+        _family("bot_db_sessions_total", "counter", "Открытые сессии БД", session_stats.sessions),
+        _family(
+            "bot_db_checkouts_total",
+            "counter",
+            "Выдачи соединений из пула",
+            session_stats.checkouts,
+        ),
+    ]
+
+
+def outbound_metrics(scheduler) -> Collector:
+    """Коллектор очереди исходящих сообщений (``OutboundScheduler``)."""
+
+    def collect() -> Iterable[MetricFamily]:
+        stats = scheduler.stats
+        messages = MetricFamily("bot_outbound_messages_total", "counter", "Исходящие запросы")
+        messages.add(stats.sent, result="sent").add(stats.failed, result="failed")
+        return [
+            messages,
+            _family("bot_outbound_merged_total", "counter", "Склеенные сообщения", stats.merged),
+            _family(
+                "bot_outbound_retries_total", "counter", "Повторы после RetryAfter", stats.retries
+            ),
+            _family(
+                "bot_outbound_queue_depth", "gauge", "Сообщения в очередях", scheduler.queue_depth
+            ),
+            _family(
+                "bot_outbound_delay_seconds",
+                "histogram",
+                "Время от постановки до отправки",
+                stats.latency,
+            ),
+        ]
+
+    return collect
+
+
+def update_metrics(scheduler) -> Collector:
+    """Коллектор планировщика апдейтов (``UpdateScheduler``)."""
+
+    def collect() -> Iterable[MetricFamily]:
+        return [
+            _family(
+                "bot_updates_processed_total",
+                "counter",
+                "Обработанные апдейты",
+                scheduler.stats.processed,
+            ),
+            _family("bot_updates_active", "gauge", "Апдейты в обработке", scheduler.active),
+            _family("bot_updates_queued", "gauge", "Апдейты в ожидании очереди", scheduler.queued),
+            _family(
+                "bot_update_wait_seconds",
+                "histogram",
+                "Ожидание очереди пользователя и воркера",
+                scheduler.stats.wait,
+            ),
+        ]
+
+    return collect
+
+
+def module_metrics(registry) -> Collector:
+    """Коллектор вызовов модулей (``ModuleRegistry.stats``)."""
+
+    def collect() -> Iterable[MetricFamily]:
+        calls = MetricFamily("bot_module_calls_total", "counter", "Вызовы process модулей")
+        errors = MetricFamily("bot_module_errors_total", "counter", "Ошибки и таймауты модулей")
+        active = MetricFamily("bot_module_active", "gauge", "Выполняющиеся вызовы модулей")
+        latency = MetricFamily(
+            "bot_module_duration_seconds", "histogram", "Длительность вызовов модулей"
+        )
+        for name, stats in registry.stats.items():
+            calls.add(stats.calls, module=name)
+            errors.add(stats.errors, module=name)
+            active.add(stats.active, module=name)
+            latency.add(stats.latency, module=name)
+        return [calls, errors, active, latency]
+
+    return collect
+
+
+def memory_metrics(registry: MemoryRegistry) -> Collector:
+    """Коллектор учёта памяти (``app/core/memory.py``) и RSS процесса."""
+
+    def collect() -> Iterable[MetricFamily]:
+        items = MetricFamily("bot_memory_items", "gauge", "Элементы в памяти по подсистемам")
+        size = MetricFamily(
+            "bot_memory_bytes", "gauge", "Оценка памяти подсистем по выборке, байт"
+        )
+        for name, usage in registry.snapshot().items():
+            items.add(usage.items, subsystem=name)
+            size.add(usage.bytes, subsystem=name)
+        families = [items, size]
+        rss = resident_bytes()
+        if rss is not None:
+            families.append(
+                _family("bot_process_resident_bytes", "gauge", "RSS процесса, байт", rss)
+            )
+        return families
+
+    return collect
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Поднимает HTTP-сервер с ``GET /metrics``; остановка — ``runner.cleanup()``."""
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(
+            body=metrics.render().encode(),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, handle_signals=False, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
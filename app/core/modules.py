@@ -1,16 +1,96 @@
 """Плагин-система модулей и их регистрация."""
 from __future__ import annotations
 
+import asyncio
+import importlib
 import logging
+import time
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
 
-from aiogram import Dispatcher
+from aiogram import Bot, Dispatcher, Router
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.memory import MemoryUsage
+from app.core.sql_stats import LatencyHistogram
 from config import Settings
 
 logger = logging.getLogger(__name__)
 
+# Сколько последних вызовов модуля учитывается в скользящей статистике.
+ROLLING_WINDOW = 100
+# Меньше вызовов в окне — доля ошибок ещё не показательна.
+_MIN_ROLLING_CALLS = 10
+# Python-модуль с роутером (``router``) каждого модуля бота. Хэндлеры регистрируются
+# при импорте, поэтому типы апдейтов известны без создания модулей.
+MODULE_ROUTERS = {
+    "ai_core": "app.modules.ai_core.module",
+    "knowledge_base": "app.modules.knowledge_base.handlers",
+    "mail": "app.modules.mail.module",
+}
+
+
+class ModuleUnavailable(Exception):
+    """Модуль не ответил за ``MODULE_TIMEOUT`` секунд."""
+
+
+def module_update_types(settings: Settings, extra: Iterable[Router] = ()) -> List[str]:
+    """Типы апдейтов, которые обрабатывают включённые модули и роутеры ``extra``.
+
+    Нужны процессу приёма в режиме супервизора: модули (пулы процессов, клиенты,
+    подписки) в нём не создаются, импортируются только их роутеры.
+    """
+
+    routers = list(extra)
+    for module_name in settings.enabled_modules:
+        path = MODULE_ROUTERS.get(module_name)
+        if path is None:
+            raise ValueError(f"Неизвестный модуль: {module_name}")
+        routers.append(importlib.import_module(path).router)
+    return sorted({kind for router in routers for kind in router.resolve_used_update_types()})
+
+
+@dataclass
+class ModuleStats:
+    """Нагрузка и задержки вызовов ``process`` одного модуля."""
+
+    concurrency: int
+    active: int = 0
+    calls: int = 0
+    errors: int = 0
+    timeouts: int = 0
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    # (задержка, мс; успешен ли вызов) последних ROLLING_WINDOW вызовов.
+    recent: Deque[Tuple[float, bool]] = field(
+        default_factory=lambda: deque(maxlen=ROLLING_WINDOW)
+    )
+
+    def observe(self, elapsed_ms: float, ok: bool) -> None:
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+        self.latency.observe(elapsed_ms)
+        self.recent.append((elapsed_ms, ok))
+
+    @property
+    def saturated(self) -> bool:
+        return self.active >= self.concurrency
+
+    @property
+    def error_rate(self) -> float:
+        if len(self.recent) < _MIN_ROLLING_CALLS:
+            return 0.0
+        return sum(1 for _, ok in self.recent if not ok) / len(self.recent)
+
+    @property
+    def p95_ms(self) -> float:
+        if not self.recent:
+            return 0.0
+        latencies = sorted(elapsed for elapsed, _ in self.recent)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
 
 class Module(ABC):
     """Базовый класс для модулей.
@@ -18,9 +98,18 @@ class Module(ABC):
     Каждый модуль должен объявлять свои возможности (`get_capabilities`) и реализовать
     бизнес-логику в `process` (используется AI-маршрутизацией) и `initialize` для
     регистрации хэндлеров/подписок.
+
+    Жизненный цикл: `startup` — открыть соединения и запустить фоновые задачи,
+    `warmup` — заранее выполнить то, за что иначе заплатил бы первый запрос,
+    `health` — текущее состояние, `shutdown` — остановить задачи и сбросить буферы.
+    `ModuleRegistry` вызывает их в порядке `depends_on`.
     """
 
     name: str
+    # Модули, которые должны стартовать раньше этого (и остановиться позже).
+    depends_on: Tuple[str, ...] = ()
+    # Ограничивать ли вызовы process семафором и дедлайном реестра.
+    bulkhead: bool = True
 
     def __init__(self, settings: Settings):
         self.settings = settings
@@ -30,13 +119,36 @@ class Module(ABC):
         """Подключает маршруты/хэндлеры модуля."""
 
     @abstractmethod
-    async def process(self, user_id: int, message: str) -> str:
-        """Асинхронная обработка запроса, вызываемая AI-роутером."""
+    async def process(self, user_id: int, message: str, session: AsyncSession) -> str:
+        """Асинхронная обработка запроса, вызываемая AI-роутером.
+
+        ``session`` — сессия текущего апдейта (unit of work); фиксировать её модулю
+        не нужно, достаточно ``flush``.
+        """
 
     @abstractmethod
     def get_capabilities(self) -> List[str]:
         """Список поддерживаемых задач (для AI function-calling)."""
 
+    async def startup(self, bot: Bot, primary: bool) -> None:
+        """Запуск при старте бота. ``primary`` — процесс, ведущий фоновые задачи."""
+
+    async def warmup(self) -> None:
+        """Прогрев после старта; бот в это время уже принимает апдейты."""
+
+    async def health(self) -> Optional[str]:
+        """Описание проблемы или ``None``, если модуль исправен."""
+
+        return None
+
+    def memory_usage(self) -> Optional[MemoryUsage]:
+        """Данные модуля в памяти процесса (кэши, буферы) или ``None``, если их нет."""
+
+        return None
+
+    async def shutdown(self) -> None:
+        """Остановка: вызывается после завершения обработки запросов."""
+
 
 class ModuleRegistry:
     """Регистрирует и хранит модули."""
@@ -45,15 +157,31 @@ class ModuleRegistry:
         self.dispatcher = dispatcher
         self.settings = settings
         self.modules: Dict[str, Module] = {}
+        # Время импорта и инициализации каждого модуля, мс.
+        self.load_times: Dict[str, float] = {}
+        self.stats: Dict[str, ModuleStats] = {}
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._warmup_task: Optional[asyncio.Task] = None
 
     def load_modules(self) -> None:
         """Инициализирует модули согласно конфигурации."""
 
         for module_name in self.settings.enabled_modules:
+            started = time.perf_counter()
             module = self._create_module(module_name)
             module.initialize(self.dispatcher)
             self.modules[module_name] = module
-            logger.info("Модуль '%s' инициализирован", module_name)
+            self.stats[module_name] = ModuleStats(concurrency=self.settings.module_concurrency)
+            self._slots[module_name] = asyncio.Semaphore(self.settings.module_concurrency)
+            self.load_times[module_name] = (time.perf_counter() - started) * 1000
+            logger.info(
+                "Модуль '%s' инициализирован за %.0f мс",
+                module_name,
+                self.load_times[module_name],
+            )
 
     def _create_module(self, module_name: str) -> Module:
         match module_name:
@@ -75,6 +203,174 @@ class ModuleRegistry:
     def get_module(self, name: str) -> Optional[Module]:
         return self.modules.get(name)
 
+    async def process(
+        self, name: str, user_id: int, message: str, session: AsyncSession
+    ) -> str:
+        """Вызывает ``process`` модуля с учётом незавершённых вызовов для остановки.
+
+        Для модулей с ``bulkhead`` одновременно выполняется не больше
+        ``MODULE_CONCURRENCY`` вызовов, а вызов вместе с ожиданием очереди ограничен
+        ``MODULE_TIMEOUT`` секундами (иначе ``ModuleUnavailable``, а незафиксированная
+        работа сессии апдейта откатывается). Медленный модуль не занимает все запросы
+        к AI-ядру.
+        """
+
+        module = self.modules[name]
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            if not module.bulkhead:
+                return await module.process(user_id, message, session)
+            return await self._guarded(name, module, user_id, message, session)
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    async def _guarded(
+        self, name: str, module: Module, user_id: int, message: str, session: AsyncSession
+    ) -> str:
+        stats = self.stats[name]
+        timeout = self.settings.module_timeout
+        deadline = asyncio.timeout(timeout)
+        started = time.perf_counter()
+        ok = False
+        try:
+            async with deadline:
+                async with self._slots[name]:
+                    stats.active += 1
+                    try:
+                        result = await module.process(user_id, message, session)
+                    finally:
+                        stats.active -= 1
+            ok = True
+            return result
+        except TimeoutError:
+            if not deadline.expired():
+                raise
+            stats.timeouts += 1
+            # Вызов мог быть отменён посреди запроса в общей сессии апдейта: откатываем
+            # её, чтобы хэндлер и DbSessionMiddleware продолжили с согласованной сессией.
+            await session.rollback()
+            raise ModuleUnavailable(f"модуль '{name}' не ответил за {timeout:.0f} с") from None
+        finally:
+            stats.observe((time.perf_counter() - started) * 1000, ok)
+
+    def degraded(self, name: str) -> Optional[str]:
+        """Причина не направлять запросы в модуль или ``None``.
+
+        Модуль считается перегруженным, если заняты все его слоты, и неисправным, если
+        среди последних вызовов доля ошибок и таймаутов не ниже ``MODULE_ERROR_RATE``.
+        """
+
+        stats = self.stats.get(name)
+        if stats is None or not self.modules[name].bulkhead:
+            return None
+        if stats.saturated:
+            return "перегружен"
+        if stats.error_rate >= self.settings.module_error_rate:
+            return f"ошибок {stats.error_rate:.0%} за последние вызовы"
+        return None
+
+    def _levels(self) -> List[List[str]]:
+        """Модули по уровням: уровень зависит только от предыдущих."""
+
+        pending = {
+            name: {dep for dep in module.depends_on if dep in self.modules}
+            for name, module in self.modules.items()
+        }
+        levels: List[List[str]] = []
+        done: set = set()
+        while pending:
+            level = [name for name, deps in pending.items() if deps <= done]
+            if not level:
+                raise ValueError(f"Циклическая зависимость модулей: {sorted(pending)}")
+            levels.append(level)
+            done.update(level)
+            for name in level:
+                del pending[name]
+        return levels
+
+    async def startup(self, bot: Bot, primary: bool = True) -> None:
+        """Хук ``dispatcher.startup``: запускает модули и прогрев в фоне.
+
+        Модули одного уровня зависимостей стартуют параллельно. Ошибка старта
+        прерывает запуск бота, ошибка прогрева только логируется.
+        """
+
+        for name, module in self.modules.items():
+            missing = [dep for dep in module.depends_on if dep not in self.modules]
+            if missing:
+                logger.warning("Модуль '%s': зависимости %s не включены", name, missing)
+        for level in self._levels():
+            await asyncio.gather(*(self.modules[name].startup(bot, primary) for name in level))
+        self._warmup_task = asyncio.create_task(self._warmup())
+
+    async def _warmup(self) -> None:
+        for level in self._levels():
+            started = time.perf_counter()
+            results = await asyncio.gather(
+                *(self.modules[name].warmup() for name in level), return_exceptions=True
+            )
+            for name, result in zip(level, results):
+                if isinstance(result, Exception):
+                    logger.warning("Прогрев модуля '%s' не удался: %s", name, result)
+            logger.info(
+                "Прогрев модулей %s: %.0f мс",
+                ", ".join(level),
+                (time.perf_counter() - started) * 1000,
+            )
+
+    async def health(self) -> Dict[str, Optional[str]]:
+        """Состояние модулей: ``None`` — исправен, иначе описание проблемы."""
+
+        names = list(self.modules)
+        results = await asyncio.gather(
+            *(self.modules[name].health() for name in names), return_exceptions=True
+        )
+        return {
+            name: f"ошибка проверки: {result}" if isinstance(result, Exception) else result
+            for name, result in zip(names, results)
+        }
+
+    async def shutdown(self) -> None:
+        """Хук ``dispatcher.shutdown``: ждёт незавершённые вызовы и останавливает модули.
+
+        Вызовы ``process`` ждут не дольше ``MODULE_DRAIN_TIMEOUT`` секунд; модули
+        останавливаются в порядке, обратном запуску.
+        """
+
+        if self._warmup_task is not None:
+            self._warmup_task.cancel()
+        if self._in_flight:
+            logger.info("Ожидание %s незавершённых запросов к модулям", self._in_flight)
+            try:
+                await asyncio.wait_for(self._idle.wait(), self.settings.module_drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(
+                    "Модули останавливаются с %s незавершёнными запросами", self._in_flight
+                )
+        for level in reversed(self._levels()):
+            results = await asyncio.gather(
+                *(self.modules[name].shutdown() for name in level), return_exceptions=True
+            )
+            for name, result in zip(level, results):
+                if isinstance(result, Exception):
+                    logger.exception("Ошибка остановки модуля '%s'", name, exc_info=result)
+        for name, stats in self.stats.items():
+            if stats.calls:
+                logger.info(
+                    "Модуль '%s': вызовов %s, ошибок %s (таймаутов %s), сред. %.0f мс, "
+                    "p95 %.0f мс, макс. %.0f мс",
+                    name,
+                    stats.calls,
+                    stats.errors,
+                    stats.timeouts,
+                    stats.latency.avg_ms,
+                    stats.p95_ms,
+                    stats.latency.max_ms,
+                )
+
     def get_capabilities_map(self) -> Dict[str, List[str]]:
         return {name: module.get_capabilities() for name, module in self.modules.items()}
 
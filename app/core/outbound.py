@@ -0,0 +1,253 @@
+"""Очередь исходящих сообщений с учётом лимитов Telegram.
+
+``OutboundScheduler`` подключается как request-middleware сессии бота, поэтому
+хэндлеры по-прежнему вызывают ``message.answer`` — все ``send*``-запросы
+проходят через планировщик:
+
+- у каждого чата своя очередь, сообщения уходят по порядку не чаще
+  ``chat_interval`` (в группах — ``group_interval``) секунд;
+- общий поток ограничен ``global_rate`` сообщений в секунду (token bucket);
+- подряд стоящие короткие ``SendMessage`` в один чат склеиваются в одно сообщение,
+  если их отправил один и тот же апдейт (``OutboundScopeMiddleware``). Сообщения
+  разных апдейтов и фоновых задач (уведомления о почте) не склеиваются: каждый
+  отправитель получает объект сообщения, которое он может изменить или удалить;
+- на ``TelegramRetryAfter`` отправка повторяется через указанную сервером паузу.
+
+Глубина очереди и задержка от постановки до отправки доступны в ``stats``.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    SendAnimation,
+    SendAudio,
+    SendDocument,
+    SendMessage,
+    SendPhoto,
+    SendVideo,
+    SendVoice,
+    TelegramMethod,
+)
+
+from app.core.memory import MemoryUsage, estimate_size
+from app.core.sql_stats import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_TEXT_LIMIT = 4096
+_QUEUED_METHODS = (
+    SendMessage,
+    SendDocument,
+    SendPhoto,
+    SendAudio,
+    SendVideo,
+    SendVoice,
+    SendAnimation,
+)
+# Апдейт, в обработке которого поставлено сообщение; ``None`` — фоновая задача.
+_update_scope: ContextVar[Optional[object]] = ContextVar("outbound_update_scope", default=None)
+
+
+@dataclass
+class OutboundStats:
+    sent: int = 0
+    merged: int = 0
+    retries: int = 0
+    failed: int = 0
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+
+@dataclass
+class _Job:
+    bot: Bot
+    method: TelegramMethod
+    make_request: NextRequestMiddlewareType
+    future: asyncio.Future
+    enqueued_at: float
+    scope: Optional[object] = None
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class OutboundScopeMiddleware(BaseMiddleware):
+    """Outer-middleware апдейта: помечает его сообщения для склейки в ``OutboundScheduler``."""
+
+    async def __call__(self, handler, event, data):  # type: ignore[override]
+        token = _update_scope.set(object())
+        try:
+            return await handler(event, data)
+        finally:
+            _update_scope.reset(token)
+
+
+def _mergeable(first_job: _Job, second_job: _Job) -> bool:
+    # Склейка — только в пределах одного апдейта: иначе два отправителя получили бы
+    # один объект сообщения, и правка или удаление «своего» задели бы чужой текст.
+    if first_job.scope is None or first_job.scope is not second_job.scope:
+        return False
+    first, second = first_job.method, second_job.method
+    if not (isinstance(first, SendMessage) and isinstance(second, SendMessage)):
+        return False
+    # Клавиатура первого сообщения и ответ второго на конкретное сообщение
+    # при склейке потерялись бы.
+    if first.reply_markup is not None or first.entities or second.entities:
+        return False
+    if second.reply_parameters is not None or second.reply_to_message_id is not None:
+        return False
+    return (
+        first.parse_mode == second.parse_mode
+        and first.message_thread_id == second.message_thread_id
+        and first.disable_notification == second.disable_notification
+        and len(first.text) + len(second.text) + 1 <= TELEGRAM_TEXT_LIMIT
+    )
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Планировщик отправки: per-chat очереди, общий лимит, склейка и повторы."""
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_interval: float = 1.0,
+        group_interval: float = 3.0,
+        max_retries: int = 3,
+    ):
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.max_retries = max_retries
+        self.stats = OutboundStats()
+        self._bucket = _TokenBucket(global_rate, burst=global_rate)
+        self._queues: Dict[Any, Deque[_Job]] = {}
+        self._workers: Dict[Any, asyncio.Task] = {}
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def memory_usage(self) -> MemoryUsage:
+        # Учитываются сами запросы: бот и future в задании общие или служебные.
+        methods = [job.method for queue in self._queues.values() for job in queue]
+        return MemoryUsage(len(methods), estimate_size(methods))
+
+    async def __call__(
+        self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod
+    ) -> Any:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not isinstance(method, _QUEUED_METHODS):
+            return await make_request(bot, method)
+        job = _Job(
+            bot,
+            method,
+            make_request,
+            asyncio.get_running_loop().create_future(),
+            time.monotonic(),
+            _update_scope.get(),
+        )
+        self._queues.setdefault(chat_id, deque()).append(job)
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return await job.future
+
+    async def _drain(self, chat_id: Any) -> None:
+        interval = self.group_interval if str(chat_id).startswith("-") else self.chat_interval
+        queue = self._queues[chat_id]
+        batch: List[_Job] = []
+        try:
+            while queue:
+                batch = [queue.popleft()]
+                while queue and _mergeable(batch[-1], queue[0]):
+                    batch.append(queue.popleft())
+                await self._send(batch)
+                # Пауза и после последнего сообщения: новое не уйдёт раньше интервала.
+                await asyncio.sleep(interval)
+        finally:
+            del self._workers[chat_id]
+            del self._queues[chat_id]
+            # Воркер отменён при остановке — ожидающим отправителям сообщаем об отмене.
+            for job in [*batch, *queue]:
+                if not job.future.done():
+                    job.future.cancel()
+
+    async def _send(self, batch: List[_Job]) -> None:
+        first = batch[0]
+        method = first.method
+        if len(batch) > 1:
+            method = method.model_copy(
+                update={
+                    "text": "\n".join(job.method.text for job in batch),  # type: ignore[attr-defined]
+                    "reply_markup": batch[-1].method.reply_markup,  # type: ignore[attr-defined]
+                }
+            )
+            self.stats.merged += len(batch) - 1
+        result: Any = None
+        error: Optional[BaseException] = None
+        for attempt in range(self.max_retries + 1):
+            await self._bucket.acquire()
+            try:
+                result = await first.make_request(first.bot, method)
+                error = None
+                break
+            except TelegramRetryAfter as exc:
+                error = exc
+                if attempt == self.max_retries:
+                    break
+                self.stats.retries += 1
+                logger.warning(
+                    "Flood control для чата %s: повтор через %s с", method.chat_id, exc.retry_after
+                )
+                await asyncio.sleep(exc.retry_after)
+            except Exception as exc:
+                error = exc
+                break
+        now = time.monotonic()
+        for job in batch:
+            self.stats.latency.observe((now - job.enqueued_at) * 1000)
+            if job.future.done():
+                continue
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+        if error is not None:
+            self.stats.failed += 1
+        else:
+            self.stats.sent += 1
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Ждёт отправки поставленных сообщений, затем отменяет оставшиеся."""
+
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        _, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
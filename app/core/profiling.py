@@ -0,0 +1,197 @@
+"""Профилирование работающего бота по запросу администратора.
+
+Три режима, каждый включается на заданное число секунд и возвращает текстовый отчёт:
+
+- ``cpu`` — ``cProfile`` по всем корутинам event loop (они выполняются в одном потоке),
+  топ функций по накопленному и собственному времени;
+- ``sample`` — сэмплирующий профилировщик: отдельный поток раз в ``SAMPLE_INTERVAL``
+  секунд снимает стек потока event loop. Замедляет бота заметно меньше cProfile,
+  поэтому подходит для продакшена; время простоя loop попадает в ``selectors``;
+- ``mem`` — разница двух снимков ``tracemalloc``: где за это время выделена память.
+
+Пока профилирование не запущено, ничего не работает: нет хуков трассировки,
+потоков и учёта аллокаций. Одновременно выполняется только одно профилирование.
+"""
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import io
+import linecache
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Tuple
+
+TOP = 40
+SAMPLE_INTERVAL = 0.005
+# Поток сэмплера ждёт GIL до sys.getswitchinterval() (5 мс): без уменьшения интервала
+# сэмпл почти всегда попадал бы на момент, когда loop сам отпускает GIL в select.
+SAMPLE_SWITCH_INTERVAL = 0.0005
+TRACEMALLOC_FRAMES = 10
+
+Location = Tuple[str, int, str]
+
+
+class ProfilerBusy(RuntimeError):
+    """Другое профилирование ещё не завершено."""
+
+
+class StackSampler:
+    """Периодически снимает стек одного потока и считает функции в нём."""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        # Функция на вершине стека (собственное время) и где-либо в стеке (накопленное).
+        self.own: Counter[Location] = Counter()
+        self.total: Counter[Location] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._switch_interval: float = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, SAMPLE_SWITCH_INTERVAL))
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def _run(self) -> None:
+        # Случайный разброс интервала: сэмплы не синхронизируются с периодичной работой.
+        while not self._stop.wait(self.interval * random.uniform(0.5, 1.5)):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            seen = set()
+            top = True
+            while frame is not None:
+                code = frame.f_code
+                location = (code.co_filename, code.co_firstlineno, code.co_name)
+                if top:
+                    self.own[location] += 1
+                    top = False
+                # Рекурсивная функция учитывается в сэмпле один раз.
+                if location not in seen:
+                    seen.add(location)
+                    self.total[location] += 1
+                frame = frame.f_back
+
+    def report(self, limit: int = TOP) -> str:
+        lines = [f"Сэмплов: {self.samples} (интервал {self.interval * 1000:g} мс)", ""]
+        for title, counts in (("Собственное время", self.own), ("Накопленное время", self.total)):
+            lines.append(f"{title}:")
+            lines.append(f"{'доля':>7} {'сэмплов':>8}  функция")
+            for (filename, lineno, name), count in counts.most_common(limit):
+                share = count / self.samples * 100 if self.samples else 0.0
+                lines.append(f"{share:6.1f}% {count:8}  {name} ({filename}:{lineno})")
+            lines.append("")
+        return "\n".join(lines)
+
+
+async def _profile_cpu(seconds: float) -> str:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(TOP)
+    return out.getvalue()
+
+
+async def _profile_sample(seconds: float) -> str:
+    # Корутина выполняется в потоке event loop — его стек и сэмплируется.
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        sampler.stop()
+    return sampler.report()
+
+
+def _memory_report(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot) -> str:
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, linecache.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ]
+    before = before.filter_traces(filters)
+    after = after.filter_traces(filters)
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [
+        f"Отслеживается: {current / 1024:.1f} КБ, пик {peak / 1024:.1f} КБ",
+        "",
+        "Прирост по строкам:",
+    ]
+    for stat in after.compare_to(before, "lineno")[:TOP]:
+        lines.append(str(stat))
+    lines.extend(["", "Крупнейшие источники прироста (стек):"])
+    for stat in after.compare_to(before, "traceback")[:5]:
+        lines.append("")
+        lines.append(f"{stat.size_diff / 1024:+.1f} КБ, {stat.count_diff:+} блоков")
+        lines.extend(stat.traceback.format())
+    return "\n".join(lines)
+
+
+async def _profile_memory(seconds: float) -> str:
+    # Если tracemalloc уже включён (PYTHONTRACEMALLOC), его не выключаем.
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    try:
+        # Снимок и сравнение тяжёлые при большом числе аллокаций — не в потоке loop.
+        before = await asyncio.to_thread(tracemalloc.take_snapshot)
+        await asyncio.sleep(seconds)
+        after = await asyncio.to_thread(tracemalloc.take_snapshot)
+        return await asyncio.to_thread(_memory_report, before, after)
+    finally:
+        if started_here:
+            tracemalloc.stop()
+
+
+PROFILERS = {
+    "cpu": _profile_cpu,
+    "sample": _profile_sample,
+    "mem": _profile_memory,
+}
+
+_running = False
+
+
+def busy() -> bool:
+    return _running
+
+
+async def run_profile(mode: str, seconds: float) -> str:
+    """Профилирует процесс ``seconds`` секунд и возвращает отчёт.
+
+    Бросает ``ProfilerBusy``, если профилирование уже идёт, и ``ValueError``
+    для неизвестного режима.
+    """
+
+    global _running
+    profiler = PROFILERS.get(mode)
+    if profiler is None:
+        raise ValueError(f"Неизвестный режим профилирования: {mode}")
+    if _running:
+        raise ProfilerBusy("Профилирование уже выполняется")
+    _running = True
+    started = time.strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        body = await profiler(seconds)
+    finally:
+        _running = False
+    return f"Профилирование {mode}, {seconds:g} с, начато {started}\n\n{body}"
@@ -0,0 +1,143 @@
+"""Ограничение частоты запросов: скользящее окно со счётчиками.
+
+Вместо списка отметок времени на каждый ключ хранятся два счётчика — текущего и
+предыдущего окна. Оценка числа запросов за последние ``window`` секунд:
+``previous * (1 - elapsed / window) + current``. Память на активный ключ
+постоянна, неактивные ключи удаляются.
+
+Бэкенды:
+
+- ``memory`` — счётчики в процессе (один экземпляр бота);
+- ``redis`` — счётчики в Redis (или совместимом сервере), лимит общий для всех
+  реплик. Проверка и инкремент выполняются одним Lua-скриптом атомарно.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from app.core.memory import MemoryUsage, estimate_size
+
+logger = logging.getLogger(__name__)
+
+
+def _weighted(previous: int, current: int, elapsed: float, window: float) -> float:
+    return previous * max(0.0, 1.0 - elapsed / window) + current
+
+
+class RateLimitBackend(ABC):
+    """Хранилище счётчиков скользящего окна."""
+
+    @abstractmethod
+    async def hit(self, key: str, limit: int, window: float) -> bool:
+        """Учитывает запрос; ``False``, если лимит за окно уже исчерпан."""
+
+    async def close(self) -> None:
+        return None
+
+    def memory_usage(self) -> Optional[MemoryUsage]:
+        """Счётчики в памяти процесса; ``None``, если они хранятся снаружи."""
+
+        return None
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """Счётчики в памяти процесса.
+
+    На ключ хранится кортеж (начало окна, счётчик предыдущего окна, счётчик
+    текущего). Ключи без запросов дольше двух окон удаляются при периодическом
+    проходе, поэтому память ограничена числом активных пользователей.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._buckets: Dict[str, List[float]] = {}
+        self._next_sweep = 0.0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def memory_usage(self) -> Optional[MemoryUsage]:
+        return MemoryUsage(len(self._buckets), estimate_size(self._buckets))
+
+    async def hit(self, key: str, limit: int, window: float) -> bool:
+        now = self._clock()
+        self._sweep(now, window)
+        bucket = self._buckets.get(key)
+        start = now - now % window
+        if bucket is None or bucket[0] < start - window:
+            bucket = [start, 0, 0]
+            self._buckets[key] = bucket
+        elif bucket[0] < start:
+            # Новое окно: текущий счётчик становится предыдущим.
+            bucket[:] = [start, bucket[2], 0]
+        if _weighted(bucket[1], bucket[2], now - start, window) >= limit:
+            return False
+        bucket[2] += 1
+        return True
+
+    def _sweep(self, now: float, window: float) -> None:
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + window
+        stale = now - 2 * window
+        for key in [key for key, bucket in self._buckets.items() if bucket[0] < stale]:
+            del self._buckets[key]
+
+
+# KEYS[1] — счётчик текущего окна, KEYS[2] — предыдущего.
+# ARGV: лимит, вес предыдущего окна, TTL ключа в мс.
+_HIT_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if previous * tonumber(ARGV[2]) + current >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """Счётчики в Redis: лимит соблюдается для всех реплик бота.
+
+    Ключи ``<prefix>:<key>:<номер окна>`` живут два окна и удаляются самим
+    Redis, так что отдельная очистка не нужна.
+    """
+
+    def __init__(self, url: str, prefix: str = "ratelimit", clock=time.time):
+        from redis.asyncio import Redis  # опциональная зависимость
+
+        self.client = Redis.from_url(url)
+        self.prefix = prefix
+        self._clock = clock
+        self._script = self.client.register_script(_HIT_SCRIPT)
+
+    async def hit(self, key: str, limit: int, window: float) -> bool:
+        now = self._clock()
+        index = int(now // window)
+        weight = max(0.0, 1.0 - (now - index * window) / window)
+        allowed = await self._script(
+            keys=[f"{self.prefix}:{key}:{index}", f"{self.prefix}:{key}:{index - 1}"],
+            args=[limit, weight, int(window * 2000)],
+        )
+        return bool(allowed)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def create_rate_limit_backend(kind: str, redis_url: Optional[str] = None) -> RateLimitBackend:
+    """Бэкенд по настройке ``RATE_LIMIT_BACKEND`` (memory/redis)."""
+
+    kind = kind.lower()
+    if kind == "memory":
+        return MemoryRateLimitBackend()
+    if kind == "redis":
+        if not redis_url:
+            raise ValueError("Для RATE_LIMIT_BACKEND=redis необходимо задать REDIS_URL")
+        return RedisRateLimitBackend(redis_url)
+    raise ValueError(f"Неизвестный RATE_LIMIT_BACKEND: {kind}")
@@ -0,0 +1,125 @@
+"""Планировщик апдейтов: по порядку для одного пользователя, параллельно для разных.
+
+aiogram обрабатывает каждый апдейт отдельной задачей. Без ограничений два
+сообщения одного пользователя могут обрабатываться одновременно и перепутать
+шаги FSM-диалога, а число одновременных хэндлеров ничем не ограничено.
+``UpdateScheduler`` — outer-middleware уровня update:
+
+- апдейты одного пользователя (или чата, если пользователя нет) выстраиваются в
+  очередь и обрабатываются строго по одному в порядке поступления;
+- апдейты разных пользователей обрабатываются параллельно, но одновременно
+  работает не больше ``workers`` хэндлеров.
+
+Апдейт, ожидающий очереди, ещё не открыл сессию БД и не занимает воркер, поэтому
+медленный запрос к LLM одного пользователя задерживает только его собственные
+апдейты.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware
+
+from app.core.memory import MemoryUsage, estimate_size
+from app.core.sql_stats import LatencyHistogram
+
+
+@dataclass
+class SchedulerStats:
+    processed: int = 0
+    # Время от поступления апдейта до начала обработки.
+    wait: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+
+class _Lane:
+    """Очередь одного пользователя: замок и число апдейтов в ней."""
+
+    __slots__ = ("lock", "pending")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class UpdateScheduler(BaseMiddleware):
+    """Последовательная обработка в пределах пользователя, параллельная между ними."""
+
+    def __init__(self, workers: int = 16):
+        self.workers = max(1, workers)
+        self.stats = SchedulerStats()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._lanes: Dict[Hashable, _Lane] = {}
+        self._active = 0
+        self._waiting = 0
+
+    @property
+    def active(self) -> int:
+        """Число апдейтов, обрабатываемых прямо сейчас."""
+
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        """Число апдейтов, ожидающих своей очереди."""
+
+        return self._waiting
+
+    def memory_usage(self) -> MemoryUsage:
+        """Очереди пользователей, у которых есть необработанные апдейты."""
+
+        return MemoryUsage(len(self._lanes), estimate_size(self._lanes))
+
+    @staticmethod
+    def _key(data: Dict[str, Any]) -> Optional[Hashable]:
+        # event_from_user/event_chat заполняет UserContextMiddleware aiogram.
+        user = data.get("event_from_user")
+        if user is not None:
+            return ("user", user.id)
+        chat = data.get("event_chat")
+        if chat is not None:
+            return ("chat", chat.id)
+        return None
+
+    async def __call__(self, handler, event, data):  # type: ignore[override]
+        key = self._key(data)
+        started = time.monotonic()
+        self._waiting += 1
+        admitted = False
+        lane: Optional[_Lane] = None
+        try:
+            if key is not None:
+                lane = self._lanes.get(key)
+                if lane is None:
+                    lane = self._lanes[key] = _Lane()
+                lane.pending += 1
+                # Сначала очередь пользователя, затем воркер: ожидающий своей очереди
+                # апдейт не занимает воркер, нужный другим пользователям.
+                await lane.lock.acquire()
+            try:
+                async with self._slots:
+                    admitted = True
+                    self._waiting -= 1
+                    return await self._run(handler, event, data, started)
+            finally:
+                if lane is not None:
+                    lane.lock.release()
+        finally:
+            # Апдейт, отменённый в очереди (остановка бота), тоже перестаёт ждать.
+            if not admitted:
+                self._waiting -= 1
+            if lane is not None:
+                lane.pending -= 1
+                if not lane.pending:
+                    del self._lanes[key]
+
+    async def _run(self, handler, event, data, started: float) -> Any:
+        self.stats.wait.observe((time.monotonic() - started) * 1000)
+        self._active += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self._active -= 1
+            self.stats.processed += 1
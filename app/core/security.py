@@ -2,33 +2,46 @@
 from __future__ import annotations
 
 import base64
-import time
-from collections import defaultdict
-from typing import DefaultDict, Dict, Iterable, Optional
+import logging
+from typing import TYPE_CHECKING, Iterable, Optional
 
 from aiogram import BaseMiddleware
 from aiogram.types import Message
-from cryptography.fernet import Fernet, InvalidToken
 
+from app.core.db import bind_session, create_session, session_stats
+from app.core.metrics import requests_denied, requests_rate_limited
+from app.core.ratelimit import MemoryRateLimitBackend, RateLimitBackend
+from app.core.sql_stats import query_stats, set_handler_name
 
-def build_fernet(secret: str) -> Optional[Fernet]:
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet
+
+logger = logging.getLogger(__name__)
+
+
+def build_fernet(secret: str) -> Optional["Fernet"]:
     if not secret:
         return None
+    # cryptography импортируется только при заданном FERNET_SECRET.
+    from cryptography.fernet import Fernet
+
     key = secret
     if len(secret) != 44:
         key = base64.urlsafe_b64encode(secret.encode().ljust(32, b"0"))
     return Fernet(key)
 
 
-def encrypt_value(fernet: Optional[Fernet], value: str) -> str:
+def encrypt_value(fernet: Optional["Fernet"], value: str) -> str:
     if fernet is None:
         return value
     return fernet.encrypt(value.encode()).decode()
 
 
-def decrypt_value(fernet: Optional[Fernet], value: str) -> str:
+def decrypt_value(fernet: Optional["Fernet"], value: str) -> str:
     if fernet is None:
         return value
+    from cryptography.fernet import InvalidToken
+
     try:
         return fernet.decrypt(value.encode()).decode()
     except InvalidToken:
@@ -46,26 +59,35 @@ class AccessMiddleware(BaseMiddleware):
             return await handler(event, data)
         if isinstance(event, Message) and event.from_user:
             if event.from_user.id not in self.allowed:
+                requests_denied.inc()
                 await event.answer("Доступ запрещён. Обратитесь к администратору.")
                 return None
         return await handler(event, data)
 
 
 class RateLimitMiddleware(BaseMiddleware):
-    """Простейший rate limiting: ограничение количества сообщений в минуту."""
+    """Ограничение количества сообщений пользователя в минуту.
+
+    Счётчики хранит ``RateLimitBackend``: в памяти процесса или в Redis, если бот
+    запущен в нескольких репликах. При недоступности бэкенда сообщение
+    пропускается — ограничение частоты не должно останавливать бота.
+    """
 
-    def __init__(self, max_per_minute: int):
+    def __init__(self, max_per_minute: int, backend: Optional[RateLimitBackend] = None):
         self.max_per_minute = max_per_minute
-        self._history: DefaultDict[int, list[float]] = defaultdict(list)
+        self.backend = backend or MemoryRateLimitBackend()
 
     async def __call__(self, handler, event, data):  # type: ignore[override]
         if isinstance(event, Message) and event.from_user:
-            user_id = event.from_user.id
-            now = time.time()
-            window = [t for t in self._history[user_id] if now - t < 60]
-            window.append(now)
-            self._history[user_id] = window
-            if len(window) > self.max_per_minute:
+            try:
+                allowed = await self.backend.hit(
+                    f"user:{event.from_user.id}", self.max_per_minute, 60.0
+                )
+            except Exception as exc:
+                logger.warning("Rate limit недоступен, сообщение пропущено: %s", exc)
+                allowed = True
+            if not allowed:
+                requests_rate_limited.inc()
                 await event.answer("Вы отправляете сообщения слишком часто. Подождите минуту.")
                 return None
         return await handler(event, data)
@@ -85,3 +107,52 @@ class ContextInjectorMiddleware(BaseMiddleware):
         data["settings"] = self.settings
         data["registry"] = self.registry
         return await handler(event, data)
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Unit of work: одна сессия БД на апдейт.
+
+    Сессия передаётся хэндлерам как ``session`` и далее в ``Module.process``.
+    Хэндлеры только делают ``flush``; фиксация выполняется один раз после
+    обработки апдейта, при исключении — откат. Подключается outer-middleware перед
+    ``FSMContextMiddleware`` (``create_dispatcher(before_fsm=...)``), чтобы
+    ``SQLStorage`` читал состояние через эту же сессию, а не открывал свою.
+    """
+
+    async def __call__(self, handler, event, data):  # type: ignore[override]
+        with query_stats.track_update():
+            async with create_session() as session:
+                data["session"] = session
+                try:
+                    with bind_session(session):
+                        result = await handler(event, data)
+                except Exception:
+                    await session.rollback()
+                    raise
+                if session.in_transaction():
+                    await session.commit()
+                checkouts = session.info.get("checkouts", 0)
+
+        session_stats.units_of_work += 1
+        if checkouts > 1:
+            session_stats.multi_checkout_units += 1
+            logger.warning("Апдейт использовал %s соединений с БД вместо одного", checkouts)
+        return result
+
+
+def handler_name(data) -> str:
+    """Имя хэндлера вида ``router.function`` для логов и статистики."""
+
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    name = getattr(callback, "__name__", None) or "unknown"
+    router = data.get("event_router")
+    return f"{router.name}.{name}" if router is not None else name
+
+
+class HandlerTagMiddleware(BaseMiddleware):
+    """Привязывает SQL-запросы апдейта к имени обрабатывающего хэндлера."""
+
+    async def __call__(self, handler, event, data):  # type: ignore[override]
+        set_handler_name(handler_name(data))
+        return await handler(event, data)
@@ -0,0 +1,180 @@
+"""Инструментирование SQL: гистограммы задержек, медленные запросы и поиск N+1."""
+from __future__ import annotations
+
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.memory import MemoryUsage, estimate_size
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограммы, мс. Последняя корзина — «больше 2500».
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+_OTHER_KEY = "<прочие запросы>"
+
+_WS_RE = re.compile(r"\s+")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM_RE = re.compile(r"\$\d+|%\(\w+\)s|:\w+|%s")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def normalize_sql(statement: str) -> str:
+    """Приводит запрос к шаблону: литералы и параметры заменяются на ``?``."""
+
+    text = _WS_RE.sub(" ", statement).strip()
+    text = _STRING_RE.sub("?", text)
+    text = _PARAM_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    return _IN_LIST_RE.sub("(?)", text)
+
+
+@dataclass
+class LatencyHistogram:
+    """Гистограмма задержек одного шаблона запроса."""
+
+    buckets: List[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+
+    def observe(self, elapsed_ms: float) -> None:
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        for idx, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[idx] += 1
+                return
+        self.buckets[-1] += 1
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+
+@dataclass
+class UpdateScope:
+    """Запросы, выполненные при обработке одного апдейта."""
+
+    handler: Optional[str] = None
+    statements: Counter = field(default_factory=Counter)
+
+
+_current_scope: ContextVar[Optional[UpdateScope]] = ContextVar("sql_update_scope", default=None)
+
+
+def set_handler_name(name: str) -> None:
+    """Запоминает хэндлер, обрабатывающий текущий апдейт."""
+
+    scope = _current_scope.get()
+    if scope is not None:
+        scope.handler = name
+
+
+class QueryStats:
+    """Собирает статистику SQL через события движка SQLAlchemy."""
+
+    def __init__(
+        self,
+        slow_query_ms: float = 200,
+        n_plus_one_threshold: int = 10,
+        max_statements: int = 500,
+    ):
+        self.slow_query_ms = slow_query_ms
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.max_statements = max_statements
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.slow_queries = 0
+        self.n_plus_one_detected = 0
+
+    def memory_usage(self) -> MemoryUsage:
+        return MemoryUsage(len(self.histograms), estimate_size(self.histograms))
+
+    def configure(self, slow_query_ms: float, n_plus_one_threshold: int) -> None:
+        self.slow_query_ms = slow_query_ms
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+    def attach(self, engine: AsyncEngine) -> None:
+        """Подписывается на выполнение запросов движком."""
+
+        sync_engine = engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", self._before_execute)
+        event.listen(sync_engine, "after_cursor_execute", self._after_execute)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Время старта хранится в контексте выполнения, а не в стеке соединения: если
+        # запрос упал, after_cursor_execute не вызывается, и стек разошёлся бы с запросами.
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_started", None)
+        if started is None:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        key = normalize_sql(statement)
+        self._histogram(key).observe(elapsed_ms)
+
+        scope = _current_scope.get()
+        if scope is not None:
+            scope.statements[key] += 1
+        if elapsed_ms >= self.slow_query_ms:
+            self.slow_queries += 1
+            logger.warning(
+                "Медленный запрос %.1f мс [%s]: %s",
+                elapsed_ms,
+                (scope.handler if scope else None) or "-",
+                key,
+            )
+
+    def _histogram(self, key: str) -> LatencyHistogram:
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            # Ограничиваем число шаблонов, чтобы динамический SQL не раздувал память.
+            if len(self.histograms) >= self.max_statements:
+                key = _OTHER_KEY
+            histogram = self.histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    @contextmanager
+    def track_update(self) -> Iterator[UpdateScope]:
+        """Отслеживает запросы в рамках одного апдейта и ищет N+1."""
+
+        scope = UpdateScope()
+        token = _current_scope.set(scope)
+        try:
+            yield scope
+        finally:
+            _current_scope.reset(token)
+            self._check_repeats(scope)
+
+    def _check_repeats(self, scope: UpdateScope) -> None:
+        for statement, count in scope.statements.items():
+            if count >= self.n_plus_one_threshold:
+                self.n_plus_one_detected += 1
+                logger.warning(
+                    "Возможный N+1 [%s]: запрос выполнен %s раз за апдейт: %s",
+                    scope.handler or "-",
+                    count,
+                    statement,
+                )
+
+    def top(self, limit: int = 10) -> List[tuple[str, LatencyHistogram]]:
+        """Самые «дорогие» шаблоны по суммарному времени."""
+
+        return sorted(
+            self.histograms.items(), key=lambda item: item[1].total_ms, reverse=True
+        )[:limit]
+
+
+query_stats = QueryStats()
@@ -0,0 +1,44 @@
+"""Замер длительности этапов запуска бота.
+
+Итог пишется в лог одной строкой, когда бот готов принимать апдейты, чтобы
+регрессии времени запуска были видны в логах деплоя. Подробный разбор
+импортов — ``python -X importtime main.py``.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Длительности именованных этапов запуска, мс."""
+
+    def __init__(self, started: Optional[float] = None):
+        # ``started`` — отметка ``time.perf_counter()`` до первых импортов.
+        self.started = time.perf_counter() if started is None else started
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, name: str, since: float) -> None:
+        self.phases.append((name, (time.perf_counter() - since) * 1000))
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name, started)
+
+    def report(self) -> str:
+        total = (time.perf_counter() - self.started) * 1000
+        parts = ", ".join(f"{name} {elapsed:.0f} мс" for name, elapsed in self.phases)
+        return f"{parts}; всего {total:.0f} мс"
+
+    async def on_ready(self) -> None:
+        """Хук ``dispatcher.startup``, регистрируемый последним."""
+
+        logger.info("Запуск: %s", self.report())
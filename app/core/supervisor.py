@@ -0,0 +1,406 @@
+"""Режим супервизора: один процесс приёма апдейтов и N процессов-обработчиков.
+
+Процесс приёма (ingress) получает апдейты через polling или webhook и
+пересылает каждый в воркер, выбранный по консистентному хешу id пользователя.
+Все апдейты одного пользователя попадают в один и тот же воркер, поэтому его
+кэши, FSM в памяти и очерёдность обработки остаются локальными для процесса.
+
+Апдейт передаётся по ``multiprocessing.Pipe`` компактным JSON (без ``null``-полей
+и пробелов). Упавший воркер перезапускается с нарастающей паузой; апдейты для
+него ждут в очереди процесса приёма. Если очередь воркера заполнена, новые апдейты
+для него отбрасываются: приём не останавливается ради одного воркера. При остановке процесс приёма перестаёт
+получать апдейты, досылает очереди и закрывает каналы — воркеры дообрабатывают
+начатое и завершаются.
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import signal
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from aiogram import Bot, Dispatcher
+
+from app.core.webhook import WebhookServer
+
+logger = logging.getLogger(__name__)
+
+# Апдейтов в очереди одного воркера; сверх этого апдейты для него отбрасываются.
+QUEUE_SIZE = 1000
+# Воркер, проработавший меньше этого, считается упавшим при старте.
+_MIN_UPTIME = 10.0
+_MAX_RESTART_DELAY = 30.0
+
+
+def encode_update(payload: Dict[str, Any]) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def shard_key(payload: Dict[str, Any]) -> int:
+    """id пользователя (или чата) апдейта в сыром формате Bot API."""
+
+    for name, event in payload.items():
+        if name == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return payload.get("update_id", 0)
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Консистентный хеш: ``replicas`` виртуальных точек на узел."""
+
+    def __init__(self, nodes: List[int], replicas: int = 64):
+        points = sorted(
+            (_hash(f"{node}:{replica}"), node) for node in nodes for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: int) -> int:
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._nodes[index]
+
+
+class _Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.conn: Optional[Connection] = None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.started_at = 0.0
+        self.crashes = 0
+        self.restart_at: Optional[float] = None
+        self.forwarded = 0
+        self.dropped = 0
+        self.shedding = False
+        # Цикл отправки в текущий процесс и апдейт, взятый из очереди, но не доставленный.
+        self.sender: Optional[asyncio.Task] = None
+        self.unsent: Optional[bytes] = None
+
+
+class Supervisor:
+    """Запускает воркеры, распределяет апдейты и перезапускает упавшие процессы.
+
+    ``target(index, conn)`` — точка входа воркера: читает апдейты из ``conn``
+    (см. ``consume_updates``).
+    """
+
+    def __init__(self, workers: int, target: Callable[[int, Connection], None]):
+        self.target = target
+        self.workers = [_Worker(index) for index in range(max(1, workers))]
+        self.ring = HashRing([worker.index for worker in self.workers])
+        self.restarts = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    async def dispatch(self, payload: Dict[str, Any]) -> None:
+        worker = self.workers[self.ring.node_for(shard_key(payload))]
+        # Не ждём места в очереди: упавший или медленный воркер остановил бы приём
+        # апдейтов для всех остальных.
+        try:
+            worker.queue.put_nowait(encode_update(payload))
+        except asyncio.QueueFull:
+            if not worker.shedding:
+                worker.shedding = True
+                logger.warning(
+                    "Очередь воркера %s заполнена (%s), апдейты для него отбрасываются",
+                    worker.index,
+                    QUEUE_SIZE,
+                )
+            worker.dropped += 1
+            return
+        if worker.shedding:
+            worker.shedding = False
+            logger.warning(
+                "Очередь воркера %s снова принимает апдейты, всего отброшено %s",
+                worker.index,
+                worker.dropped,
+            )
+
+    async def start(self) -> None:
+        for worker in self.workers:
+            await self._spawn(worker)
+            self._start_sender(worker)
+        self._tasks.append(asyncio.create_task(self._monitor()))
+
+    async def _spawn(self, worker: _Worker) -> None:
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=self.target, args=(worker.index, reader), name=f"bot-shard-{worker.index}"
+        )
+        # Запуск spawn-процесса (новый интерпретатор, передача аргументов) блокирует —
+        # не в потоке event loop.
+        await asyncio.get_running_loop().run_in_executor(None, process.start)
+        reader.close()
+        worker.process, worker.conn = process, writer
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+
+    def _start_sender(self, worker: _Worker) -> None:
+        if worker.conn is None:
+            return
+        worker.sender = asyncio.create_task(
+            self._send_loop(worker, worker.conn), name=f"shard-send-{worker.index}"
+        )
+
+    async def _stop_sender(self, worker: _Worker) -> None:
+        """Останавливает цикл отправки; после этого канал воркера можно закрыть."""
+
+        if worker.sender is None:
+            return
+        worker.sender.cancel()
+        await asyncio.gather(worker.sender, return_exceptions=True)
+        worker.sender = None
+
+    async def _send_loop(self, worker: _Worker, conn: Connection) -> None:
+        # Цикл обслуживает канал одного процесса и останавливается до его закрытия.
+        loop = asyncio.get_running_loop()
+        while True:
+            if worker.unsent is None:
+                worker.unsent = await worker.queue.get()
+            send = loop.run_in_executor(None, conn.send_bytes, worker.unsent)
+            try:
+                await asyncio.shield(send)
+            except asyncio.CancelledError:
+                # send_bytes уже выполняется в потоке: канал закрывается только после неё.
+                await asyncio.wait([send])
+                if not send.cancelled() and send.exception() is None:
+                    self._delivered(worker)
+                raise
+            except (OSError, ValueError):
+                # Воркер упал: апдейт уйдёт в перезапущенный процесс, этот цикл
+                # остановит монитор.
+                await asyncio.sleep(0.5)
+                continue
+            self._delivered(worker)
+
+    @staticmethod
+    def _delivered(worker: _Worker) -> None:
+        worker.unsent = None
+        worker.forwarded += 1
+        worker.queue.task_done()
+
+    async def _monitor(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(1.0)
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.restart_at is not None:
+                    if now >= worker.restart_at:
+                        self.restarts += 1
+                        await self._spawn(worker)
+                        self._start_sender(worker)
+                    continue
+                if worker.process is None or worker.process.is_alive():
+                    continue
+                if now - worker.started_at < _MIN_UPTIME:
+                    worker.crashes += 1
+                else:
+                    worker.crashes = 0
+                delay = min(_MAX_RESTART_DELAY, 2.0 ** worker.crashes)
+                logger.error(
+                    "Воркер %s завершился с кодом %s, перезапуск через %.0f с",
+                    worker.index,
+                    worker.process.exitcode,
+                    delay,
+                )
+                await self._stop_sender(worker)
+                if worker.conn is not None:
+                    worker.conn.close()
+                    worker.conn = None
+                worker.restart_at = now + delay
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Досылает очереди, закрывает каналы и ждёт завершения воркеров."""
+
+        # Пока очереди досылаются, упавший воркер ещё перезапускается.
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(worker.queue.join() for worker in self.workers)), timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Супервизор: не все апдейты переданы воркерам до остановки")
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for worker in self.workers:
+            await self._stop_sender(worker)
+            if worker.conn is not None:
+                worker.conn.close()
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            await loop.run_in_executor(None, worker.process.join, timeout)
+            if worker.process.is_alive():
+                logger.warning("Воркер %s не завершился вовремя, останавливаем", worker.index)
+                worker.process.terminate()
+                await loop.run_in_executor(None, worker.process.join)
+        logger.info(
+            "Супервизор: передано апдейтов %s, отброшено %s, перезапусков воркеров %s",
+            [worker.forwarded for worker in self.workers],
+            [worker.dropped for worker in self.workers],
+            self.restarts,
+        )
+
+
+class _ForwardingWebhook(WebhookServer):
+    """Webhook процесса приёма: апдейт не обрабатывается, а передаётся воркеру."""
+
+    def __init__(self, supervisor: Supervisor, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.supervisor = supervisor
+
+    async def _process(self, payload: dict) -> None:
+        await self.supervisor.dispatch(payload)
+
+
+async def _poll(bot: Bot, supervisor: Supervisor, allowed_updates: List[str]) -> None:
+    offset: Optional[int] = None
+    backoff = 1.0
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=30, allowed_updates=allowed_updates
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.warning("Ошибка получения апдейтов: %s, повтор через %.0f с", exc, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, _MAX_RESTART_DELAY)
+            continue
+        backoff = 1.0
+        for update in updates:
+            offset = update.update_id + 1
+            await supervisor.dispatch(
+                update.model_dump(mode="json", by_alias=True, exclude_none=True)
+            )
+
+
+async def run_supervisor(
+    settings,
+    dispatcher: Dispatcher,
+    bot: Bot,
+    target: Callable[[int, Connection], None],
+    allowed_updates: List[str],
+) -> None:
+    """Процесс приёма: запускает воркеры и пересылает им апдейты до SIGINT/SIGTERM.
+
+    Хэндлеры в этом процессе не вызываются, ``dispatcher`` нужен только серверу
+    webhook. ``allowed_updates`` — типы апдейтов, которые обрабатывают воркеры.
+    """
+
+    supervisor = Supervisor(settings.shard_workers, target)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):  # pragma: no cover - Windows
+            pass
+
+    await supervisor.start()
+    runner = None
+    polling: Optional[asyncio.Task] = None
+    if settings.transport == "webhook":
+        if not settings.webhook_url or not settings.webhook_secret:
+            raise ValueError("Для TRANSPORT=webhook необходимо задать WEBHOOK_URL и WEBHOOK_SECRET")
+        from aiohttp import web
+
+        server = _ForwardingWebhook(
+            supervisor,
+            dispatcher,
+            bot,
+            secret=settings.webhook_secret,
+            path=settings.webhook_path,
+            drain_timeout=settings.webhook_drain_timeout,
+        )
+        runner = web.AppRunner(server.build_app(), handle_signals=False)
+        await runner.setup()
+        await web.TCPSite(runner, settings.webhook_host, settings.webhook_port).start()
+        await bot.set_webhook(
+            settings.webhook_url.rstrip("/") + settings.webhook_path,
+            secret_token=settings.webhook_secret,
+            allowed_updates=allowed_updates,
+        )
+    else:
+        polling = asyncio.create_task(_poll(bot, supervisor, allowed_updates))
+    logger.info("Супервизор: %s воркеров, приём через %s", len(supervisor.workers), settings.transport)
+    try:
+        await stop.wait()
+    finally:
+        if polling is not None:
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
+        if runner is not None:
+            # Webhook не снимается: см. serve_webhook.
+            await server.drain()
+            await runner.cleanup()
+        await supervisor.stop(timeout=settings.webhook_drain_timeout)
+
+
+async def consume_updates(
+    dispatcher: Dispatcher, bot: Bot, conn: Connection, primary: bool, drain_timeout: float = 30.0
+) -> None:
+    """Цикл воркера: читает апдейты из канала супервизора и обрабатывает их.
+
+    Завершается, когда супервизор закрыл канал или пришёл SIGTERM; начатые
+    апдейты дообрабатываются не дольше ``drain_timeout``.
+    """
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    tasks: Set[asyncio.Task] = set()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+    except (NotImplementedError, RuntimeError):  # pragma: no cover - Windows
+        pass
+
+    async def _feed(payload: dict) -> None:
+        try:
+            await dispatcher.feed_raw_update(bot, payload)
+        except Exception as exc:  # pragma: no cover - ошибка апдейта не должна терять остальные
+            logger.exception("Ошибка обработки апдейта", exc_info=exc)
+
+    def _on_readable() -> None:
+        try:
+            while conn.poll():
+                task = asyncio.create_task(_feed(json.loads(conn.recv_bytes())))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (EOFError, OSError):
+            loop.remove_reader(conn.fileno())
+            stop.set()
+
+    workflow = {"bot": bot, "bots": [bot], "dispatcher": dispatcher, "primary": primary}
+    await dispatcher.emit_startup(**dispatcher.workflow_data, **workflow)
+    loop.add_reader(conn.fileno(), _on_readable)
+    try:
+        await stop.wait()
+    finally:
+        if not conn.closed:
+            loop.remove_reader(conn.fileno())
+            conn.close()
+        if tasks:
+            _, pending = await asyncio.wait(set(tasks), timeout=drain_timeout)
+            for task in pending:
+                task.cancel()
+        await dispatcher.emit_shutdown(**dispatcher.workflow_data, **workflow)
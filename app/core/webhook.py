@@ -0,0 +1,221 @@
+"""Приём обновлений через webhook (aiohttp).
+
+Telegram присылает апдейт POST-запросом; запрос проверяется по заголовку
+``X-Telegram-Bot-Api-Secret-Token``, апдейт ставится в обработку фоновой задачей,
+а ответ 200 уходит сразу — медленный хэндлер не задерживает доставку следующих
+апдейтов. При остановке сервер перестаёт принимать запросы и дожидается
+начатых задач (не дольше ``drain_timeout``).
+
+Несколько процессов-воркеров слушают один порт (``SO_REUSEPORT``), ядро
+распределяет соединения между ними; упавший воркер перезапускается. Webhook
+регистрирует только основной воркер (индекс 0). При остановке webhook не
+снимается: при поэтапном деплое или второй реплике это остановило бы доставку
+апдейтов работающему экземпляру.
+"""
+from __future__ import annotations
+
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import signal
+import time
+from typing import Callable, List, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Перезапуск упавших воркеров, как у супервизора: воркер, проработавший меньше
+# _MIN_UPTIME, считается упавшим при старте, и пауза перед перезапуском растёт.
+_MIN_UPTIME = 10.0
+_MAX_RESTART_DELAY = 30.0
+
+
+class WebhookServer:
+    """HTTP-эндпоинт webhook с фоновой обработкой и корректной остановкой."""
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        secret: str,
+        path: str,
+        drain_timeout: float = 30.0,
+    ):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret = secret
+        self.path = path
+        self.drain_timeout = drain_timeout
+        self._tasks: Set[asyncio.Task] = set()
+        self._accepting = True
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            return web.Response(status=401)
+        if not self._accepting:
+            # Telegram повторит доставку — апдейт получит другой воркер или новый запуск.
+            return web.Response(status=503)
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        task = asyncio.create_task(self._process(payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response(status=200)
+
+    async def _process(self, payload: dict) -> None:
+        try:
+            await self.dispatcher.feed_raw_update(self.bot, payload)
+        except Exception as exc:  # pragma: no cover - ошибка апдейта не должна терять остальные
+            logger.exception("Ошибка обработки апдейта из webhook", exc_info=exc)
+
+    async def drain(self) -> None:
+        """Перестаёт принимать апдейты и дожидается уже начатых."""
+
+        self._accepting = False
+        if not self._tasks:
+            return
+        logger.info("Webhook: ожидание %s апдейтов в обработке", len(self._tasks))
+        _, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+        if pending:
+            logger.warning("Webhook: %s апдейтов прервано по таймауту остановки", len(pending))
+            for task in pending:
+                task.cancel()
+
+
+async def serve_webhook(dispatcher: Dispatcher, bot: Bot, settings, primary: bool = True) -> None:
+    """Запускает webhook-сервер и работает до SIGINT/SIGTERM.
+
+    ``primary`` — основной воркер: регистрирует webhook при старте. При остановке
+    webhook остаётся зарегистрированным (Telegram хранит недоставленные апдейты до
+    следующего запуска); снимать его — явное действие оператора.
+    """
+
+    if not settings.webhook_url or not settings.webhook_secret:
+        raise ValueError("Для TRANSPORT=webhook необходимо задать WEBHOOK_URL и WEBHOOK_SECRET")
+
+    server = WebhookServer(
+        dispatcher,
+        bot,
+        secret=settings.webhook_secret,
+        path=settings.webhook_path,
+        drain_timeout=settings.webhook_drain_timeout,
+    )
+    runner = web.AppRunner(server.build_app(), handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(
+        runner,
+        settings.webhook_host,
+        settings.webhook_port,
+        reuse_port=settings.webhook_workers > 1,
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):  # pragma: no cover - Windows
+            pass
+
+    workflow = {"bot": bot, "bots": [bot], "dispatcher": dispatcher, "primary": primary}
+    await dispatcher.emit_startup(**dispatcher.workflow_data, **workflow)
+    await site.start()
+    if primary:
+        await bot.set_webhook(
+            settings.webhook_url.rstrip("/") + settings.webhook_path,
+            secret_token=settings.webhook_secret,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+        )
+    logger.info(
+        "Webhook слушает %s:%s%s", settings.webhook_host, settings.webhook_port, settings.webhook_path
+    )
+    try:
+        await stop.wait()
+    finally:
+        await server.drain()
+        await runner.cleanup()
+        await dispatcher.emit_shutdown(**dispatcher.workflow_data, **workflow)
+
+
+def run_workers(count: int, target: Callable[[int], None]) -> None:
+    """Запускает ``count`` процессов ``target(index)`` и ждёт их завершения.
+
+    Воркер, завершившийся с ненулевым кодом, перезапускается с нарастающей паузой
+    (до ``_MAX_RESTART_DELAY`` секунд), иначе группа ``SO_REUSEPORT`` незаметно
+    уменьшалась бы. SIGTERM пересылается воркерам; SIGINT из терминала они получают
+    сами и завершаются с кодом 0 — такие воркеры не перезапускаются.
+    """
+
+    context = multiprocessing.get_context("spawn")
+    workers: List[Optional[multiprocessing.process.BaseProcess]] = [None] * count
+    started_at = [0.0] * count
+    crashes = [0] * count
+    restart_at: List[Optional[float]] = [None] * count
+    stopping = False
+
+    def _spawn(index: int) -> None:
+        worker = context.Process(target=target, args=(index,), name=f"bot-worker-{index}")
+        worker.start()
+        workers[index] = worker
+        started_at[index] = time.monotonic()
+        restart_at[index] = None
+
+    def _forward(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for worker in workers:
+            if worker is not None and worker.is_alive():
+                worker.terminate()
+
+    for index in range(count):
+        _spawn(index)
+    signal.signal(signal.SIGTERM, _forward)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    while not stopping:
+        time.sleep(1.0)
+        now = time.monotonic()
+        running = False
+        for index, worker in enumerate(workers):
+            if stopping:
+                break
+            if restart_at[index] is not None:
+                running = True
+                if now >= restart_at[index]:
+                    _spawn(index)
+                continue
+            if worker is None or worker.exitcode == 0:
+                continue
+            running = True
+            if worker.is_alive():
+                continue
+            crashes[index] = crashes[index] + 1 if now - started_at[index] < _MIN_UPTIME else 0
+            delay = min(_MAX_RESTART_DELAY, 2.0 ** crashes[index])
+            logger.error(
+                "Воркер %s завершился с кодом %s, перезапуск через %.0f с",
+                index,
+                worker.exitcode,
+                delay,
+            )
+            restart_at[index] = now + delay
+        if not running:
+            break
+    for worker in workers:
+        if worker is not None:
+            worker.join()
@@ -1,7 +1,10 @@
 """Модели приложения."""
 from app.core.db import Base
 from app.models.context import ContextMessage
+from app.models.fsm import FSMRecord
 from app.models.knowledge_base import Employee
+from app.models.mail import MailAnalysis, MailArchive, MailSyncState
+from app.models.schema import SchemaVersion
 from app.models.user import RDPCredential, User
 
 __all__ = [
@@ -10,4 +13,9 @@ __all__ = [
     "User",
     "RDPCredential",
     "ContextMessage",
+    "FSMRecord",
+    "MailAnalysis",
+    "MailArchive",
+    "MailSyncState",
+    "SchemaVersion",
 ]
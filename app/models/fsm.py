@@ -0,0 +1,22 @@
+"""Модель хранилища состояний FSM."""
+from datetime import datetime
+
+from sqlalchemy import DateTime, String, Text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.core.db import Base
+
+
+class FSMRecord(Base):
+    """Состояние и данные диалога aiogram FSM для одного ключа (бот/чат/пользователь).
+
+    ``expires_at`` продлевается при каждой записи; брошенные диалоги после него
+    считаются пустыми и удаляются.
+    """
+
+    __tablename__ = "fsm_state"
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    state: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    data: Mapped[str] = mapped_column(Text, default="{}")
+    expires_at: Mapped[datetime] = mapped_column(DateTime, index=True)
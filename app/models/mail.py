@@ -0,0 +1,70 @@
+"""Модели модуля почты."""
+from datetime import datetime
+
+from sqlalchemy import BigInteger, DateTime, Index, String, Text, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.core.db import Base
+
+
+class MailSyncState(Base):
+    """Позиция инкрементальной синхронизации почтового ящика.
+
+    Для IMAP хранится ``UIDVALIDITY`` и последний обработанный UID, для POP3 —
+    UIDL последнего обработанного письма.
+    """
+
+    __tablename__ = "mail_sync_state"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    account: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
+    uidvalidity: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    last_uid: Mapped[int] = mapped_column(BigInteger, default=0)
+    last_uidl: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+
+class MailAnalysis(Base):
+    """Кэш AI-анализа письма.
+
+    Ключ — Message-ID, хэш содержимого (письмо с тем же Message-ID, но другим
+    текстом анализируется заново) и модель, которой выполнен анализ.
+    """
+
+    __tablename__ = "mail_analysis"
+    __table_args__ = (UniqueConstraint("message_id", "content_hash", "model"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    message_id: Mapped[str] = mapped_column(String(512), nullable=False)
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    model: Mapped[str] = mapped_column(String(100), nullable=False)
+    summary: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    last_used_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class MailArchive(Base):
+    """Локальный архив писем для полнотекстового поиска.
+
+    Заполняется при синхронизации ящиков (заголовки и начало текста), при
+    загрузке полного тела текст дополняется. Полнотекстовый индекс поверх таблицы
+    (FTS5 в SQLite, tsvector в PostgreSQL) создаёт ``app.modules.mail.archive``.
+    """
+
+    __tablename__ = "mail_archive"
+    __table_args__ = (
+        UniqueConstraint("account", "uid"),
+        Index("ix_mail_archive_account_sent_at", "account", "sent_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    account: Mapped[str] = mapped_column(String(255), nullable=False)
+    uid: Mapped[str] = mapped_column(String(255), nullable=False)
+    message_id: Mapped[str | None] = mapped_column(String(512), nullable=True)
+    sender: Mapped[str] = mapped_column(String(512), default="")
+    subject: Mapped[str] = mapped_column(String(1024), default="")
+    body: Mapped[str] = mapped_column(Text, default="")
+    sent_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,21 @@
+"""Модель версии схемы БД."""
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.core.db import Base
+
+
+class SchemaVersion(Base):
+    """Отпечаток схемы, для которой последний раз выполнялся ``create_all``.
+
+    Одна строка (``id = 1``). Пока отпечаток моделей совпадает с записанным,
+    проверка схемы при запуске пропускается.
+    """
+
+    __tablename__ = "schema_version"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    fingerprint: Mapped[str] = mapped_column(String(64))
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
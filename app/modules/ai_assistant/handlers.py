@@ -4,7 +4,6 @@ from __future__ import annotations
 import logging
 from dataclasses import dataclass
 
-import httpx
 from aiogram import Dispatcher, Router
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
@@ -102,6 +101,8 @@ async def _send_ai_reply(message: Message, question: str, config: AIConfig):
     headers = {"Authorization": f"Bearer {config.api_key}"}
     url = f"{config.base_url}/chat/completions"
 
+    import httpx  # импорт HTTP-клиента откладывается до первого вопроса
+
     try:
         async with httpx.AsyncClient(timeout=30.0) as client:
             response = await client.post(url, json=payload, headers=headers)
@@ -2,26 +2,33 @@
 from __future__ import annotations
 
 import logging
-from typing import Iterable, List, Optional
+from typing import TYPE_CHECKING, Iterable, List, Optional
 
 from aiogram import Dispatcher, Router
 from aiogram.filters import Command
 from aiogram.types import Message
-from openai import AsyncOpenAI
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.context import ContextManager
-from app.core.db import get_session
-from app.core.modules import Module, ModuleRegistry
+from app.core.llm import openai_client
+from app.core.metrics import llm_latency
+from app.core.modules import Module, ModuleRegistry, ModuleUnavailable
 from app.models.context import ContextMessage
 from config import Settings
 
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
 router = Router(name="ai_core")
 logger = logging.getLogger(__name__)
 
 
 class AICoreModule(Module):
     name = "ai_core"
+    # Маршрутизатор вызывает остальные модули: стартует после них, останавливается раньше.
+    depends_on = ("knowledge_base", "mail")
+    # Длительность маршрутизации складывается из дедлайнов вызываемых модулей.
+    bulkhead = False
 
     def __init__(self, settings: Settings, registry: ModuleRegistry):
         super().__init__(settings)
@@ -30,23 +37,24 @@ class AICoreModule(Module):
             max_messages=settings.context_window_messages,
             max_chars=settings.context_max_chars,
         )
-        self.client: Optional[AsyncOpenAI] = None
-        if settings.openai_api_key:
-            self.client = AsyncOpenAI(
-                api_key=settings.openai_api_key,
-                base_url=settings.openai_base_url,
-            )
+
+    @property
+    def client(self) -> Optional["AsyncOpenAI"]:
+        return openai_client(self.settings)
 
     def initialize(self, dispatcher: Dispatcher) -> None:
         dispatcher.include_router(router)
 
-    async def process(self, user_id: int, message: str) -> str:
+    async def warmup(self) -> None:
+        # Импорт SDK и создание клиента — до первого запроса /ai.
+        openai_client(self.settings)
+
+    async def process(self, user_id: int, message: str, session: AsyncSession) -> str:
         """Определяет подходящий модуль и делегирует обработку."""
 
-        history: List[ContextMessage] = []
-        async for session in get_session():
-            history = await self.context_manager.get_history(session, user_id)
-            break
+        history: List[ContextMessage] = await self.context_manager.get_history(
+            session, user_id
+        )
 
         target = None
         if self.client:
@@ -60,9 +68,16 @@ class AICoreModule(Module):
         module = self.registry.get_module(target)
         if module is None:
             return "Модуль недоступен или выключен."
+        reason = self.registry.degraded(target)
+        if reason:
+            logger.info("Модуль %s пропущен маршрутизатором: %s", target, reason)
+            return f"Модуль {target} сейчас {reason}. Попробуйте позже."
 
         try:
-            reply = await module.process(user_id, message)
+            reply = await self.registry.process(target, user_id, message, session)
+        except ModuleUnavailable as exc:
+            logger.warning("Ошибка модуля %s: %s", target, exc)
+            return "Модуль не успел ответить. Попробуйте позже."
         except Exception as exc:  # pragma: no cover - защита от каскадных сбоев
             logger.exception("Ошибка модуля %s", target, exc_info=exc)
             return "Модуль временно недоступен. Попробуйте позже."
@@ -103,13 +118,17 @@ class AICoreModule(Module):
                 },
             }
             for name, capabilities in self.registry.get_capabilities_map().items()
-            if name != self.name
+            # Перегруженные и сбоящие модули LLM не предлагаются.
+            if name != self.name and not self.registry.degraded(name)
         ]
-        response = await self.client.chat.completions.create(
-            model=self.settings.openai_model,
-            messages=llm_messages,
-            tools=tools,
-        )
+        if not tools:
+            return None
+        with llm_latency.time(purpose="route"):
+            response = await self.client.chat.completions.create(
+                model=self.settings.openai_model,
+                messages=llm_messages,
+                tools=tools,
+            )
         choice = response.choices[0]
         if choice.finish_reason == "tool_calls" and choice.message.tool_calls:
             return choice.message.tool_calls[0].function.name
@@ -133,7 +152,7 @@ class AICoreModule(Module):
 
 
 @router.message(Command("ai"))
-async def ask_ai(message: Message, state):
+async def ask_ai(message: Message, session: AsyncSession, state):
     """Маршрутизация пользовательского текста через AI ядро."""
 
     text = (message.text or "").partition(" ")[2].strip()
@@ -144,14 +163,14 @@ async def ask_ai(message: Message, state):
     registry: ModuleRegistry = message.conf.get("registry")  # type: ignore[attr-defined]
     ai_core: AICoreModule = registry.get_module("ai_core")  # type: ignore[assignment]
 
-    async for session in get_session():
-        assert isinstance(session, AsyncSession)
-        await ai_core.context_manager.add_message(session, message.from_user.id, "user", text)
-        reply = await ai_core.process(message.from_user.id, text)
-        await ai_core.context_manager.add_message(session, message.from_user.id, "assistant", reply)
-        for chunk in _split_reply(reply):
-            await message.answer(chunk)
-        break
+    # Сначала маршрутизация (только чтение) и отправка ответа, затем запись истории:
+    # транзакция на запись открывается последней и не держится ни на время обращения
+    # к LLM, ни на время отправки (очередь чата и RetryAfter ждут секунды).
+    reply = await registry.process("ai_core", message.from_user.id, text, session)
+    for chunk in _split_reply(reply):
+        await message.answer(chunk)
+    await ai_core.context_manager.add_message(session, message.from_user.id, "user", text)
+    await ai_core.context_manager.add_message(session, message.from_user.id, "assistant", reply)
 
 
 def _split_reply(text: str, limit: int = 3800) -> List[str]:
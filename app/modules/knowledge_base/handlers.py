@@ -14,7 +14,6 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from sqlalchemy import func, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.db import get_session
 from app.models import Employee
 from config import Settings
 
@@ -226,11 +225,11 @@ async def input_department(message: Message, state: FSMContext):
 
 
 @router.message(AddEmployeeStates.rdp_host)
-async def input_rdp_host(message: Message, state: FSMContext):
+async def input_rdp_host(message: Message, state: FSMContext, session: AsyncSession):
     host = (message.text or "").strip()
     if host == "-" or not host:
         await state.update_data(rdp_host=None)
-        await _finalize_employee(message, state)
+        await _finalize_employee(message, state, session)
         return
     await state.update_data(rdp_host=host)
     await state.set_state(AddEmployeeStates.rdp_login)
@@ -260,7 +259,7 @@ async def input_rdp_password(message: Message, state: FSMContext):
 
 
 @router.message(AddEmployeeStates.rdp_port)
-async def input_rdp_port(message: Message, state: FSMContext):
+async def input_rdp_port(message: Message, state: FSMContext, session: AsyncSession):
     text = (message.text or "").strip()
     port = 3389
     if text:
@@ -269,16 +268,17 @@ async def input_rdp_port(message: Message, state: FSMContext):
             return
         port = int(text)
     await state.update_data(rdp_port=port)
-    await _finalize_employee(message, state)
+    await _finalize_employee(message, state, session)
 
 
-async def _finalize_employee(message: Message, state: FSMContext):
+async def _finalize_employee(message: Message, state: FSMContext, session: AsyncSession):
     data = await state.get_data()
     payload = EmployeePayload(**data)  # type: ignore[arg-type]
 
     try:
-        rdp_saved, rdp_note = await _save_employee(payload, message.from_user)
+        rdp_saved, rdp_note = await _save_employee(session, payload, message.from_user)
     except Exception as exc:  # pragma: no cover - простая логика
+        await session.rollback()
         await message.answer(
             "Не удалось сохранить данные. Попробуйте позднее или обратитесь к администратору."
         )
@@ -312,27 +312,25 @@ async def start_search(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(SearchStates.query)
-async def process_search(message: Message, state: FSMContext):
+async def process_search(message: Message, state: FSMContext, session: AsyncSession):
     query = (message.text or "").strip()
     if not query:
         await message.answer("Запрос не может быть пустым. Введите текст для поиска:")
         return
 
-    async for session in get_session():
-        assert isinstance(session, AsyncSession)
-        stmt = select(Employee).where(
-            or_(
-                Employee.last_name.ilike(f"%{query}%"),
-                Employee.first_name.ilike(f"%{query}%"),
-                Employee.middle_name.ilike(f"%{query}%"),
-                Employee.phone.ilike(f"%{query}%"),
-                Employee.email.ilike(f"%{query}%"),
-                Employee.position.ilike(f"%{query}%"),
-                Employee.department.ilike(f"%{query}%"),
-            )
-        ).limit(10)
-        result = await session.execute(stmt)
-        employees = result.scalars().all()
+    stmt = select(Employee).where(
+        or_(
+            Employee.last_name.ilike(f"%{query}%"),
+            Employee.first_name.ilike(f"%{query}%"),
+            Employee.middle_name.ilike(f"%{query}%"),
+            Employee.phone.ilike(f"%{query}%"),
+            Employee.email.ilike(f"%{query}%"),
+            Employee.position.ilike(f"%{query}%"),
+            Employee.department.ilike(f"%{query}%"),
+        )
+    ).limit(10)
+    result = await session.execute(stmt)
+    employees = result.scalars().all()
 
     if not employees:
         await message.answer("Ничего не найдено. Попробуйте другой запрос.")
@@ -362,37 +360,35 @@ async def start_delete(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(DeleteStates.target)
-async def process_delete(message: Message, state: FSMContext):
+async def process_delete(message: Message, state: FSMContext, session: AsyncSession):
     target = (message.text or "").strip()
     if not target:
         await message.answer("Пожалуйста, введите ID или email сотрудника:")
         return
 
-    async for session in get_session():
-        assert isinstance(session, AsyncSession)
-        stmt = select(Employee)
-        employee = None
-        if target.isdigit():
-            employee = await session.get(Employee, int(target))
-        else:
-            stmt = stmt.where(Employee.email == target)
-            result = await session.execute(stmt)
-            employee = result.scalars().first()
+    stmt = select(Employee)
+    employee = None
+    if target.isdigit():
+        employee = await session.get(Employee, int(target))
+    else:
+        stmt = stmt.where(Employee.email == target)
+        result = await session.execute(stmt)
+        employee = result.scalars().first()
 
-        if not employee:
-            await message.answer("Сотрудник не найден. Проверьте ввод и попробуйте снова.")
-            await state.clear()
-            return
+    if not employee:
+        await message.answer("Сотрудник не найден. Проверьте ввод и попробуйте снова.")
+        await state.clear()
+        return
 
-        async with session.begin():
-            await session.delete(employee)
+    await session.delete(employee)
+    await session.flush()
 
     await message.answer("Сотрудник удалён из базы знаний.")
     await state.clear()
 
 
 @router.callback_query(lambda c: c.data and c.data.startswith("kb:list:"))
-async def list_employees(callback: CallbackQuery):
+async def list_employees(callback: CallbackQuery, session: AsyncSession):
     """Отображает сотрудников постранично по 5 записей."""
 
     await callback.answer()
@@ -404,20 +400,18 @@ async def list_employees(callback: CallbackQuery):
     page_size = 5
     offset = page * page_size
 
-    async for session in get_session():
-        assert isinstance(session, AsyncSession)
-        total_stmt = select(func.count()).select_from(Employee)
-        total_result = await session.execute(total_stmt)
-        total = total_result.scalar_one()
-
-        stmt = (
-            select(Employee)
-            .order_by(Employee.id)
-            .offset(offset)
-            .limit(page_size)
-        )
-        rows = await session.execute(stmt)
-        employees = rows.scalars().all()
+    total_stmt = select(func.count()).select_from(Employee)
+    total_result = await session.execute(total_stmt)
+    total = total_result.scalar_one()
+
+    stmt = (
+        select(Employee)
+        .order_by(Employee.id)
+        .offset(offset)
+        .limit(page_size)
+    )
+    rows = await session.execute(stmt)
+    employees = rows.scalars().all()
 
     if not employees:
         text = "В базе пока нет сотрудников." if total == 0 else "Страница пуста."
@@ -453,29 +447,32 @@ async def list_employees(callback: CallbackQuery):
             await callback.message.answer("\n\n".join(lines), reply_markup=builder.as_markup())
 
 
-async def _save_employee(payload: EmployeePayload, telegram_user) -> tuple[bool, str | None]:
+async def _save_employee(
+    session: AsyncSession, payload: EmployeePayload, telegram_user
+) -> tuple[bool, str | None]:
     """Сохраняет запись в базу данных.
 
     Возвращает флаг успешного сохранения RDP и дополнительное сообщение для пользователя.
+    Фиксацию транзакции выполняет DbSessionMiddleware.
     """
 
-    async for session in get_session():
-        assert isinstance(session, AsyncSession)
-        employee = Employee(
-            last_name=payload.last_name,
-            first_name=payload.first_name,
-            middle_name=payload.middle_name,
-            phone=payload.phone,
-            email=payload.email,
-            position=payload.position,
-            department=payload.department,
-        )
-        async with session.begin():
-            session.add(employee)
-        rdp_saved = False
-        rdp_note: str | None = None
-        if payload.rdp_host and _MODULE:
-            try:
+    employee = Employee(
+        last_name=payload.last_name,
+        first_name=payload.first_name,
+        middle_name=payload.middle_name,
+        phone=payload.phone,
+        email=payload.email,
+        position=payload.position,
+        department=payload.department,
+    )
+    session.add(employee)
+    await session.flush()
+    rdp_saved = False
+    rdp_note: str | None = None
+    if payload.rdp_host and _MODULE:
+        try:
+            # Savepoint: сбой сохранения RDP не отменяет добавление сотрудника.
+            async with session.begin_nested():
                 await _MODULE.store_rdp(
                     session,
                     telegram_id=telegram_user.id,
@@ -485,15 +482,14 @@ async def _save_employee(payload: EmployeePayload, telegram_user) -> tuple[bool,
                     host=payload.rdp_host,
                     port=payload.rdp_port or 3389,
                 )
-                rdp_saved = True
-            except RuntimeError as err:
-                logger.warning("Не удалось зашифровать RDP: %s", err)
-                rdp_note = "RDP не сохранены: задайте FERNET_SECRET в конфигурации."
-            except Exception as exc:  # pragma: no cover - хранилище может быть недоступно
-                logger.exception("Ошибка при сохранении RDP", exc_info=exc)
-                rdp_note = "RDP не сохранены из-за ошибки. Попробуйте позже."
-        return rdp_saved, rdp_note
-    return False, "Не удалось подключиться к базе данных."
+            rdp_saved = True
+        except RuntimeError as err:
+            logger.warning("Не удалось зашифровать RDP: %s", err)
+            rdp_note = "RDP не сохранены: задайте FERNET_SECRET в конфигурации."
+        except Exception as exc:  # pragma: no cover - хранилище может быть недоступно
+            logger.exception("Ошибка при сохранении RDP", exc_info=exc)
+            rdp_note = "RDP не сохранены из-за ошибки. Попробуйте позже."
+    return rdp_saved, rdp_note
 
 
 def setup(
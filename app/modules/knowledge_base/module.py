@@ -1,11 +1,13 @@
 """Класс модуля базы знаний."""
 from __future__ import annotations
 
+from functools import cached_property
+from typing import TYPE_CHECKING, Optional
+
 from aiogram import Dispatcher
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.db import get_session
 from app.core.modules import Module
 from app.core.security import decrypt_value, encrypt_value, build_fernet
 from app.models import Employee, RDPCredential, User
@@ -13,33 +15,40 @@ from config import Settings
 
 from . import handlers
 
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet
+
 
 class KnowledgeBaseModule(Module):
     name = "knowledge_base"
 
     def __init__(self, settings: Settings):
         super().__init__(settings)
-        self.fernet = build_fernet(settings.fernet_secret)
+
+    @cached_property
+    def fernet(self) -> Optional["Fernet"]:
+        # Ключ (и cryptography) готовится при первой операции с RDP-данными.
+        return build_fernet(self.settings.fernet_secret)
 
     def initialize(self, dispatcher: Dispatcher) -> None:
         handlers.setup(dispatcher, settings=self.settings, module=self)
 
-    async def process(self, user_id: int, message: str) -> str:
+    async def warmup(self) -> None:
+        _ = self.fernet
+
+    async def process(self, user_id: int, message: str, session: AsyncSession) -> str:
         # Простейший поиск по таблице сотрудников
-        async for session in get_session():
-            assert isinstance(session, AsyncSession)
-            stmt = select(Employee).where(Employee.last_name.ilike(f"%{message}%"))
-            result = await session.execute(stmt)
-            employees = list(result.scalars())
-            if not employees:
-                return "Ничего не найдено в базе знаний."
-            formatted = "\n\n".join(
-                f"{emp.last_name} {emp.first_name} — {emp.position} ({emp.department}), "
-                f"тел. {emp.phone}, email {emp.email}"
-                for emp in employees[:5]
-            )
-            return formatted
-        return "Нет доступа к базе данных."
+        stmt = select(Employee).where(Employee.last_name.ilike(f"%{message}%"))
+        result = await session.execute(stmt)
+        employees = list(result.scalars())
+        if not employees:
+            return "Ничего не найдено в базе знаний."
+        formatted = "\n\n".join(
+            f"{emp.last_name} {emp.first_name} — {emp.position} ({emp.department}), "
+            f"тел. {emp.phone}, email {emp.email}"
+            for emp in employees[:5]
+        )
+        return formatted
 
     def get_capabilities(self):
         return ["search_employee", "store_rdp", "list_employees"]
@@ -58,7 +67,7 @@ class KnowledgeBaseModule(Module):
             port=port,
         )
         session.add(credential)
-        await session.commit()
+        await session.flush()
 
     async def fetch_rdp(self, session: AsyncSession, telegram_id: int):
         stmt = (
@@ -91,6 +100,5 @@ class KnowledgeBaseModule(Module):
             return user
         user = User(telegram_id=telegram_id, username=username)
         session.add(user)
-        await session.commit()
-        await session.refresh(user)
+        await session.flush()
         return user
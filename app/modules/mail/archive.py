@@ -0,0 +1,389 @@
+"""Локальный архив писем с полнотекстовым поиском.
+
+Письма попадают в ``mail_archive`` при синхронизации ящиков, поэтому вопросы вида
+«что присылала бухгалтерия на этой неделе» обслуживаются запросом к БД, без
+повторной загрузки писем с сервера. Индекс:
+
+- SQLite — виртуальная таблица FTS5 ``mail_archive_fts`` (external content) и
+  триггеры, поддерживающие её в актуальном состоянии;
+- PostgreSQL — генерируемая колонка ``search tsvector`` и GIN-индекс;
+- прочие СУБД — поиск через ``LIKE`` без индекса.
+"""
+from __future__ import annotations
+
+import html
+import logging
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, func, or_, select, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from app.core.db import create_session
+from app.models import MailArchive
+from app.modules.mail.envelope import MailEnvelope
+from app.modules.mail.parser import ParsedMail
+from app.modules.mail.text import slim
+from config import MailAccountSettings
+
+logger = logging.getLogger(__name__)
+
+_UPSERTS = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}
+
+_TABLE = MailArchive.__tablename__
+_FTS = f"{_TABLE}_fts"
+SNIPPET_CHARS = 160
+MAX_TERMS = 8
+
+_SQLITE_DDL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {_FTS} USING fts5(
+        sender, subject, body,
+        content='{_TABLE}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {_TABLE}_ai AFTER INSERT ON {_TABLE} BEGIN
+        INSERT INTO {_FTS}(rowid, sender, subject, body)
+        VALUES (new.id, new.sender, new.subject, new.body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {_TABLE}_ad AFTER DELETE ON {_TABLE} BEGIN
+        INSERT INTO {_FTS}({_FTS}, rowid, sender, subject, body)
+        VALUES ('delete', old.id, old.sender, old.subject, old.body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {_TABLE}_au AFTER UPDATE ON {_TABLE} BEGIN
+        INSERT INTO {_FTS}({_FTS}, rowid, sender, subject, body)
+        VALUES ('delete', old.id, old.sender, old.subject, old.body);
+        INSERT INTO {_FTS}(rowid, sender, subject, body)
+        VALUES (new.id, new.sender, new.subject, new.body);
+    END
+    """,
+]
+_POSTGRES_DDL = [
+    f"""
+    ALTER TABLE {_TABLE} ADD COLUMN IF NOT EXISTS search tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('simple', coalesce(sender, '') || ' ' || coalesce(subject, '') || ' '
+                    || coalesce(body, ''))
+    ) STORED
+    """,
+    f"CREATE INDEX IF NOT EXISTS ix_{_TABLE}_search ON {_TABLE} USING gin (search)",
+]
+
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+_CYRILLIC_RE = re.compile(r"[а-яё]", re.I)
+_STOPWORDS = {
+    # русский
+    "а", "в", "во", "и", "к", "о", "об", "от", "по", "с", "со", "у", "за", "из", "на",
+    "для", "про", "что", "кто", "где", "когда", "какие", "какое", "какой", "мне", "мой",
+    "мои", "мы", "нам", "нас", "я", "ли", "ещё", "еще", "было", "были", "есть", "это",
+    "письмо", "письма", "писем", "письмах", "почта", "почте", "почту", "сообщения",
+    "присылал", "присылала", "присылали", "прислал", "прислала", "прислали", "писал",
+    "писала", "писали", "отправил", "отправила", "отправили", "найди", "найти", "покажи",
+    "поищи", "пришло", "пришли", "приходило", "приходили", "все", "всё", "этой", "эту",
+    "прошлой", "прошлую", "прошлом", "последние", "последний", "последнюю",
+    # английский
+    "a", "an", "the", "of", "to", "from", "in", "on", "for", "about", "by", "what",
+    "who", "when", "which", "did", "do", "does", "me", "my", "we", "us", "is", "are",
+    "was", "were", "send", "sent", "mail", "mails", "email", "emails", "message",
+    "messages", "find", "show", "search", "any", "all", "this", "last", "past",
+}
+_PERIODS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r"^(сегодня|today)$", re.I), "today"),
+    (re.compile(r"^(вчера|yesterday)$", re.I), "yesterday"),
+    (re.compile(r"^(недел[яиюе]|week)$", re.I), "week"),
+    (re.compile(r"^(месяц|месяца|месяце|month)$", re.I), "month"),
+]
+
+
+@dataclass
+class SearchQuery:
+    terms: List[str]
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+
+@dataclass
+class ArchivedMail:
+    account: str
+    sender: str
+    subject: str
+    sent_at: datetime
+    snippet: str
+
+
+def parse_query(query: str, now: Optional[datetime] = None) -> SearchQuery:
+    """Грубый разбор вопроса: период («сегодня», «на этой неделе») и ключевые слова."""
+
+    now = now or datetime.utcnow()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    result = SearchQuery(terms=[])
+    for word in _WORD_RE.findall(query.lower()):
+        period = next((name for pattern, name in _PERIODS if pattern.match(word)), None)
+        if period == "today":
+            result.since = midnight
+        elif period == "yesterday":
+            result.since, result.until = midnight - timedelta(days=1), midnight
+        elif period == "week":
+            result.since = now - timedelta(days=7)
+        elif period == "month":
+            result.since = now - timedelta(days=30)
+        elif word not in _STOPWORDS and len(word) > 1 and not word.isdigit():
+            result.terms.append(_stem(word))
+    result.terms = list(dict.fromkeys(result.terms))[:MAX_TERMS]
+    return result
+
+
+def _stem(word: str) -> str:
+    # Префиксный поиск вместо морфологии: «бухгалтерия» найдёт «бухгалтерии».
+    if _CYRILLIC_RE.search(word) and len(word) > 5:
+        return word[: max(4, len(word) - 2)]
+    return word
+
+
+def _sent_at(mail: ParsedMail) -> datetime:
+    try:
+        moment = parsedate_to_datetime(str(mail.headers.get("Date", "")))
+    except (TypeError, ValueError, IndexError):
+        return datetime.utcnow()
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def _one_line(value: object) -> str:
+    return " ".join(str(value).split())
+
+
+class MailArchiveIndex:
+    """Запись писем в ``mail_archive`` и поиск по ним."""
+
+    def __init__(self, body_chars: int = 20000):
+        self.body_chars = body_chars
+        self.dialect = "sqlite"
+
+    async def prepare(self, engine: AsyncEngine) -> None:
+        """Создаёт полнотекстовый индекс поверх ``mail_archive`` (идемпотентно)."""
+
+        self.dialect = engine.dialect.name
+        statements = {"sqlite": _SQLITE_DDL, "postgresql": _POSTGRES_DDL}.get(self.dialect, [])
+        async with engine.begin() as conn:
+            for statement in statements:
+                await conn.execute(text(statement))
+
+    def _fields(self, mail: ParsedMail) -> dict:
+        message_id = _one_line(mail.headers.get("Message-ID", "")) or None
+        return {
+            "message_id": message_id[:512] if message_id else None,
+            "sender": _one_line(mail.headers.get("From", ""))[:512],
+            "subject": _one_line(mail.headers.get("Subject", ""))[:1024],
+            "body": slim(mail.text).text[: self.body_chars],
+            "sent_at": _sent_at(mail),
+        }
+
+    async def store(self, account: MailAccountSettings, envelopes: Sequence[MailEnvelope]) -> None:
+        """Добавляет в архив ещё не сохранённые письма (одна транзакция на пачку)."""
+
+        if not envelopes:
+            return
+        uids = [str(envelope.uid) for envelope in envelopes]
+        async with create_session() as session:
+            existing = set(
+                (
+                    await session.execute(
+                        select(MailArchive.uid).where(
+                            MailArchive.account == account.name, MailArchive.uid.in_(uids)
+                        )
+                    )
+                ).scalars()
+            )
+            # /mail в другом процессе мог уже вставить письмо (update_body): пропускаем.
+            upsert = _UPSERTS.get(_dialect(session))
+            added = 0
+            for uid, envelope in zip(uids, envelopes):
+                if uid in existing:
+                    continue
+                existing.add(uid)
+                values = dict(account=account.name, uid=uid, **self._fields(envelope.parsed))
+                if upsert is not None:
+                    await session.execute(
+                        upsert(MailArchive)
+                        .values(**values)
+                        .on_conflict_do_nothing(
+                            index_elements=[MailArchive.account, MailArchive.uid]
+                        )
+                    )
+                else:
+                    session.add(MailArchive(**values))
+                added += 1
+            if added:
+                await session.commit()
+                logger.debug("Архив писем %s: добавлено %s", account.name, added)
+
+    async def update_body(
+        self, account: MailAccountSettings, uid: object, mail: ParsedMail
+    ) -> None:
+        """Дополняет запись текстом, полученным при загрузке полного тела.
+
+        Пишет в отдельной короткой транзакции, как ``store``: сессия апдейта держала бы
+        блокировку записи SQLite до конца анализа письма и отправки ответа.
+        Синхронизация основного процесса может в это же время добавлять то же письмо,
+        поэтому в SQLite и PostgreSQL запись вставляется через upsert.
+        """
+
+        fields = self._fields(mail)
+        async with create_session() as session:
+            upsert = _UPSERTS.get(_dialect(session))
+            if upsert is not None:
+                statement = upsert(MailArchive).values(
+                    account=account.name, uid=str(uid), **fields
+                )
+                await session.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=[MailArchive.account, MailArchive.uid],
+                        set_={"body": statement.excluded.body},
+                        where=func.length(MailArchive.body)
+                        < func.length(statement.excluded.body),
+                    )
+                )
+            else:
+                result = await session.execute(
+                    select(MailArchive).where(
+                        MailArchive.account == account.name, MailArchive.uid == str(uid)
+                    )
+                )
+                entry = result.scalar_one_or_none()
+                if entry is None:
+                    session.add(MailArchive(account=account.name, uid=str(uid), **fields))
+                elif len(fields["body"]) > len(entry.body or ""):
+                    entry.body = fields["body"]
+            await session.commit()
+
+    async def search(
+        self, session: AsyncSession, accounts: Iterable[str], query: str, limit: int = 5
+    ) -> List[ArchivedMail]:
+        accounts = list(accounts)
+        parsed = parse_query(query)
+        if not accounts or (not parsed.terms and parsed.since is None):
+            return []
+        if not parsed.terms:
+            return await self._latest(session, accounts, parsed, limit)
+        # Диалект берётся из сессии: prepare() выполняет только основной процесс.
+        dialect = _dialect(session)
+        if dialect == "sqlite":
+            return await self._search_sqlite(session, accounts, parsed, limit)
+        if dialect == "postgresql":
+            return await self._search_postgres(session, accounts, parsed, limit)
+        return await self._search_like(session, accounts, parsed, limit)
+
+    async def _search_sqlite(
+        self, session: AsyncSession, accounts: List[str], query: SearchQuery, limit: int
+    ) -> List[ArchivedMail]:
+        match = " OR ".join(f'"{term}"*' for term in query.terms)
+        statement = text(
+            f"""
+            SELECT a.account, a.sender, a.subject, a.sent_at, a.body
+            FROM {_FTS} JOIN {_TABLE} AS a ON a.id = {_FTS}.rowid
+            WHERE {_FTS} MATCH :match AND a.account IN :accounts
+              AND a.sent_at >= :since AND a.sent_at < :until
+            ORDER BY bm25({_FTS}) LIMIT :limit
+            """
+        ).bindparams(bindparam("accounts", expanding=True))
+        rows = await session.execute(statement, self._params(query, accounts, limit, match=match))
+        return [self._row(row) for row in rows]
+
+    async def _search_postgres(
+        self, session: AsyncSession, accounts: List[str], query: SearchQuery, limit: int
+    ) -> List[ArchivedMail]:
+        tsquery = " | ".join(f"{term}:*" for term in query.terms)
+        statement = text(
+            f"""
+            SELECT account, sender, subject, sent_at, body
+            FROM {_TABLE}
+            WHERE search @@ to_tsquery('simple', :match) AND account IN :accounts
+              AND sent_at >= :since AND sent_at < :until
+            ORDER BY ts_rank(search, to_tsquery('simple', :match)) DESC, sent_at DESC
+            LIMIT :limit
+            """
+        ).bindparams(bindparam("accounts", expanding=True))
+        rows = await session.execute(statement, self._params(query, accounts, limit, match=tsquery))
+        return [self._row(row) for row in rows]
+
+    async def _search_like(
+        self, session: AsyncSession, accounts: List[str], query: SearchQuery, limit: int
+    ) -> List[ArchivedMail]:
+        conditions = [
+            column.ilike(f"%{term}%")
+            for term in query.terms
+            for column in (MailArchive.sender, MailArchive.subject, MailArchive.body)
+        ]
+        statement = self._filtered(accounts, query).where(or_(*conditions))
+        result = await session.execute(statement.order_by(MailArchive.sent_at.desc()).limit(limit))
+        return [self._row(entry) for entry in result.scalars()]
+
+    async def _latest(
+        self, session: AsyncSession, accounts: List[str], query: SearchQuery, limit: int
+    ) -> List[ArchivedMail]:
+        statement = self._filtered(accounts, query).order_by(MailArchive.sent_at.desc())
+        result = await session.execute(statement.limit(limit))
+        return [self._row(entry) for entry in result.scalars()]
+
+    @staticmethod
+    def _filtered(accounts: List[str], query: SearchQuery):
+        statement = select(MailArchive).where(MailArchive.account.in_(accounts))
+        if query.since is not None:
+            statement = statement.where(MailArchive.sent_at >= query.since)
+        if query.until is not None:
+            statement = statement.where(MailArchive.sent_at < query.until)
+        return statement
+
+    @staticmethod
+    def _params(query: SearchQuery, accounts: List[str], limit: int, match: str) -> dict:
+        return {
+            "match": match,
+            "accounts": accounts,
+            "since": query.since or datetime.min,
+            "until": query.until or datetime.max,
+            "limit": limit,
+        }
+
+    @staticmethod
+    def _row(row) -> ArchivedMail:
+        sent_at = row.sent_at
+        if isinstance(sent_at, str):  # сырой SQL в SQLite возвращает строку
+            sent_at = datetime.fromisoformat(sent_at)
+        return ArchivedMail(
+            account=row.account,
+            sender=row.sender or "",
+            subject=row.subject or "",
+            sent_at=sent_at,
+            snippet=_one_line(row.body or "")[:SNIPPET_CHARS],
+        )
+
+
+def _dialect(session: AsyncSession) -> str:
+    return session.get_bind().dialect.name
+
+
+def format_results(results: Sequence[ArchivedMail]) -> str:
+    """Список найденных писем; поля экранированы, ответ бота идёт с parse_mode HTML."""
+
+    lines = [f"Найдено писем: {len(results)}"]
+    for number, item in enumerate(results, start=1):
+        # Отправитель вида «Имя <addr@host>» без экранирования ломает разбор HTML.
+        sender = html.escape(item.sender or "(неизвестно)")
+        subject = html.escape(item.subject or "(без темы)")
+        lines.append(f"\n{number}. {item.sent_at:%d.%m %H:%M} — {sender}\n   {subject}")
+        if item.snippet:
+            lines.append(f"   {html.escape(item.snippet)}")
+    return "\n".join(lines)
@@ -0,0 +1,114 @@
+"""Персистентный кэш AI-анализа писем."""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.db import create_session
+from app.models import MailAnalysis
+from app.modules.mail.parser import ParsedMail
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(mail: ParsedMail) -> tuple[str, str]:
+    """Message-ID и SHA-256 содержимого, влияющего на анализ."""
+
+    digest = hashlib.sha256()
+    for value in (
+        str(mail.headers.get("Subject", "")),
+        str(mail.headers.get("From", "")),
+        mail.text,
+        "\n".join(mail.attachment_names),
+    ):
+        digest.update(value.encode("utf-8", errors="replace"))
+        digest.update(b"\0")
+    content_hash = digest.hexdigest()
+    # Без Message-ID письмо идентифицируется только содержимым.
+    message_id = str(mail.headers.get("Message-ID", "")).strip() or f"<sha256:{content_hash}>"
+    return message_id[:512], content_hash
+
+
+class AnalysisCache:
+    """Хранит результаты анализа в ``mail_analysis``.
+
+    Повторный ``/mail`` для того же письма (у любого пользователя) отвечает из БД
+    без обращения к LLM. Записи старше ``ttl_days`` и всё сверх ``max_entries``
+    (по давности использования) удаляются периодически.
+    """
+
+    def __init__(self, ttl_days: int, max_entries: int, evict_interval: int = 3600):
+        self.ttl_days = ttl_days
+        self.max_entries = max_entries
+        self.evict_interval = evict_interval
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, session: AsyncSession, mail: ParsedMail, model: str) -> Optional[str]:
+        message_id, content_hash = cache_key(mail)
+        result = await session.execute(
+            select(MailAnalysis).where(
+                MailAnalysis.message_id == message_id,
+                MailAnalysis.content_hash == content_hash,
+                MailAnalysis.model == model,
+            )
+        )
+        entry = result.scalar_one_or_none()
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry.last_used_at = datetime.utcnow()
+        return entry.summary
+
+    async def put(self, session: AsyncSession, mail: ParsedMail, model: str, summary: str) -> None:
+        message_id, content_hash = cache_key(mail)
+        try:
+            # Savepoint: параллельный анализ того же письма другим пользователем не
+            # должен откатывать остальную работу апдейта.
+            async with session.begin_nested():
+                session.add(
+                    MailAnalysis(
+                        message_id=message_id,
+                        content_hash=content_hash,
+                        model=model,
+                        summary=summary,
+                    )
+                )
+        except IntegrityError:
+            logger.debug("Анализ письма %s уже сохранён", message_id)
+
+    async def evict(self, session: AsyncSession) -> int:
+        cutoff = datetime.utcnow() - timedelta(days=self.ttl_days)
+        expired = await session.execute(
+            delete(MailAnalysis).where(MailAnalysis.last_used_at < cutoff)
+        )
+        keep = (
+            select(MailAnalysis.id)
+            .order_by(MailAnalysis.last_used_at.desc())
+            .limit(self.max_entries)
+            .subquery()
+        )
+        overflow = await session.execute(
+            delete(MailAnalysis).where(MailAnalysis.id.not_in(select(keep.c.id)))
+        )
+        return (expired.rowcount or 0) + (overflow.rowcount or 0)
+
+    async def run_eviction(self) -> None:
+        while True:
+            try:
+                async with create_session() as session:
+                    removed = await self.evict(session)
+                    await session.commit()
+                if removed:
+                    logger.info("Кэш анализа писем: удалено записей %s", removed)
+            except Exception as exc:  # pragma: no cover - очистка не должна ронять бота
+                logger.exception("Ошибка очистки кэша анализа писем", exc_info=exc)
+            await asyncio.sleep(self.evict_interval)
@@ -0,0 +1,556 @@
+"""Почтовые ящики: постоянная IMAP-сессия с IDLE и инкрементальная синхронизация.
+
+Позиция синхронизации (UIDVALIDITY + последний UID для IMAP, последний UIDL для
+POP3) хранится в ``mail_sync_state``, поэтому после перезапуска загружаются только
+новые письма. Сначала загружаются заголовки и начало тела (``MailEnvelope``),
+полное тело — только когда оно нужно для анализа.
+
+Постоянную сессию, опрос и позицию ведёт только процесс, вызвавший ``start()``
+(основной воркер). Ящик без ``start()`` подключается к серверу на время команды
+и позицию в ``mail_sync_state`` не меняет.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.db import create_session
+from app.models import MailSyncState
+from app.modules.mail.envelope import PREVIEW_BYTES, MailEnvelope, build_envelope
+from app.modules.mail.imap import AsyncIMAPClient, FetchResult, IMAPError, MailboxStatus
+from app.modules.mail.parser import ParsedMail, StreamingMailParser
+from app.modules.mail.pop3 import AsyncPOP3Client, POP3Error
+from config import MailAccountSettings
+
+logger = logging.getLogger(__name__)
+
+NewMailListener = Callable[[MailAccountSettings, MailEnvelope], Awaitable[None]]
+# Получает каждую загруженную при синхронизации пачку писем, включая прогрев кэша.
+SyncListener = Callable[[MailAccountSettings, List[MailEnvelope]], Awaitable[None]]
+# Парсер для полной загрузки письма (например, с сохранением вложений для извлечения).
+ParserFactory = Callable[[], StreamingMailParser]
+
+_BACKOFF_MIN = 1.0
+_BACKOFF_MAX = 300.0
+_EXISTS_MARK = b" EXISTS"
+_READY_TIMEOUT = 10.0
+_HEADER_ITEMS = f"(UID RFC822.SIZE BODY.PEEK[HEADER] BODY.PEEK[TEXT]<0.{PREVIEW_BYTES}>)"
+# Строк тела, запрашиваемых через POP3 TOP вместе с заголовками.
+_POP3_PREVIEW_LINES = 100
+
+
+def account_key(account: MailAccountSettings) -> str:
+    return f"{account.protocol.lower()}:{account.username}@{account.host}"
+
+
+def _envelope(item: FetchResult) -> MailEnvelope:
+    return build_envelope(
+        item.uid,  # type: ignore[arg-type]
+        item.parts.get("BODY[HEADER]", b""),
+        item.parts.get("BODY[TEXT]<0>", b""),
+        item.size,
+    )
+
+
+async def load_sync_state(session: AsyncSession, account: str) -> MailSyncState:
+    result = await session.execute(
+        select(MailSyncState).where(MailSyncState.account == account)
+    )
+    state = result.scalar_one_or_none()
+    if state is None:
+        state = MailSyncState(account=account, last_uid=0)
+        session.add(state)
+    return state
+
+
+class MailConnectionManager:
+    """Держит авторизованную IMAP-сессию и узнаёт о новых письмах через IDLE.
+
+    Соединение открывается один раз, при обрыве восстанавливается с
+    экспоненциальной задержкой. Последние письма хранятся в памяти, поэтому
+    ``/mail`` отвечает без обращения к серверу, а о новых письмах подписчики
+    узнают сразу после ``EXISTS`` от сервера.
+    """
+
+    def __init__(
+        self,
+        account: MailAccountSettings,
+        limiter: asyncio.Semaphore,
+        idle_timeout: float,
+        cache_size: int = 20,
+        parser_factory: ParserFactory = StreamingMailParser,
+    ):
+        self.account = account
+        self.parser_factory = parser_factory
+        self.key = account_key(account)
+        self.limiter = limiter
+        self.cache_size = cache_size
+        self.idle_timeout = idle_timeout
+        self.synced = False
+        self.connected = False
+        self._messages: Deque[MailEnvelope] = deque(maxlen=cache_size)
+        self._listeners: List[NewMailListener] = []
+        self._sync_listeners: List[SyncListener] = []
+        self._task: Optional[asyncio.Task] = None
+        self._client: Optional[AsyncIMAPClient] = None
+        self._last_uid = 0
+        self._ready = asyncio.Event()
+        # Команды вне IDLE (догрузка тела) прерывают ожидание и ждут блокировку.
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._pending = 0
+
+    def subscribe(self, listener: NewMailListener) -> None:
+        self._listeners.append(listener)
+
+    def subscribe_sync(self, listener: SyncListener) -> None:
+        self._sync_listeners.append(listener)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"mail-imap-{self.account.name}")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def refresh(self) -> None:
+        """Состояние обновляется через IDLE; ждём только первичную синхронизацию.
+
+        Без постоянной сессии новые письма загружаются во временном соединении.
+        """
+
+        if self._task is None:
+            async with self._on_demand() as client:
+                status = await client.select("INBOX")
+                await self._sync(client, notify=False, status=status, persist=False)
+            return
+        if self.synced:
+            return
+        try:
+            await asyncio.wait_for(self._ready.wait(), _READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("IMAP %s: первичная синхронизация ещё не завершена", self.account.name)
+
+    def latest(self, limit: int = 1) -> List[MailEnvelope]:
+        """Последние ``limit`` писем из уже синхронизированного состояния."""
+
+        return list(self._messages)[-limit:] if limit > 0 else []
+
+    async def recent(self, limit: int) -> List[MailEnvelope]:
+        """Заголовки последних ``limit`` писем; сверх кэша — запросом к серверу."""
+
+        cached = self.latest(limit)
+        if len(cached) >= limit:
+            return cached
+        if self._task is None:
+            async with self._on_demand() as client:
+                await client.select("INBOX")
+                return await self._fetch_recent(client, limit)
+        if self._client is None:
+            return cached
+        self._pending += 1
+        self._wake.set()
+        async with self._lock:
+            self._pending -= 1
+            client = self._client
+            if client is None:
+                return cached
+            async with self.limiter:
+                return await self._fetch_recent(client, limit)
+
+    @staticmethod
+    async def _fetch_recent(client: AsyncIMAPClient, limit: int) -> List[MailEnvelope]:
+        # Порядковый номер последнего письма = число писем в ящике.
+        last = await client.fetch("*", "(UID)")
+        if not last:
+            return []
+        first = max(1, last[0].seq - limit + 1)
+        fetched = await client.fetch(f"{first}:*", _HEADER_ITEMS)
+        return [
+            _envelope(item)
+            for item in sorted(fetched, key=lambda result: result.uid or 0)
+            if item.uid is not None
+        ]
+
+    async def load_full(self, envelope: MailEnvelope) -> ParsedMail:
+        """Возвращает разобранное письмо, при необходимости догружая полное тело по UID.
+
+        Тело потоком идёт из ответа сервера в ``StreamingMailParser``: вложения
+        не буферизуются.
+        """
+
+        if not envelope.needs_full_body:
+            return envelope.parsed
+        if self._task is None:
+            parser = self.parser_factory()
+            async with self._on_demand() as client:
+                await client.select("INBOX")
+                await client.uid_fetch_into(str(envelope.uid), "(UID BODY.PEEK[])", parser.feed)
+            envelope.parsed = parser.close()
+            envelope.complete = True
+            return envelope.parsed
+        if self._client is None:
+            return envelope.parsed
+        self._pending += 1
+        self._wake.set()
+        async with self._lock:
+            self._pending -= 1
+            client = self._client
+            if client is None or envelope.complete:
+                return envelope.parsed
+            parser = self.parser_factory()
+            async with self.limiter:
+                await client.uid_fetch_into(str(envelope.uid), "(UID BODY.PEEK[])", parser.feed)
+        envelope.parsed = parser.close()
+        envelope.complete = True
+        return envelope.parsed
+
+    @asynccontextmanager
+    async def _on_demand(self) -> AsyncIterator[AsyncIMAPClient]:
+        """Временная сессия для процесса без постоянного соединения (не основной воркер)."""
+
+        account = self.account
+        client = AsyncIMAPClient(account.host, account.port, use_ssl=account.use_ssl)
+        # Блокировка: параллельные команды процесса не синхронизируют кэш дважды.
+        async with self._lock, self.limiter:
+            try:
+                await client.connect()
+                await client.login(account.username, account.password)
+                yield client
+                await client.logout()
+            finally:
+                await client.close()
+
+    async def _run(self) -> None:
+        delay = _BACKOFF_MIN
+        while True:
+            account = self.account
+            client = AsyncIMAPClient(account.host, account.port, use_ssl=account.use_ssl)
+            try:
+                async with self.limiter:
+                    await client.connect()
+                    await client.login(account.username, account.password)
+                self.connected = True
+                delay = _BACKOFF_MIN
+                logger.info("IMAP-сессия %s установлена: %s", account.name, account.host)
+                await self._serve(client)
+            except asyncio.CancelledError:
+                await client.logout()
+                raise
+            except (IMAPError, OSError, EOFError, asyncio.TimeoutError) as exc:
+                logger.warning(
+                    "IMAP %s: соединение потеряно (%s), повтор через %.0f с",
+                    account.name,
+                    exc,
+                    delay,
+                )
+            finally:
+                self.connected = False
+                self._client = None
+                await client.close()
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+            delay = min(delay * 2, _BACKOFF_MAX)
+
+    async def _serve(self, client: AsyncIMAPClient) -> None:
+        async with self._lock, self.limiter:
+            status = await client.select("INBOX")
+            notify = await self._restore_position(status)
+            await self._sync(client, notify=notify, status=status)
+        self._client = client
+        self.synced = True
+        self._ready.set()
+
+        while True:
+            async with self._lock:
+                if not self._pending:
+                    self._wake.clear()
+                # Ожидание в IDLE не занимает слот ограничителя, только сама синхронизация.
+                events = await client.idle(self.idle_timeout, interrupt=self._wake)
+                if any(_EXISTS_MARK in bytes(event[0]) for event in events):
+                    async with self.limiter:
+                        await self._sync(client, notify=True)
+
+    async def _restore_position(self, status: MailboxStatus) -> bool:
+        """Загружает позицию из БД. Возвращает, нужно ли уведомлять о новых письмах."""
+
+        async with create_session() as session:
+            state = await load_sync_state(session, self.key)
+            if state.uidvalidity != status.uidvalidity:
+                # Ящик пересоздан или первый запуск: прежние UID недействительны.
+                state.uidvalidity = status.uidvalidity
+                state.last_uid = 0
+                self._messages.clear()
+            self._last_uid = state.last_uid
+            await session.commit()
+        return self.synced or self._last_uid > 0
+
+    async def _save_position(self) -> None:
+        async with create_session() as session:
+            state = await load_sync_state(session, self.key)
+            state.last_uid = self._last_uid
+            await session.commit()
+
+    async def _sync(
+        self,
+        client: AsyncIMAPClient,
+        notify: bool,
+        status: Optional[MailboxStatus] = None,
+        persist: bool = True,
+    ) -> None:
+        fetched: List[FetchResult]
+        if not self._messages and status is not None:
+            # Холодный кэш: заголовки последних писем по порядковым номерам, без SEARCH ALL.
+            if not status.exists:
+                return
+            first = max(1, status.exists - self.cache_size + 1)
+            fetched = await client.fetch(f"{first}:*", _HEADER_ITEMS)
+        else:
+            uids = await client.uid_search(f"UID {self._last_uid + 1}:*")
+            # «N:*» всегда включает последнее письмо, даже если его UID меньше N.
+            uids = [uid for uid in uids if uid > self._last_uid][-self.cache_size:]
+            if not uids:
+                return
+            fetched = await client.uid_fetch(",".join(map(str, uids)), _HEADER_ITEMS)
+
+        last_uid = self._last_uid
+        batch: List[MailEnvelope] = []
+        for item in sorted(fetched, key=lambda result: result.uid or 0):
+            if item.uid is None:
+                continue
+            envelope = _envelope(item)
+            self._messages.append(envelope)
+            batch.append(envelope)
+            if item.uid > last_uid:
+                self._last_uid = max(self._last_uid, item.uid)
+                if notify:
+                    await self._notify(envelope)
+        if persist and self._last_uid != last_uid:
+            await self._save_position()
+        await self._notify_sync(batch)
+
+    async def _notify(self, envelope: MailEnvelope) -> None:
+        for listener in self._listeners:
+            try:
+                await listener(self.account, envelope)
+            except Exception as exc:  # pragma: no cover - ошибка подписчика не рвёт сессию
+                logger.exception("Ошибка обработчика новых писем", exc_info=exc)
+
+    async def _notify_sync(self, envelopes: List[MailEnvelope]) -> None:
+        if not envelopes:
+            return
+        for listener in self._sync_listeners:
+            try:
+                await listener(self.account, envelopes)
+            except Exception as exc:  # pragma: no cover - ошибка подписчика не рвёт сессию
+                logger.exception("Ошибка обработчика синхронизации почты", exc_info=exc)
+
+
+class Pop3Mailbox:
+    """POP3-ящик с инкрементальной синхронизацией по UIDL.
+
+    POP3 не умеет push, поэтому новые письма запрашиваются при ``/mail`` и
+    периодическим опросом: ``UIDL`` сравнивается с сохранённой позицией, для новых
+    писем выполняется ``TOP`` (заголовки и начало тела), ``RETR`` — только для
+    полного тела.
+    """
+
+    def __init__(
+        self,
+        account: MailAccountSettings,
+        limiter: asyncio.Semaphore,
+        cache_size: int = 20,
+        parser_factory: ParserFactory = StreamingMailParser,
+    ):
+        self.account = account
+        self.parser_factory = parser_factory
+        self.key = account_key(account)
+        self.limiter = limiter
+        self.cache_size = cache_size
+        self._messages: Deque[MailEnvelope] = deque(maxlen=cache_size)
+        self._listeners: List[NewMailListener] = []
+        self._sync_listeners: List[SyncListener] = []
+        # Позицию по UIDL ведёт только процесс, запустивший опрос.
+        self._tracking = False
+        # Опрос и /mail не выполняют refresh одновременно: иначе оба прочитали бы одну
+        # позицию, дважды добавили письма в кэш и дважды уведомили о них.
+        self._lock = asyncio.Lock()
+
+    def subscribe(self, listener: NewMailListener) -> None:
+        self._listeners.append(listener)
+
+    def subscribe_sync(self, listener: SyncListener) -> None:
+        self._sync_listeners.append(listener)
+
+    def start(self) -> None:
+        self._tracking = True
+
+    async def stop(self) -> None:
+        self._tracking = False
+
+    async def refresh(self) -> None:
+        """Загружает новые письма.
+
+        Позиция читается и сохраняется в отдельных коротких транзакциях, как у IMAP:
+        транзакция сессии апдейта оставалась бы открытой на время обмена с сервером
+        и анализа письма.
+        """
+
+        async with self._lock:
+            await self._refresh()
+
+    async def _refresh(self) -> None:
+        warm = not self._messages
+        if not self._tracking:
+            # Только кэш процесса: новые — после последнего известного ему письма.
+            last_known = str(self._messages[-1].uid) if self._messages else None
+            async with self.limiter:
+                client = await self._connect()
+                try:
+                    envelopes, _ = await self._fetch_new(client, last_known, warm)
+                finally:
+                    await client.quit()
+            known = {envelope.uid for envelope in self._messages}
+            self._messages.extend(e for e in envelopes if e.uid not in known)
+            return
+
+        saved_uidl = await self._load_position()
+        async with self.limiter:
+            client = await self._connect()
+            try:
+                envelopes, last_uidl = await self._fetch_new(client, saved_uidl, warm)
+            finally:
+                await client.quit()
+
+        known = {envelope.uid for envelope in self._messages}
+        fresh = [envelope for envelope in envelopes if envelope.uid not in known]
+        self._messages.extend(fresh)
+        await self._notify_sync(fresh)
+        if last_uidl and last_uidl != saved_uidl:
+            # О письмах, догруженных для прогрева кэша после перезапуска, не уведомляем.
+            if saved_uidl is not None or not warm:
+                for envelope in fresh:
+                    await self._notify(envelope)
+            await self._save_position(last_uidl)
+
+    async def _load_position(self) -> Optional[str]:
+        async with create_session() as session:
+            state = await load_sync_state(session, self.key)
+            last_uidl = state.last_uidl
+            await session.commit()
+        return last_uidl
+
+    async def _save_position(self, last_uidl: str) -> None:
+        async with create_session() as session:
+            state = await load_sync_state(session, self.key)
+            state.last_uidl = last_uidl
+            await session.commit()
+
+    def latest(self, limit: int = 1) -> List[MailEnvelope]:
+        return list(self._messages)[-limit:] if limit > 0 else []
+
+    async def recent(self, limit: int) -> List[MailEnvelope]:
+        cached = self.latest(limit)
+        if len(cached) >= limit:
+            return cached
+        async with self.limiter:
+            client = await self._connect()
+            try:
+                entries = (await client.uidl())[-limit:]
+                sizes = await client.list() if entries else {}
+                return [
+                    await self._top(client, number, uidl, sizes.get(number))
+                    for number, uidl in entries
+                ]
+            finally:
+                await client.quit()
+
+    async def load_full(self, envelope: MailEnvelope) -> ParsedMail:
+        if not envelope.needs_full_body:
+            return envelope.parsed
+        parser = self.parser_factory()
+        found = False
+        async with self.limiter:
+            client = await self._connect()
+            try:
+                for number, uidl in await client.uidl():
+                    if uidl == envelope.uid:
+                        await client.retr_into(number, parser.feed)
+                        found = True
+                        break
+            finally:
+                await client.quit()
+        if found:
+            envelope.parsed = parser.close()
+            envelope.complete = True
+        return envelope.parsed
+
+    async def _connect(self) -> AsyncPOP3Client:
+        account = self.account
+        client = AsyncPOP3Client(account.host, account.port, use_ssl=account.use_ssl)
+        try:
+            await client.connect()
+            await client.login(account.username, account.password)
+        except BaseException:
+            await client.close()
+            raise
+        return client
+
+    async def _fetch_new(
+        self, client: AsyncPOP3Client, last_uidl: Optional[str], warm: bool
+    ) -> tuple[List[MailEnvelope], Optional[str]]:
+        entries = await client.uidl()
+        if not entries:
+            return [], last_uidl
+        uidls = [uidl for _, uidl in entries]
+        start = uidls.index(last_uidl) + 1 if last_uidl in uidls else 0
+        selected = entries[start:][-self.cache_size:]
+        if not selected and warm:
+            # После перезапуска кэш пуст: берём последние письма, даже если они не новые.
+            selected = entries[-self.cache_size:]
+        sizes = await client.list() if selected else {}
+
+        envelopes = [
+            await self._top(client, number, uidl, sizes.get(number)) for number, uidl in selected
+        ]
+        return envelopes, entries[-1][1]
+
+    @staticmethod
+    async def _top(
+        client: AsyncPOP3Client, number: int, uidl: str, size: Optional[int]
+    ) -> MailEnvelope:
+        raw = await client.top(number, _POP3_PREVIEW_LINES)
+        header, _, body = raw.partition(b"\r\n\r\n")
+        return build_envelope(uidl, header + b"\r\n\r\n", body, size)
+
+    async def _notify(self, envelope: MailEnvelope) -> None:
+        for listener in self._listeners:
+            try:
+                await listener(self.account, envelope)
+            except Exception as exc:  # pragma: no cover - ошибка подписчика не рвёт опрос
+                logger.exception("Ошибка обработчика новых писем", exc_info=exc)
+
+    async def _notify_sync(self, envelopes: List[MailEnvelope]) -> None:
+        if not envelopes:
+            return
+        for listener in self._sync_listeners:
+            try:
+                await listener(self.account, envelopes)
+            except Exception as exc:  # pragma: no cover - ошибка подписчика не рвёт опрос
+                logger.exception("Ошибка обработчика синхронизации почты", exc_info=exc)
+
+
+MAIL_ERRORS = (IMAPError, POP3Error, OSError, EOFError, asyncio.TimeoutError)
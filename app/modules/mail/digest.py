@@ -0,0 +1,125 @@
+"""Дайджест входящих: map-reduce суммаризация пачек писем."""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Callable, List, Optional, Sequence
+
+from app.core.metrics import llm_latency
+from app.modules.mail.envelope import MailEnvelope
+from app.modules.mail.text import estimate_tokens, slim
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+SYNOPSIS_TEXT_CHARS = 400
+
+_MAP_PROMPT = (
+    "Тебе передан список писем в формате «#номер | отправитель | тема | текст». "
+    "Для каждого письма дай одну строку: номер, приоритет (высокий/средний/низкий) и суть "
+    "в 10–15 словах. Ничего не добавляй от себя."
+)
+_REDUCE_PROMPT = (
+    "Тебе переданы краткие разборы писем из входящих. Составь единый дайджест: сначала "
+    "письма с высоким приоритетом, затем средним, низкие сгруппируй одной строкой. Отметь, "
+    "что требует ответа или действия. Пиши кратко, не длиннее 3000 символов."
+)
+
+
+def _clean(value: object) -> str:
+    return " ".join(str(value).split())
+
+
+def synopsis(index: int, envelope: MailEnvelope) -> str:
+    """Компактное представление письма для пакетного запроса."""
+
+    headers = envelope.message
+    text = _clean(slim(envelope.parsed.text).text)[:SYNOPSIS_TEXT_CHARS]
+    attachments = envelope.parsed.attachment_names
+    parts = [
+        f"#{index}",
+        _clean(headers.get("From", "(неизвестно)")),
+        _clean(headers.get("Subject", "(без темы)")),
+        text,
+    ]
+    if attachments:
+        parts.append("вложения: " + ", ".join(attachments))
+    return " | ".join(parts)
+
+
+def pack(synopses: Sequence[str], token_budget: int) -> List[List[str]]:
+    """Раскладывает синопсисы по пачкам, не превышая бюджет токенов на пачку."""
+
+    chunks: List[List[str]] = []
+    current: List[str] = []
+    used = 0
+    for item in synopses:
+        cost = estimate_tokens(item) + 1
+        if current and used + cost > token_budget:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class DigestBuilder:
+    """Map: пачки синопсисов суммаризируются параллельно (не больше ``concurrency``).
+    Reduce: один запрос собирает итоговый приоритизированный дайджест.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Optional["AsyncOpenAI"]],
+        model: str,
+        chunk_token_budget: int,
+        concurrency: int,
+    ):
+        # Клиент запрашивается при построении дайджеста: SDK не импортируется заранее.
+        self.client_factory = client_factory
+        self.model = model
+        self.chunk_token_budget = chunk_token_budget
+        self.concurrency = max(1, concurrency)
+
+    async def build(self, envelopes: Sequence[MailEnvelope]) -> str:
+        synopses = [synopsis(idx, env) for idx, env in enumerate(envelopes, start=1)]
+        if not synopses:
+            return "Нет писем для дайджеста."
+        client = self.client_factory()
+        if client is None:
+            return "Последние письма:\n" + "\n".join(s[: SYNOPSIS_TEXT_CHARS // 2] for s in synopses)
+
+        chunks = pack(synopses, self.chunk_token_budget)
+        if len(chunks) == 1:
+            # Всё помещается в один запрос — отдельный reduce не нужен.
+            return await self._complete(client, _REDUCE_PROMPT, "\n".join(chunks[0]))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def summarize(chunk: List[str]) -> str:
+            async with semaphore:
+                return await self._complete(client, _MAP_PROMPT, "\n".join(chunk))
+
+        partials = await asyncio.gather(*(summarize(chunk) for chunk in chunks))
+        logger.info(
+            "Дайджест: писем %s, пачек %s, ~%s токенов на входе",
+            len(synopses),
+            len(chunks),
+            sum(estimate_tokens(s) for s in synopses),
+        )
+        return await self._complete(client, _REDUCE_PROMPT, "\n".join(partials))
+
+    async def _complete(self, client: "AsyncOpenAI", system_prompt: str, content: str) -> str:
+        with llm_latency.time(purpose="mail_digest"):
+            response = await client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": content},
+                ],
+            )
+        return response.choices[0].message.content or ""
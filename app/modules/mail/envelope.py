@@ -0,0 +1,48 @@
+"""Письмо, загруженное «сначала заголовки»."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from email.message import Message as EmailMessage
+from typing import Optional, Union
+
+from app.modules.mail.parser import ParsedMail, parse_bytes
+
+# Сколько байт тела подтягивать вместе с заголовками.
+PREVIEW_BYTES = 8192
+
+
+@dataclass
+class MailEnvelope:
+    """Заголовки и начало тела письма; полное тело загружается по требованию.
+
+    ``uid`` — IMAP UID или POP3 UIDL. ``parsed`` разобран из заголовков и первых
+    ``PREVIEW_BYTES`` тела, поэтому первой текстовой части обычно достаточно для
+    анализа. ``complete`` означает, что письмо разобрано целиком.
+    """
+
+    uid: Union[int, str]
+    parsed: ParsedMail
+    size: Optional[int] = None
+    complete: bool = False
+
+    @property
+    def message(self) -> EmailMessage:
+        """Заголовки письма."""
+
+        return self.parsed.headers
+
+    @property
+    def needs_full_body(self) -> bool:
+        # Вложения живут в multipart/mixed: их имена без полного тела не узнать.
+        if self.complete:
+            return False
+        return self.message.get_content_type() == "multipart/mixed"
+
+
+def build_envelope(
+    uid: Union[int, str], header: bytes, preview: bytes, size: Optional[int] = None
+) -> MailEnvelope:
+    complete = size is not None and len(header) + len(preview) >= size
+    return MailEnvelope(
+        uid=uid, parsed=parse_bytes(header + preview), size=size, complete=complete
+    )
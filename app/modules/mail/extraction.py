@@ -0,0 +1,257 @@
+"""Извлечение текста из вложений в пуле процессов.
+
+Декодирование больших base64/quoted-printable тел, разбор PDF (``pypdf``, если
+установлен), DOCX (``zipfile`` + ``word/document.xml``), HTML и текстовых вложений
+нагружает CPU и на потоке event loop остановило бы обработку остальных чатов.
+Эти шаги выполняются в ``ProcessPoolExecutor``; у каждой задачи есть таймаут и
+ограничения на размер входа и результата.
+"""
+from __future__ import annotations
+
+import asyncio
+import html
+import io
+import logging
+import multiprocessing
+import re
+import signal
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from email.message import Message as EmailMessage
+from typing import Dict, Optional, Set
+
+from app.modules.mail.parser import AttachmentInfo, ParsedMail, decode_transfer, html_to_text
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTACHMENTS = 5
+# Распакованный document.xml больше этого считается zip-бомбой.
+MAX_DOCX_XML_BYTES = 20 * 1024 * 1024
+# Запас поверх таймаута задачи: за это время воркер должен сам прервать работу.
+_TIMEOUT_GRACE = 2.0
+
+_DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+_DOCX_PARAGRAPH_RE = re.compile(r"</w:p>|<w:br\s*/>")
+_DOCX_TAB_RE = re.compile(r"<w:tab\s*/>")
+_XML_TAG_RE = re.compile(r"<[^>]+>")
+
+
+class ExtractionTimeout(Exception):
+    """Задача извлечения не уложилась в отведённое время."""
+
+
+def attachment_kind(content_type: str, name: str) -> Optional[str]:
+    """Тип извлечения для вложения или ``None``, если текст из него не извлекается."""
+
+    name = name.lower()
+    if content_type == "application/pdf" or name.endswith(".pdf"):
+        return "pdf"
+    if content_type == _DOCX_TYPE or name.endswith(".docx"):
+        return "docx"
+    if content_type == "text/html" or name.endswith((".html", ".htm")):
+        return "html"
+    if content_type in ("text/plain", "text/csv") or name.endswith((".txt", ".csv")):
+        return "text"
+    return None
+
+
+def is_extractable(headers: EmailMessage) -> bool:
+    """Предикат для ``StreamingMailParser(capture=...)``."""
+
+    return attachment_kind(headers.get_content_type(), headers.get_filename() or "") is not None
+
+
+def _on_alarm(signum, frame):
+    raise ExtractionTimeout()
+
+
+def _pdf_text(data: bytes, max_chars: int) -> str:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return ""
+    reader = PdfReader(io.BytesIO(data))
+    chunks = []
+    total = 0
+    for page in reader.pages:
+        chunk = page.extract_text() or ""
+        chunks.append(chunk)
+        total += len(chunk)
+        if total >= max_chars:
+            break
+    return "\n".join(chunks)
+
+
+def _docx_text(data: bytes) -> str:
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        info = archive.getinfo("word/document.xml")
+        if info.file_size > MAX_DOCX_XML_BYTES:
+            return ""
+        xml = archive.read(info).decode("utf-8", errors="replace")
+    xml = _DOCX_TAB_RE.sub("\t", _DOCX_PARAGRAPH_RE.sub("\n", xml))
+    return html.unescape(_XML_TAG_RE.sub("", xml))
+
+
+def extract_text(
+    payload: bytes,
+    encoding: str,
+    content_type: str,
+    name: str,
+    charset: Optional[str],
+    max_chars: int,
+    timeout: float,
+) -> str:
+    """Выполняется в процессе пула: декодирует вложение и извлекает из него текст."""
+
+    alarm = timeout > 0 and hasattr(signal, "setitimer")
+    if alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        data = decode_transfer(payload, encoding)
+        kind = attachment_kind(content_type, name)
+        if kind == "pdf":
+            text = _pdf_text(data, max_chars)
+        elif kind == "docx":
+            text = _docx_text(data)
+        else:
+            try:
+                text = data.decode(charset or "utf-8", errors="replace")
+            except LookupError:
+                text = data.decode("utf-8", errors="replace")
+            if kind == "html":
+                text = html_to_text(text)
+        return " ".join(text.split())[:max_chars]
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class ExtractionPool:
+    """Пул процессов для извлечения текста из вложений.
+
+    Пул создаётся при первой задаче. В пул передаётся не больше задач, чем в нём
+    воркеров, поэтому таймаут отсчитывается с начала выполнения, а не с постановки
+    в очередь. Задача, превысившая ``timeout``, прерывается в самом воркере
+    (``SIGALRM``). Если воркер не ответил и после этого, новые задачи идут в новый
+    пул, а старый останавливается вместе с зависшим воркером, когда закончатся
+    остальные его задачи. Ошибки извлечения не мешают анализу письма — вложение
+    просто остаётся без текста.
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = 10.0, max_chars: int = 4000):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.max_chars = max_chars
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(self.workers)
+        # Выполняющиеся задачи по пулам и пулы, выведенные из работы после сбоя.
+        self._running: Dict[ProcessPoolExecutor, int] = {}
+        self._retired: Set[ProcessPoolExecutor] = set()
+
+    async def extract(self, mail: ParsedMail) -> None:
+        """Заполняет ``text`` у сохранённых вложений и освобождает их тела."""
+
+        jobs = [a for a in mail.attachments if a.payload is not None and a.text is None]
+        try:
+            if jobs:
+                texts = await asyncio.gather(
+                    *(self._run(attachment) for attachment in jobs[:MAX_ATTACHMENTS])
+                )
+                for attachment, text in zip(jobs, texts):
+                    attachment.text = text
+        finally:
+            mail.drop_payloads()
+
+    async def _run(self, attachment: AttachmentInfo) -> str:
+        loop = asyncio.get_running_loop()
+        # Задача ждёт свободного воркера здесь, а не в очереди пула: иначе ожидание
+        # за чужими задачами входило бы в таймаут.
+        async with self._slots:
+            executor = self._get_executor()
+            self._running[executor] = self._running.get(executor, 0) + 1
+            try:
+                future = loop.run_in_executor(
+                    executor,
+                    extract_text,
+                    attachment.payload,
+                    attachment.encoding,
+                    attachment.content_type,
+                    attachment.name,
+                    attachment.charset,
+                    self.max_chars,
+                    self.timeout,
+                )
+                return await asyncio.wait_for(future, self.timeout + _TIMEOUT_GRACE)
+            except ExtractionTimeout:
+                logger.warning("Извлечение текста из %s прервано по таймауту", attachment.name)
+            except asyncio.TimeoutError:
+                logger.warning(
+                    "Воркер извлечения не ответил (%s), он будет остановлен", attachment.name
+                )
+                self._retire(executor)
+            except BrokenProcessPool:
+                logger.warning("Пул извлечения текста аварийно завершился, пересоздаём")
+                self._retire(executor)
+            except Exception as exc:
+                logger.warning("Не удалось извлечь текст из %s: %s", attachment.name, exc)
+            finally:
+                self._finish(executor)
+        return ""
+
+    async def warmup(self) -> None:
+        """Запускает процессы пула, чтобы первое письмо не ждало их старта."""
+
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(executor, int) for _ in range(self.workers))
+        )
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: воркеры не наследуют event loop, соединения и потоки бота.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _retire(self, executor: ProcessPoolExecutor) -> None:
+        """Новые задачи пойдут в новый пул; ``executor`` остановится в ``_finish``."""
+
+        # Поздний сбой задачи из уже выведенного пула не трогает текущий.
+        if self._executor is executor:
+            self._executor = None
+        self._retired.add(executor)
+
+    def _finish(self, executor: ProcessPoolExecutor) -> None:
+        self._running[executor] -= 1
+        if self._running[executor]:
+            return
+        del self._running[executor]
+        if executor in self._retired:
+            self._retired.discard(executor)
+            _terminate(executor)
+
+    def shutdown(self) -> None:
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        for retired in self._retired:
+            _terminate(retired)
+        self._retired.clear()
+
+
+def _terminate(executor: ProcessPoolExecutor) -> None:
+    """Останавливает пул, в котором других задач уже нет, вместе с зависшим воркером."""
+
+    # shutdown(wait=False) не останавливает воркер, который завис в задаче: такой
+    # процесс продолжал бы занимать CPU и память. Список процессов — приватный
+    # атрибут CPython; если его нет, остаётся только shutdown.
+    processes = getattr(executor, "_processes", None)
+    alive = list(processes.values()) if isinstance(processes, dict) else []
+    executor.shutdown(wait=False)
+    for process in alive:
+        if process.is_alive():
+            process.terminate()
@@ -0,0 +1,260 @@
+"""Минимальный асинхронный IMAP4rev1-клиент поверх asyncio streams.
+
+Поддерживает ровно то, что нужно модулю почты: LOGIN, SELECT, UID SEARCH/FETCH,
+NOOP, IDLE (RFC 2177) и LOGOUT. Литералы ``{N}`` в ответах читаются целиком.
+"""
+from __future__ import annotations
+
+import asyncio
+import re
+import ssl
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Union
+
+_LITERAL_RE = re.compile(rb"\{(\d+)\}\r\n$")
+_STATUS_RE = re.compile(rb"\[(UIDVALIDITY|UIDNEXT) (\d+)\]")
+_EXISTS_RE = re.compile(rb"^\* (\d+) EXISTS")
+_FETCH_RE = re.compile(rb"^\* (\d+) FETCH")
+_UID_RE = re.compile(rb"\bUID (\d+)")
+_SIZE_RE = re.compile(rb"\bRFC822\.SIZE (\d+)")
+_KEY_RE = re.compile(rb"([A-Z0-9.]+(?:\[[^\]]*\])?(?:<\d+>)?)$")
+
+# Untagged-ответ: чередование строк протокола и литералов (bytearray).
+Response = List[Union[bytes, bytearray]]
+LiteralSink = Callable[[bytes], None]
+
+_LITERAL_CHUNK = 64 * 1024
+
+
+class IMAPError(Exception):
+    """Сервер вернул NO/BAD или разорвал соединение."""
+
+
+@dataclass
+class MailboxStatus:
+    exists: int = 0
+    uidvalidity: Optional[int] = None
+    uidnext: Optional[int] = None
+
+
+@dataclass
+class FetchResult:
+    """Разобранный ответ ``FETCH``: UID, размер и литералы по именам атрибутов."""
+
+    seq: int
+    uid: Optional[int] = None
+    size: Optional[int] = None
+    parts: Dict[str, bytes] = field(default_factory=dict)
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def parse_fetch(response: Response) -> Optional[FetchResult]:
+    head = bytes(response[0])
+    match = _FETCH_RE.match(head)
+    if not match:
+        return None
+    result = FetchResult(seq=int(match.group(1)))
+    text = b" ".join(bytes(chunk) for chunk in response[::2])
+    if uid := _UID_RE.search(text):
+        result.uid = int(uid.group(1))
+    if size := _SIZE_RE.search(text):
+        result.size = int(size.group(1))
+    # Каждый литерал относится к атрибуту, имя которого стоит перед {N}.
+    for idx in range(1, len(response), 2):
+        line = _LITERAL_RE.sub(b"", bytes(response[idx - 1])).rstrip()
+        key = _KEY_RE.search(line)
+        if key:
+            name = key.group(1).decode()
+            result.parts[name.replace(".PEEK", "")] = bytes(response[idx])
+    return result
+
+
+class AsyncIMAPClient:
+    """Одно IMAP-соединение. Не потокобезопасно: команды выполняются по очереди."""
+
+    def __init__(self, host: str, port: int = 993, use_ssl: bool = True, timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._tag = 0
+
+    async def connect(self) -> None:
+        context = ssl.create_default_context() if self.use_ssl else None
+        self._reader, self._writer = await asyncio.wait_for(
+            # Длинные строки (SEARCH по большому ящику) не помещаются в лимит по умолчанию.
+            asyncio.open_connection(self.host, self.port, ssl=context, limit=2**20),
+            self.timeout,
+        )
+        greeting = await self._read_response()
+        if not bytes(greeting[0]).startswith((b"* OK", b"* PREAUTH")):
+            raise IMAPError(f"Неожиданное приветствие сервера: {bytes(greeting[0])!r}")
+
+    async def login(self, username: str, password: str) -> None:
+        await self.command(f"LOGIN {_quote(username)} {_quote(password)}")
+
+    async def select(self, mailbox: str = "INBOX") -> MailboxStatus:
+        status = MailboxStatus()
+        for response in await self.command(f"SELECT {_quote(mailbox)}"):
+            line = bytes(response[0])
+            if match := _EXISTS_RE.match(line):
+                status.exists = int(match.group(1))
+            for key, value in _STATUS_RE.findall(line):
+                if key == b"UIDVALIDITY":
+                    status.uidvalidity = int(value)
+                else:
+                    status.uidnext = int(value)
+        return status
+
+    async def uid_search(self, criteria: str) -> List[int]:
+        uids: List[int] = []
+        for response in await self.command(f"UID SEARCH {criteria}"):
+            line = bytes(response[0])
+            if line.startswith(b"* SEARCH"):
+                uids.extend(int(item) for item in line.split()[2:])
+        return uids
+
+    async def uid_fetch(self, uid_set: str, items: str) -> List[FetchResult]:
+        return self._parse_fetch_all(await self.command(f"UID FETCH {uid_set} {items}"))
+
+    async def uid_fetch_into(self, uid_set: str, items: str, sink: LiteralSink) -> None:
+        """UID FETCH, при котором литералы не буферизуются, а отдаются в ``sink`` кусками."""
+
+        await self.command(f"UID FETCH {uid_set} {items}", sink=sink)
+
+    async def fetch(self, seq_set: str, items: str) -> List[FetchResult]:
+        """FETCH по порядковым номерам (нужен, пока UID ещё неизвестны)."""
+
+        return self._parse_fetch_all(await self.command(f"FETCH {seq_set} {items}"))
+
+    @staticmethod
+    def _parse_fetch_all(responses: List[Response]) -> List[FetchResult]:
+        results = []
+        for response in responses:
+            parsed = parse_fetch(response)
+            if parsed is not None:
+                results.append(parsed)
+        return results
+
+    async def noop(self) -> List[Response]:
+        return await self.command("NOOP")
+
+    async def idle(
+        self, timeout: float, interrupt: Optional[asyncio.Event] = None
+    ) -> List[Response]:
+        """Ждёт событий ящика до ``timeout`` секунд (IDLE), затем выходит из IDLE.
+
+        ``interrupt`` позволяет досрочно выйти из IDLE, чтобы выполнить другую
+        команду на том же соединении. Возвращает untagged-ответы, полученные за
+        время ожидания (``EXISTS`` и т.п.).
+        """
+
+        tag = self._next_tag()
+        await self._send(f"{tag} IDLE")
+        continuation = await self._read_response()
+        if not bytes(continuation[0]).startswith(b"+"):
+            raise IMAPError(f"Сервер не поддерживает IDLE: {bytes(continuation[0])!r}")
+
+        events: List[Response] = []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        interrupted = asyncio.ensure_future(interrupt.wait()) if interrupt else None
+        reading: Optional[asyncio.Future] = None
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                reading = asyncio.ensure_future(self._read_response())
+                waiters = {reading, interrupted} if interrupted else {reading}
+                await asyncio.wait(waiters, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not reading.done():
+                    reading.cancel()
+                    break
+                response = reading.result()
+                events.append(response)
+                if _EXISTS_RE.match(bytes(response[0])):
+                    break
+        finally:
+            if interrupted is not None:
+                interrupted.cancel()
+            if reading is not None and not reading.done():
+                reading.cancel()
+
+        await self._send("DONE")
+        events.extend(await self._read_until_tagged(tag))
+        return events
+
+    async def logout(self) -> None:
+        try:
+            await self.command("LOGOUT")
+        except (IMAPError, OSError, asyncio.TimeoutError):
+            pass
+        await self.close()
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+        self._reader = self._writer = None
+
+    async def command(self, command: str, sink: Optional[LiteralSink] = None) -> List[Response]:
+        tag = self._next_tag()
+        await self._send(f"{tag} {command}")
+        return await asyncio.wait_for(self._read_until_tagged(tag, sink), self.timeout)
+
+    def _next_tag(self) -> str:
+        self._tag += 1
+        return f"A{self._tag:04d}"
+
+    async def _send(self, line: str) -> None:
+        if self._writer is None:
+            raise IMAPError("Соединение не установлено")
+        self._writer.write(line.encode() + b"\r\n")
+        await self._writer.drain()
+
+    async def _read_until_tagged(
+        self, tag: str, sink: Optional[LiteralSink] = None
+    ) -> List[Response]:
+        prefix = tag.encode() + b" "
+        untagged: List[Response] = []
+        while True:
+            response = await self._read_response(sink)
+            line = bytes(response[0])
+            if not line.startswith(prefix):
+                untagged.append(response)
+                continue
+            status = line[len(prefix):].split(b" ", 1)[0]
+            if status != b"OK":
+                raise IMAPError(line.decode(errors="replace").strip())
+            return untagged
+
+    async def _read_response(self, sink: Optional[LiteralSink] = None) -> Response:
+        if self._reader is None:
+            raise IMAPError("Соединение не установлено")
+        response: Response = []
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                raise IMAPError("Сервер закрыл соединение")
+            response.append(line)
+            literal = _LITERAL_RE.search(line)
+            if not literal:
+                return response
+            size = int(literal.group(1))
+            if sink is None:
+                response.append(bytearray(await self._reader.readexactly(size)))
+                continue
+            while size > 0:
+                chunk = await self._reader.readexactly(min(size, _LITERAL_CHUNK))
+                sink(chunk)
+                size -= len(chunk)
+            response.append(bytearray())
@@ -1,21 +1,43 @@
 """Модуль обработки почты с ИИ-анализом."""
 from __future__ import annotations
 
-import email
-import imaplib
-import poplib
-from email.message import Message as EmailMessage
-from typing import List, Optional
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Optional
 
-from aiogram import Dispatcher, Router
+from aiogram import Bot, Dispatcher, Router
 from aiogram.filters import Command
 from aiogram.types import Message
-from openai import AsyncOpenAI
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.db import get_engine
+from app.core.llm import llm_errors, openai_client
+from app.core.memory import MemoryUsage, estimate_size
+from app.core.metrics import MetricFamily, llm_latency, mail_latency, metrics
 from app.core.modules import Module
-from config import Settings
+from app.modules.mail.archive import MailArchiveIndex, format_results
+from app.modules.mail.cache import AnalysisCache
+from app.modules.mail.classifier import MailClassifier, template_summary
+from app.modules.mail.connection import MAIL_ERRORS
+from app.modules.mail.digest import DigestBuilder
+from app.modules.mail.extraction import ExtractionPool
+from app.modules.mail.envelope import MailEnvelope
+from app.modules.mail.parser import ParsedMail
+from app.modules.mail.service import MailService
+from app.modules.mail.text import slim
+from config import MailAccountSettings, Settings
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 router = Router(name="mail")
+logger = logging.getLogger(__name__)
+
+DIGEST_DEFAULT = 20
+DIGEST_MAX = 100
+_TELEGRAM_CHUNK = 3800
+PROMPT_TEXT_CHARS = 3500
+ATTACHMENTS_PROMPT_CHARS = 3000
 
 
 class MailModule(Module):
@@ -23,29 +45,195 @@ class MailModule(Module):
 
     def __init__(self, settings: Settings):
         super().__init__(settings)
-        self.client: Optional[AsyncOpenAI] = None
-        if settings.openai_api_key:
-            self.client = AsyncOpenAI(
-                api_key=settings.openai_api_key,
-                base_url=settings.openai_base_url,
+        self.mailboxes = MailService(settings)
+        self.analysis_cache = AnalysisCache(
+            ttl_days=settings.mail_analysis_ttl_days,
+            max_entries=settings.mail_analysis_max_entries,
+        )
+        self.archive: Optional[MailArchiveIndex] = None
+        if settings.mail_archive_enabled:
+            self.archive = MailArchiveIndex(body_chars=settings.mail_archive_body_chars)
+        self.extraction: Optional[ExtractionPool] = None
+        if settings.mail_extract_enabled:
+            self.extraction = ExtractionPool(
+                workers=settings.mail_extract_workers,
+                timeout=settings.mail_extract_timeout,
+                max_chars=settings.mail_extract_max_chars,
             )
+        self.classifier: Optional[MailClassifier] = None
+        if settings.mail_classifier_enabled:
+            self.classifier = MailClassifier(threshold=settings.mail_classifier_threshold)
+        self.digest = DigestBuilder(
+            lambda: self.client,
+            settings.openai_model,
+            chunk_token_budget=settings.mail_digest_chunk_tokens,
+            concurrency=settings.mail_digest_concurrency,
+        )
+        # Сколько токенов текста писем ушло бы в LLM без очистки и сколько ушло.
+        self.prompt_tokens_original = 0
+        self.prompt_tokens_sent = 0
+        self._bot: Optional[Bot] = None
+        self._primary = False
+        self._eviction_task: Optional[asyncio.Task] = None
+        metrics.register_collector(self._collect_metrics)
+
+    @property
+    def client(self) -> Optional["AsyncOpenAI"]:
+        return openai_client(self.settings)
 
     def initialize(self, dispatcher: Dispatcher) -> None:
         dispatcher.include_router(router)
 
-    async def process(self, user_id: int, message: str) -> str:
-        return (
+    def _collect_metrics(self):
+        cache = self.analysis_cache
+        lookups = cache.hits + cache.misses
+        yield MetricFamily(
+            "bot_mail_analysis_cache_lookups_total", "counter", "Обращения к кэшу анализа писем"
+        ).add(cache.hits, result="hit").add(cache.misses, result="miss")
+        yield MetricFamily(
+            "bot_mail_analysis_cache_hit_ratio", "gauge", "Доля попаданий в кэш анализа писем"
+        ).add(cache.hits / lookups if lookups else 0.0)
+        if self.classifier is not None:
+            categories = MetricFamily(
+                "bot_mail_classified_total", "counter", "Письма по категориям классификатора"
+            )
+            for category, count in self.classifier.counters.items():
+                categories.add(count, category=category)
+            yield categories
+        yield MetricFamily(
+            "bot_mail_prompt_tokens_total", "counter", "Токены текста писем для LLM (оценка)"
+        ).add(self.prompt_tokens_original, stage="original").add(
+            self.prompt_tokens_sent, stage="sent"
+        )
+
+    async def startup(self, bot: Bot, primary: bool) -> None:
+        self._bot = bot
+        self._primary = primary
+        # При нескольких воркерах постоянные сессии, опрос POP3, уведомления, архив и
+        # очистку кэша ведёт только основной процесс: иначе каждый воркер держал бы свои
+        # соединения и писал бы ту же позицию в mail_sync_state. Остальные воркеры
+        # подключаются к ящикам на время команды.
+        if primary:
+            if self.archive is not None:
+                await self.archive.prepare(get_engine())
+                self.mailboxes.subscribe_sync(self.archive.store)
+            self.mailboxes.subscribe(self._notify_new_mail)
+            self._eviction_task = asyncio.create_task(self.analysis_cache.run_eviction())
+            self.mailboxes.start()
+
+    async def warmup(self) -> None:
+        if self.extraction is not None:
+            # Процессы пула (spawn) запускаются заранее, а не на первом письме.
+            await self.extraction.warmup()
+        # Клиент LLM создаётся сейчас, а не при первом анализе письма.
+        openai_client(self.settings)
+
+    async def health(self) -> Optional[str]:
+        if not self._primary:
+            # Постоянных соединений в этом процессе нет.
+            return None
+        offline = [
+            name
+            for name, mailbox in self.mailboxes.mailboxes.items()
+            if not getattr(mailbox, "connected", True)
+        ]
+        return f"нет соединения с ящиками: {', '.join(offline)}" if offline else None
+
+    def memory_usage(self) -> Optional[MemoryUsage]:
+        # Кэш последних писем каждого ящика вместе с сохранёнными вложениями.
+        envelopes = [
+            envelope
+            for mailbox in self.mailboxes.mailboxes.values()
+            for envelope in mailbox.latest(mailbox.cache_size)
+        ]
+        return MemoryUsage(len(envelopes), estimate_size(envelopes))
+
+    async def shutdown(self) -> None:
+        if self._eviction_task is not None:
+            self._eviction_task.cancel()
+        await self.mailboxes.stop()
+        if self.extraction is not None:
+            self.extraction.shutdown()
+        if self.classifier is not None and self.classifier.counters:
+            logger.info("Категории писем: %s", dict(self.classifier.counters))
+        if self.prompt_tokens_original:
+            logger.info(
+                "Очистка текста писем: ~%s токенов отправлено из ~%s",
+                self.prompt_tokens_sent,
+                self.prompt_tokens_original,
+            )
+
+    async def _notify_new_mail(
+        self, account: MailAccountSettings, envelope: MailEnvelope
+    ) -> None:
+        if self._bot is None:
+            return
+        # Персональный ящик — уведомляем владельца, общий — чаты из MAIL_NOTIFY_CHATS.
+        chats = [account.owner_id] if account.owner_id else self.settings.mail_notify_chats
+        subject = _sanitize_header(envelope.message.get("Subject", "(без темы)"))
+        sender = _sanitize_header(envelope.message.get("From", "(неизвестно)"))
+        for chat_id in chats:
+            await self._bot.send_message(
+                chat_id,
+                f"📬 [{account.name}] Новое письмо от {sender}: {subject}",
+                parse_mode=None,
+            )
+
+    async def process(self, user_id: int, message: str, session: AsyncSession) -> str:
+        help_text = (
             "Я могу получать почту и резюмировать письма. "
             "Используйте /mail для проверки или уточните критерии поиска."
         )
+        if self.archive is None:
+            return help_text
+        # Поиск по локальному архиву: без обращения к почтовому серверу.
+        results = await self.archive.search(
+            session,
+            self.mailboxes.accounts_for(user_id),
+            message,
+            limit=self.settings.mail_archive_search_limit,
+        )
+        if not results:
+            return "В архиве писем ничего не нашлось. " + help_text
+        return format_results(results)
 
     def get_capabilities(self):
-        return ["fetch_mail", "analyze_mail"]
+        return ["fetch_mail", "analyze_mail", "search_mail"]
 
-    async def _analyze(self, mail: EmailMessage) -> str:
-        subject = _sanitize_header(mail.get("Subject", "(без темы)"))
-        sender = _sanitize_header(mail.get("From", "(неизвестно)"))
-        text, attachments = _extract_body_and_attachments(mail)
+    async def analyze(self, session: AsyncSession, mail: ParsedMail) -> str:
+        """Анализ письма с персистентным кэшем (повтор не тратит токены LLM)."""
+
+        try:
+            if not self.client:
+                return await self._analyze(mail)
+            if self.classifier is not None:
+                classification = self.classifier.classify(mail)
+                if classification.low_value:
+                    logger.info(
+                        "Письмо отнесено к «%s» (%s, %.2f), LLM не вызывается",
+                        classification.category,
+                        classification.reason,
+                        classification.confidence,
+                    )
+                    return template_summary(mail, classification)
+            model = self.settings.openai_model
+            cached = await self.analysis_cache.get(session, mail, model)
+            if cached is not None:
+                return cached
+            if self.extraction is not None:
+                # Декодирование и разбор вложений — в пуле процессов, не в event loop.
+                await self.extraction.extract(mail)
+            summary = await self._analyze(mail)
+            await self.analysis_cache.put(session, mail, model, summary)
+            return summary
+        finally:
+            # Письмо остаётся в кэше ящика: сохранённые тела вложений больше не нужны.
+            mail.drop_payloads()
+
+    async def _analyze(self, mail: ParsedMail) -> str:
+        subject = _sanitize_header(mail.headers.get("Subject", "(без темы)"))
+        sender = _sanitize_header(mail.headers.get("From", "(неизвестно)"))
+        text, attachments = mail.text, mail.attachment_names
         if not self.client:
             attachments_info = (
                 f"\nВложений: {len(attachments)} ({', '.join(attachments)})"
@@ -53,93 +241,121 @@ class MailModule(Module):
                 else ""
             )
             return f"Письмо от {sender} с темой '{subject}'.{attachments_info}"
-        response = await self.client.chat.completions.create(
-            model=self.settings.openai_model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "Ты помощник, который кратко классифицирует письмо, выделяет ключевое "
-                        "и отмечает важные вложения."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        f"Тема: {subject}\nОтправитель: {sender}\n"
-                        f"Вложения: {', '.join(attachments) or 'нет'}\n"
-                        f"Текст: {text[:3500]}"
-                    ),
-                },
-            ],
+        # Цитаты, подписи и дисклеймеры отрезаются до обрезки по длине, чтобы в лимит
+        # попадал новый текст письма, а не история переписки.
+        slimmed = slim(text)
+        prompt_text = slimmed.text[:PROMPT_TEXT_CHARS]
+        self.prompt_tokens_original += slimmed.original_tokens
+        self.prompt_tokens_sent += slimmed.tokens
+        logger.info(
+            "Текст письма для анализа: ~%s токенов вместо ~%s (сэкономлено ~%s)",
+            slimmed.tokens,
+            slimmed.original_tokens,
+            slimmed.saved_tokens,
         )
+        extracted = _attachments_text(mail)
+        with llm_latency.time(purpose="mail_analysis"):
+            response = await self.client.chat.completions.create(
+                model=self.settings.openai_model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": (
+                            "Ты помощник, который кратко классифицирует письмо, выделяет ключевое "
+                            "и отмечает важные вложения."
+                        ),
+                    },
+                    {
+                        "role": "user",
+                        "content": (
+                            f"Тема: {subject}\nОтправитель: {sender}\n"
+                            f"Вложения: {', '.join(attachments) or 'нет'}\n"
+                            f"Текст: {prompt_text}"
+                            + (f"\nСодержимое вложений:\n{extracted}" if extracted else "")
+                        ),
+                    },
+                ],
+            )
         return response.choices[0].message.content or "Не удалось проанализировать письмо"
 
 
-def _fetch_imap(settings: Settings, limit: int = 1) -> List[EmailMessage]:
-    if not settings.mail_host or not settings.mail_username or not settings.mail_password:
-        return []
-    mails: List[EmailMessage] = []
-    with imaplib.IMAP4_SSL(settings.mail_host, settings.mail_port) as client:
-        client.login(settings.mail_username, settings.mail_password)
-        client.select("INBOX")
-        _, data = client.search(None, "ALL")
-        ids = data[0].split()[-limit:]
-        for uid in ids:
-            _, msg_data = client.fetch(uid, "(RFC822)")
-            raw = msg_data[0][1]
-            mails.append(email.message_from_bytes(raw))
-    return mails
-
-
-def _fetch_pop3(settings: Settings, limit: int = 1) -> List[EmailMessage]:
-    if not settings.mail_host or not settings.mail_username or not settings.mail_password:
-        return []
-    mails: List[EmailMessage] = []
-    with poplib.POP3_SSL(settings.mail_host, settings.mail_port) as client:
-        client.user(settings.mail_username)
-        client.pass_(settings.mail_password)
-        total, _ = client.stat()
-        for idx in range(max(1, total - limit + 1), total + 1):
-            response, lines, octets = client.retr(idx)
-            raw = b"\n".join(lines)
-            mails.append(email.message_from_bytes(raw))
-    return mails
+def _attachments_text(mail: ParsedMail) -> str:
+    """Текст, извлечённый из вложений, в пределах ``ATTACHMENTS_PROMPT_CHARS``."""
+
+    chunks = [f"[{a.name}] {a.text}" for a in mail.attachments if a.text]
+    return "\n".join(chunks)[:ATTACHMENTS_PROMPT_CHARS]
 
 
 def _sanitize_header(value: str) -> str:
-    return value.replace("\r", " ").replace("\n", " ").strip()
-
-
-def _extract_body_and_attachments(mail: EmailMessage) -> tuple[str, List[str]]:
-    text = ""
-    attachments: List[str] = []
-    if mail.is_multipart():
-        for part in mail.walk():
-            content_disposition = part.get("Content-Disposition", "")
-            if content_disposition and "attachment" in content_disposition.lower():
-                filename = part.get_filename()
-                if filename:
-                    attachments.append(_sanitize_header(filename))
-                continue
-            if part.get_content_type() == "text/plain" and not text:
-                payload = part.get_payload(decode=True) or b""
-                text = payload.decode(errors="ignore")
-    else:
-        payload = mail.get_payload(decode=True) or b""
-        text = payload.decode(errors="ignore")
-    return text.strip(), attachments
+    return str(value).replace("\r", " ").replace("\n", " ").strip()
 
 
 @router.message(Command("mail"))
-async def check_mail(message: Message):
-    settings: Settings = message.conf.get("settings")  # type: ignore[attr-defined]
+async def check_mail(message: Message, session: AsyncSession):
     module: MailModule = message.conf.get("registry").get_module("mail")  # type: ignore[attr-defined]
 
-    fetcher = _fetch_imap if settings.mail_protocol.lower() == "imap" else _fetch_pop3
-    mails = await message.bot.loop.run_in_executor(None, fetcher, settings, 1)
-    if not mails:
+    mailbox = module.mailboxes.for_user(message.from_user.id)
+    if mailbox is None:
         await message.answer("Нет писем или не настроено соединение с почтой")
         return
-    summary = await module._analyze(mails[0])
-    await message.answer(summary)
+
+    args = (message.text or "").split()[1:]
+    if args and args[0].lower() == "digest":
+        await _send_digest(message, module, mailbox, args[1:], session)
+        return
+
+    try:
+        # IMAP-сессия уже держит свежие заголовки (IDLE), POP3 догружает только новые UIDL.
+        with mail_latency.time(operation="refresh"):
+            await mailbox.refresh()
+        envelopes = mailbox.latest(1)
+        # Полное тело запрашивается, только если без него не узнать вложения.
+        with mail_latency.time(operation="load_full"):
+            mail = await mailbox.load_full(envelopes[0]) if envelopes else None
+        if mail is not None and module.archive is not None and envelopes[0].complete:
+            await module.archive.update_body(mailbox.account, envelopes[0].uid, mail)
+    except MAIL_ERRORS as exc:
+        logger.warning("Ошибка почтового сервера: %s", exc)
+        await message.answer("Почтовый сервер недоступен. Попробуйте позже.")
+        return
+    if mail is None:
+        await message.answer("Нет писем или не настроено соединение с почтой")
+        return
+    try:
+        summary = await module.analyze(session, mail)
+    except llm_errors() as exc:
+        logger.warning("Ошибка LLM при анализе письма: %s", exc)
+        await message.answer("Сервис анализа писем недоступен. Попробуйте позже.")
+        return
+    # Ответ LLM и шаблон классификатора — обычный текст с адресами вида «<addr@host>».
+    await message.answer(summary, parse_mode=None)
+
+
+async def _send_digest(message: Message, module: MailModule, mailbox, args, session: AsyncSession):
+    """``/mail digest N`` — сводка по последним N письмам."""
+
+    count = DIGEST_DEFAULT
+    if args:
+        if not args[0].isdigit():
+            await message.answer("Использование: /mail digest N (N — число писем)")
+            return
+        count = min(max(1, int(args[0])), DIGEST_MAX)
+
+    await message.answer(f"Готовлю дайджест по {count} письмам...")
+    try:
+        with mail_latency.time(operation="refresh"):
+            await mailbox.refresh()
+        with mail_latency.time(operation="recent"):
+            envelopes = await mailbox.recent(count)
+    except MAIL_ERRORS as exc:
+        logger.warning("Ошибка почтового сервера: %s", exc)
+        await message.answer("Почтовый сервер недоступен. Попробуйте позже.")
+        return
+    try:
+        digest = await module.digest.build(envelopes)
+    except llm_errors() as exc:
+        logger.warning("Ошибка LLM при подготовке дайджеста: %s", exc)
+        await message.answer("Не удалось подготовить дайджест: сервис анализа недоступен.")
+        return
+    for start in range(0, len(digest), _TELEGRAM_CHUNK):
+        await message.answer(digest[start : start + _TELEGRAM_CHUNK], parse_mode=None)
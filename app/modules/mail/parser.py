@@ -0,0 +1,347 @@
+"""Потоковый разбор MIME с ограничением памяти.
+
+Письмо подаётся кусками (``feed``) прямо из сетевого ответа. Заголовки каждой части
+разбираются ``BytesFeedParser``, тела вложений не декодируются и не хранятся —
+считается только их размер. Из текстовых частей сохраняется не больше
+``max_text_bytes``; если ``text/plain`` нет, текст извлекается из ``text/html``.
+
+Вложения, для которых ``capture`` вернул ``True``, сохраняются в исходной
+(закодированной) форме не длиннее ``max_capture_bytes`` — для извлечения текста
+вне event loop (``app.modules.mail.extraction``). Все сохранённые вложения письма
+вместе не превышают ``max_capture_total`` байт: когда бюджет исчерпан, остальные
+вложения только учитываются, как обычные.
+"""
+from __future__ import annotations
+
+import base64
+import binascii
+import html
+import quopri
+import re
+from dataclasses import dataclass, field
+from email import policy
+from email.feedparser import BytesFeedParser
+from email.message import Message as EmailMessage
+from html.parser import HTMLParser
+from typing import Callable, List, Optional
+
+MAX_TEXT_BYTES = 64 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+MAX_LINE_BYTES = 64 * 1024
+MAX_PARTS = 200
+MAX_CAPTURE_TOTAL_BYTES = 16 * 1024 * 1024
+
+_WS_RE = re.compile(r"[ \t]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+@dataclass
+class AttachmentInfo:
+    name: str
+    content_type: str
+    size: int  # оценка размера после декодирования, байт
+    # Исходное тело (до декодирования transfer-encoding), если вложение сохранено.
+    payload: Optional[bytes] = None
+    encoding: str = "7bit"
+    charset: Optional[str] = None
+    # Текст, извлечённый из вложения.
+    text: Optional[str] = None
+
+
+@dataclass
+class ParsedMail:
+    headers: EmailMessage
+    text: str = ""
+    attachments: List[AttachmentInfo] = field(default_factory=list)
+    truncated: bool = False
+    size: int = 0
+
+    @property
+    def attachment_names(self) -> List[str]:
+        return [attachment.name for attachment in self.attachments]
+
+    def drop_payloads(self) -> None:
+        """Освобождает сохранённые тела вложений (письмо может жить в кэше ящика)."""
+
+        for attachment in self.attachments:
+            attachment.payload = None
+
+
+class _HTMLText(HTMLParser):
+    _SKIP = {"script", "style", "head"}
+    _BREAKS = {"br", "p", "div", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6"}
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.chunks: List[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP:
+            self._skip_depth += 1
+        elif tag in self._BREAKS:
+            self.chunks.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in self._BREAKS:
+            self.chunks.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.chunks.append(data)
+
+
+def html_to_text(markup: str) -> str:
+    """Грубое преобразование HTML в текст (без скриптов, стилей и тегов)."""
+
+    parser = _HTMLText()
+    try:
+        parser.feed(markup)
+        parser.close()
+    except Exception:  # pragma: no cover - битый HTML
+        return html.unescape(re.sub(r"<[^>]+>", " ", markup))
+    text = "".join(parser.chunks)
+    lines = (_WS_RE.sub(" ", line).strip() for line in text.splitlines())
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def decode_transfer(data: bytes, encoding: str) -> bytes:
+    """Декодирует base64/quoted-printable, терпимо к обрезанному концу."""
+
+    encoding = encoding.lower()
+    if encoding == "base64":
+        compact = re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+        compact = compact[: len(compact) - len(compact) % 4]
+        try:
+            return base64.b64decode(compact)
+        except (binascii.Error, ValueError):
+            return b""
+    if encoding == "quoted-printable":
+        return quopri.decodestring(data)
+    return data
+
+
+class _Part:
+    """Текущая листовая часть: заголовки и (для текста) ограниченный буфер тела."""
+
+    def __init__(self, headers: EmailMessage, role: str, capture: bool = False):
+        self.headers = headers
+        self.role = role  # text / html / attachment / skip
+        self.capture = capture
+        self.buffer = bytearray()
+        self.raw_size = 0
+        self.overflow = False
+
+
+class StreamingMailParser:
+    """Разбирает письмо построчно, удерживая в памяти только ограниченные буферы."""
+
+    def __init__(
+        self,
+        max_text_bytes: int = MAX_TEXT_BYTES,
+        max_header_bytes: int = MAX_HEADER_BYTES,
+        max_parts: int = MAX_PARTS,
+        capture: Optional[Callable[[EmailMessage], bool]] = None,
+        max_capture_bytes: int = 0,
+        max_capture_total: int = MAX_CAPTURE_TOTAL_BYTES,
+    ):
+        self.max_text_bytes = max_text_bytes
+        self.max_header_bytes = max_header_bytes
+        self.max_parts = max_parts
+        self.capture = capture
+        self.max_capture_bytes = max_capture_bytes
+        self.max_capture_total = max_capture_total
+        # Байт в буферах сохраняемых вложений этого письма.
+        self._captured = 0
+        self._pending = bytearray()
+        self._boundaries: List[bytes] = []
+        self._in_headers = True
+        self._header_parser: Optional[BytesFeedParser] = BytesFeedParser(policy=policy.default)
+        self._header_bytes = 0
+        self._part: Optional[_Part] = None
+        self._root: Optional[EmailMessage] = None
+        self._text: Optional[str] = None
+        self._html: Optional[str] = None
+        self._parts_seen = 0
+        self._truncated = False
+        self._size = 0
+        self.attachments: List[AttachmentInfo] = []
+
+    def feed(self, data: bytes) -> None:
+        self._size += len(data)
+        self._pending.extend(data)
+        while True:
+            idx = self._pending.find(b"\n")
+            if idx < 0:
+                break
+            line = bytes(self._pending[: idx + 1])
+            del self._pending[: idx + 1]
+            self._line(line)
+        if len(self._pending) > MAX_LINE_BYTES:
+            # Строка без перевода строки не может быть границей — отдаём как данные.
+            line = bytes(self._pending)
+            self._pending.clear()
+            self._body_line(line)
+
+    def close(self) -> ParsedMail:
+        if self._pending:
+            self._line(bytes(self._pending))
+            self._pending.clear()
+        if self._in_headers:
+            self._finish_headers()
+        self._finish_part()
+        text = self._text
+        if not text and self._html:
+            text = html_to_text(self._html)
+        return ParsedMail(
+            headers=self._root if self._root is not None else EmailMessage(policy=policy.default),
+            text=(text or "").strip(),
+            attachments=self.attachments,
+            truncated=self._truncated,
+            size=self._size,
+        )
+
+    def _line(self, line: bytes) -> None:
+        if self._in_headers:
+            if line in (b"\r\n", b"\n"):
+                self._finish_headers()
+                return
+            self._header_bytes += len(line)
+            if self._header_bytes <= self.max_header_bytes and self._header_parser is not None:
+                self._header_parser.feed(line)
+            else:
+                self._truncated = True
+            return
+
+        if self._boundaries and line.startswith(b"--"):
+            stripped = line.rstrip()
+            for depth in range(len(self._boundaries) - 1, -1, -1):
+                boundary = self._boundaries[depth]
+                if stripped == boundary:
+                    self._finish_part()
+                    del self._boundaries[depth + 1:]
+                    self._start_headers()
+                    return
+                if stripped == boundary + b"--":
+                    self._finish_part()
+                    del self._boundaries[depth:]
+                    return
+        self._body_line(line)
+
+    def _body_line(self, line: bytes) -> None:
+        part = self._part
+        if part is None:
+            return  # преамбула/эпилог multipart
+        part.raw_size += len(line.rstrip(b"\r\n"))
+        if part.role in ("text", "html") and not part.overflow:
+            if len(part.buffer) + len(line) > self.max_text_bytes:
+                part.overflow = True
+                self._truncated = True
+            else:
+                part.buffer.extend(line)
+        elif part.capture and not part.overflow:
+            if (
+                len(part.buffer) + len(line) > self.max_capture_bytes
+                or self._captured + len(line) > self.max_capture_total
+            ):
+                # Слишком большое вложение не сохраняем вовсе: обрезанный PDF/DOCX бесполезен.
+                part.overflow = True
+                self._captured -= len(part.buffer)
+                part.buffer = bytearray()
+            else:
+                part.buffer.extend(line)
+                self._captured += len(line)
+
+    def _start_headers(self) -> None:
+        self._in_headers = True
+        self._header_bytes = 0
+        self._parts_seen += 1
+        if self._parts_seen > self.max_parts:
+            self._truncated = True
+            self._header_parser = None
+        else:
+            self._header_parser = BytesFeedParser(policy=policy.default)
+
+    def _finish_headers(self) -> None:
+        self._in_headers = False
+        parser, self._header_parser = self._header_parser, None
+        if parser is None:
+            self._part = _Part(EmailMessage(policy=policy.default), "skip")
+            return
+        headers = parser.close()
+        if self._root is None:
+            self._root = headers
+
+        if headers.get_content_maintype() == "multipart":
+            boundary = headers.get_boundary()
+            if boundary:
+                self._boundaries.append(b"--" + boundary.encode("ascii", "ignore"))
+                self._part = None
+                return
+        role = self._role(headers)
+        capture = (
+            role == "attachment"
+            and self.capture is not None
+            and self.max_capture_bytes > 0
+            and self._captured < self.max_capture_total
+            and self.capture(headers)
+        )
+        self._part = _Part(headers, role, capture)
+
+    def _role(self, headers: EmailMessage) -> str:
+        disposition = (headers.get_content_disposition() or "").lower()
+        content_type = headers.get_content_type()
+        if disposition == "attachment" or headers.get_filename():
+            return "attachment"
+        if content_type == "text/plain" and self._text is None:
+            return "text"
+        if content_type == "text/html" and self._html is None:
+            return "html"
+        if headers.get_content_maintype() in ("text", "multipart"):
+            return "skip"
+        return "attachment"
+
+    def _finish_part(self) -> None:
+        part, self._part = self._part, None
+        if part is None:
+            return
+        encoding = str(part.headers.get("Content-Transfer-Encoding", "7bit")).strip()
+        if part.role == "attachment":
+            size = part.raw_size * 3 // 4 if encoding.lower() == "base64" else part.raw_size
+            name = part.headers.get_filename() or part.headers.get_content_type()
+            captured = part.capture and not part.overflow
+            self.attachments.append(
+                AttachmentInfo(
+                    name=_clean(name),
+                    content_type=part.headers.get_content_type(),
+                    size=size,
+                    payload=bytes(part.buffer) if captured else None,
+                    encoding=encoding,
+                    charset=part.headers.get_content_charset(),
+                )
+            )
+            return
+        if part.role not in ("text", "html"):
+            return
+        charset = part.headers.get_content_charset() or "utf-8"
+        payload = decode_transfer(bytes(part.buffer), encoding)
+        try:
+            decoded = payload.decode(charset, errors="replace")
+        except LookupError:
+            decoded = payload.decode("utf-8", errors="replace")
+        if part.role == "text":
+            self._text = decoded
+        else:
+            self._html = decoded
+
+
+def _clean(value: str) -> str:
+    return value.replace("\r", " ").replace("\n", " ").strip()
+
+
+def parse_bytes(raw: bytes, **limits) -> ParsedMail:
+    parser = StreamingMailParser(**limits)
+    parser.feed(raw)
+    return parser.close()
@@ -0,0 +1,113 @@
+"""Минимальный асинхронный POP3-клиент поверх asyncio streams (RFC 1939)."""
+from __future__ import annotations
+
+import asyncio
+import ssl
+from typing import Callable, Dict, List, Optional, Tuple
+
+LineSink = Callable[[bytes], None]
+
+
+class POP3Error(Exception):
+    """Сервер ответил ``-ERR`` или разорвал соединение."""
+
+
+class AsyncPOP3Client:
+    """Одно POP3-соединение: USER/PASS, LIST, UIDL, TOP, RETR и QUIT."""
+
+    def __init__(self, host: str, port: int = 995, use_ssl: bool = True, timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def connect(self) -> None:
+        context = ssl.create_default_context() if self.use_ssl else None
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=context, limit=2**20),
+            self.timeout,
+        )
+        await self._status()
+
+    async def login(self, username: str, password: str) -> None:
+        await self._command(f"USER {username}")
+        await self._command(f"PASS {password}")
+
+    async def uidl(self) -> List[Tuple[int, str]]:
+        entries = []
+        for line in await self._multiline("UIDL"):
+            number, _, uidl = line.decode(errors="ignore").partition(" ")
+            entries.append((int(number), uidl.strip()))
+        return entries
+
+    async def list(self) -> Dict[int, int]:
+        sizes = {}
+        for line in await self._multiline("LIST"):
+            number, _, size = line.decode(errors="ignore").partition(" ")
+            sizes[int(number)] = int(size.strip() or 0)
+        return sizes
+
+    async def top(self, number: int, lines: int) -> bytes:
+        return b"\r\n".join(await self._multiline(f"TOP {number} {lines}"))
+
+    async def retr(self, number: int) -> bytes:
+        return b"\r\n".join(await self._multiline(f"RETR {number}"))
+
+    async def retr_into(self, number: int, sink: LineSink) -> None:
+        """RETR без буферизации письма: строки отдаются в ``sink`` по мере чтения."""
+
+        await self._multiline(f"RETR {number}", sink=sink)
+
+    async def quit(self) -> None:
+        try:
+            await self._command("QUIT")
+        except (POP3Error, OSError, asyncio.TimeoutError):
+            pass
+        await self.close()
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+        self._reader = self._writer = None
+
+    async def _command(self, line: str) -> bytes:
+        if self._writer is None:
+            raise POP3Error("Соединение не установлено")
+        self._writer.write(line.encode() + b"\r\n")
+        await self._writer.drain()
+        return await self._status()
+
+    async def _status(self) -> bytes:
+        line = await self._readline()
+        if not line.startswith(b"+OK"):
+            raise POP3Error(line.decode(errors="replace").strip())
+        return line
+
+    async def _multiline(self, command: str, sink: Optional[LineSink] = None) -> List[bytes]:
+        await self._command(command)
+        lines: List[bytes] = []
+        while True:
+            line = (await self._readline()).rstrip(b"\r\n")
+            if line == b".":
+                return lines
+            # Снимаем byte-stuffing: строки, начинающиеся с точки, передаются как «..».
+            if line.startswith(b".."):
+                line = line[1:]
+            if sink is None:
+                lines.append(line)
+            else:
+                sink(line + b"\r\n")
+
+    async def _readline(self) -> bytes:
+        if self._reader is None:
+            raise POP3Error("Соединение не установлено")
+        line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+        if not line:
+            raise POP3Error("Сервер закрыл соединение")
+        return line
@@ -0,0 +1,138 @@
+"""Набор почтовых ящиков модуля: общий лимит соединений и опрос POP3."""
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+from typing import Dict, List, Optional
+
+from app.modules.mail.connection import (
+    MAIL_ERRORS,
+    MailConnectionManager,
+    NewMailListener,
+    ParserFactory,
+    Pop3Mailbox,
+    SyncListener,
+)
+from app.modules.mail.extraction import is_extractable
+from app.modules.mail.parser import StreamingMailParser
+from config import MailAccountSettings, Settings
+
+logger = logging.getLogger(__name__)
+
+Mailbox = MailConnectionManager | Pop3Mailbox
+
+DEFAULT_ACCOUNT = "default"
+
+
+def load_accounts(settings: Settings) -> List[MailAccountSettings]:
+    """Ящик из ``MAIL_*`` (если настроен) плюс ящики из ``MAIL_ACCOUNTS``."""
+
+    accounts: List[MailAccountSettings] = []
+    if settings.mail_host and settings.mail_username and settings.mail_password:
+        accounts.append(
+            MailAccountSettings(
+                name=DEFAULT_ACCOUNT,
+                host=settings.mail_host,
+                port=settings.mail_port,
+                use_ssl=settings.mail_use_ssl,
+                username=settings.mail_username,
+                password=settings.mail_password,
+                protocol=settings.mail_protocol,
+            )
+        )
+    accounts.extend(settings.mail_accounts)
+    return accounts
+
+
+class MailService:
+    """Обслуживает все настроенные ящики в одном event loop.
+
+    Сетевые операции всех ящиков делят один семафор ``MAIL_MAX_CONNECTIONS``,
+    поэтому командный и персональные ящики опрашиваются параллельно без потоков
+    и без перегрузки почтового сервера. IMAP-ящики получают новые письма через
+    IDLE, POP3-ящики опрашиваются раз в ``MAIL_POLL_INTERVAL`` секунд.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.limiter = asyncio.Semaphore(max(1, settings.mail_max_connections))
+        self.mailboxes: Dict[str, Mailbox] = {}
+        parser_factory: ParserFactory = StreamingMailParser
+        if settings.mail_extract_enabled:
+            # Вложения, из которых можно извлечь текст, сохраняются при полной загрузке.
+            parser_factory = functools.partial(
+                StreamingMailParser,
+                capture=is_extractable,
+                max_capture_bytes=settings.mail_extract_max_bytes,
+                max_capture_total=settings.mail_extract_max_total_bytes,
+            )
+        for account in load_accounts(settings):
+            if account.protocol.lower() == "imap":
+                mailbox: Mailbox = MailConnectionManager(
+                    account,
+                    self.limiter,
+                    idle_timeout=settings.mail_idle_timeout,
+                    parser_factory=parser_factory,
+                )
+            else:
+                mailbox = Pop3Mailbox(account, self.limiter, parser_factory=parser_factory)
+            self.mailboxes[account.name] = mailbox
+        self._poll_task: Optional[asyncio.Task] = None
+
+    def subscribe(self, listener: NewMailListener) -> None:
+        for mailbox in self.mailboxes.values():
+            mailbox.subscribe(listener)
+
+    def subscribe_sync(self, listener: SyncListener) -> None:
+        for mailbox in self.mailboxes.values():
+            mailbox.subscribe_sync(listener)
+
+    def accounts_for(self, user_id: int) -> List[str]:
+        """Имена ящиков, доступных пользователю: персональный и общие."""
+
+        return [
+            name
+            for name, mailbox in self.mailboxes.items()
+            if mailbox.account.owner_id in (None, user_id)
+        ]
+
+    def for_user(self, user_id: int) -> Optional[Mailbox]:
+        """Персональный ящик пользователя, иначе первый общий."""
+
+        shared = None
+        for mailbox in self.mailboxes.values():
+            owner = mailbox.account.owner_id
+            if owner == user_id:
+                return mailbox
+            if owner is None and shared is None:
+                shared = mailbox
+        return shared
+
+    def start(self) -> None:
+        for mailbox in self.mailboxes.values():
+            mailbox.start()
+        if any(isinstance(m, Pop3Mailbox) for m in self.mailboxes.values()):
+            self._poll_task = asyncio.create_task(self._poll_pop3(), name="mail-pop3-poll")
+
+    async def stop(self) -> None:
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            try:
+                await self._poll_task
+            except asyncio.CancelledError:
+                pass
+            self._poll_task = None
+        await asyncio.gather(*(mailbox.stop() for mailbox in self.mailboxes.values()))
+
+    async def _poll_pop3(self) -> None:
+        mailboxes = [m for m in self.mailboxes.values() if isinstance(m, Pop3Mailbox)]
+        while True:
+            await asyncio.gather(*(self._poll_one(mailbox) for mailbox in mailboxes))
+            await asyncio.sleep(self.settings.mail_poll_interval)
+
+    async def _poll_one(self, mailbox: Pop3Mailbox) -> None:
+        try:
+            await mailbox.refresh()
+        except MAIL_ERRORS as exc:
+            logger.warning("POP3 %s: ошибка опроса (%s)", mailbox.account.name, exc)
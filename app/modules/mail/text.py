@@ -0,0 +1,193 @@
+"""Текстовые утилиты модуля почты: оценка токенов и «похудение» текста перед LLM."""
+from __future__ import annotations
+
+import html
+import math
+import re
+from dataclasses import dataclass
+from typing import List
+
+# Грубая оценка: для смеси русского и английского текста ~3 символа на токен.
+CHARS_PER_TOKEN = 3
+
+# Если после отрезания цитат остаётся меньше, письмо — чистая пересылка/цитата,
+# и в LLM уходит цитируемый текст.
+MIN_NEW_CONTENT_CHARS = 20
+# Подпись ищется только в нижней части письма, чтобы не отрезать текст по
+# «С уважением» в середине.
+SIGNATURE_TAIL_LINES = 12
+# После прощальной фразы («Спасибо», «Best») подписью считаются не больше стольких
+# коротких строк: имя, должность, телефон. Длинная строка ниже — продолжение письма.
+SIGNATURE_MAX_LINES = 4
+SIGNATURE_LINE_CHARS = 60
+# Абзацы об отписке удаляются только в конце письма (последние столько абзацев).
+FOOTER_PARAGRAPHS = 2
+LONG_URL_CHARS = 60
+
+# Начало цитируемой переписки: всё ниже — история.
+_REPLY_HEADER_RES = [
+    re.compile(r"^-{2,}\s*(Original Message|Исходное сообщение|Пересылаемое сообщение)\s*-{2,}", re.I),
+    re.compile(r"^On .{4,200} wrote:\s*$", re.I),
+    re.compile(r"^.{4,200}\s(пишет|написал|написала|написал\(а\)):\s*$", re.I),
+    re.compile(r"^_{10,}\s*$"),
+]
+# Блок заголовков Outlook («From: … / Sent: …») — считается цитатой, только если
+# за «From:» в ближайших строках идут другие заголовки письма.
+_QUOTED_FROM_RE = re.compile(r"^(From|От):\s.+$", re.I)
+_QUOTED_FIELD_RE = re.compile(r"^(Sent|Date|To|Subject|Отправлено|Дата|Кому|Тема):\s", re.I)
+# Строка, после которой начинается подпись: разделитель «-- » и «Sent from my …».
+_SIGNATURE_RES = [
+    re.compile(r"^--\s*$"),
+    re.compile(r"^(sent from my|отправлено с|отправлено из)\b", re.I),
+]
+# Прощальная фраза: подпись, только если ниже короткий «хвост» (см. SIGNATURE_MAX_LINES).
+_CLOSING_RES = [
+    re.compile(
+        r"^(с уважением|с наилучшими пожеланиями|всего доброго|спасибо|best regards|"
+        r"kind regards|regards|best|cheers|thanks|thank you)[,.!]?\s*$",
+        re.I,
+    ),
+]
+# Шаблонные абзацы: дисклеймеры, «напечатайте только при необходимости».
+_BOILERPLATE_RES = [
+    re.compile(r"(this (e-?mail|message)|the information).{0,80}(confidential|intended (solely|only))", re.I),
+    re.compile(r"(конфиденциальн|предназначен[оа]? (только|исключительно)).{0,80}(адресат|получател)", re.I),
+    re.compile(r"(please consider the environment|подумайте об окружающей среде)", re.I),
+    re.compile(r"^\s*(view|открыть) (in|в) (browser|браузере)", re.I),
+]
+# Ссылка отписки: слово «unsubscribe» вместе со ссылкой или призывом перейти по ней.
+# Просьба «unsubscribe me from …» в тексте письма под это не подходит.
+_UNSUBSCRIBE_RE = re.compile(r"\b(unsubscribe|отписаться|отказаться от рассылки)\b", re.I)
+_LINK_RE = re.compile(r"https?://|\[ссылка:|\bwww\.", re.I)
+_LINK_CALL_RE = re.compile(r"\b(click|here|link|нажмите|здесь|ссылк\w*|перейдите)\b", re.I)
+_TAG_RE = re.compile(r"</?[a-zA-Z][^>]{0,200}>")
+_URL_RE = re.compile(r"https?://([^/\s]+)\S*")
+_WS_RE = re.compile(r"[ \t ]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+@dataclass
+class SlimText:
+    text: str
+    original_tokens: int
+    tokens: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(0, self.original_tokens - self.tokens)
+
+
+def estimate_tokens(text: str) -> int:
+    """Приблизительное число токенов без обращения к токенизатору модели."""
+
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def slim(text: str) -> SlimText:
+    r"""Оставляет в письме новое содержимое: без цитат, подписи и шаблонных абзацев.
+
+    Новый текст письма идёт первым; если его нет (пересылка или голая цитата),
+    возвращается очищенный цитируемый текст.
+
+    >>> slim("Спасибо!\nДокументы получил, завтра отправлю подписанный договор.").text
+    'Спасибо!\nДокументы получил, завтра отправлю подписанный договор.'
+    >>> slim("Документы получил, завтра отправлю договор.\n\nСпасибо!\nИван Петров").text
+    'Документы получил, завтра отправлю договор.'
+    >>> slim("Please unsubscribe me from the board meeting invites, "
+    ...      "and move budget review to Monday.").text
+    'Please unsubscribe me from the board meeting invites, and move budget review to Monday.'
+    >>> slim("Новые скидки недели.\n\nЧтобы отписаться, нажмите здесь.").text
+    'Новые скидки недели.'
+    """
+
+    lines = _normalize(text).split("\n")
+    new, quoted = _split_quoted(lines)
+    body = _cleanup(_strip_signature(new))
+    if len(body) < MIN_NEW_CONTENT_CHARS:
+        body = _cleanup(_strip_signature(quoted)) or body
+    return SlimText(text=body, original_tokens=estimate_tokens(text), tokens=estimate_tokens(body))
+
+
+def _normalize(text: str) -> str:
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    # Остатки HTML, которые пришли в text/plain части.
+    text = html.unescape(_TAG_RE.sub(" ", text))
+    # Трекинговые ссылки занимают десятки токенов — оставляем только домен.
+    return _URL_RE.sub(
+        lambda m: m.group(0) if len(m.group(0)) <= LONG_URL_CHARS else f"[ссылка: {m.group(1)}]",
+        text,
+    )
+
+
+def _split_quoted(lines: List[str]) -> tuple[List[str], List[str]]:
+    """Делит письмо на новый текст и цитируемую историю."""
+
+    new: List[str] = []
+    quoted: List[str] = []
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if any(pattern.match(stripped) for pattern in _REPLY_HEADER_RES) or _is_quoted_headers(
+            lines, index
+        ):
+            # Заголовок цитаты: всё ниже — история переписки.
+            quoted.extend(_unquote(l) for l in lines[index + 1 :])
+            break
+        if stripped.startswith(">"):
+            quoted.append(_unquote(line))
+        else:
+            new.append(line)
+    return new, quoted
+
+
+def _is_quoted_headers(lines: List[str], index: int) -> bool:
+    if not _QUOTED_FROM_RE.match(lines[index].strip()):
+        return False
+    return any(_QUOTED_FIELD_RE.match(line.strip()) for line in lines[index + 1 : index + 4])
+
+
+def _unquote(line: str) -> str:
+    return line.lstrip().lstrip(">").lstrip() if line.lstrip().startswith(">") else line
+
+
+def _strip_signature(lines: List[str]) -> List[str]:
+    start = max(0, len(lines) - SIGNATURE_TAIL_LINES)
+    for index in range(start, len(lines)):
+        stripped = lines[index].strip()
+        # Подпись не может быть первой строкой: выше должен остаться текст письма.
+        if not any(line.strip() for line in lines[:index]):
+            continue
+        if any(pattern.match(stripped) for pattern in _SIGNATURE_RES):
+            return lines[:index]
+        if any(pattern.match(stripped) for pattern in _CLOSING_RES) and _is_signature_tail(
+            lines[index + 1 :]
+        ):
+            return lines[:index]
+    return lines
+
+
+def _is_signature_tail(lines: List[str]) -> bool:
+    tail = [line.strip() for line in lines if line.strip()]
+    return len(tail) <= SIGNATURE_MAX_LINES and all(
+        len(line) <= SIGNATURE_LINE_CHARS for line in tail
+    )
+
+
+def _is_unsubscribe_footer(paragraph: str, index: int, total: int) -> bool:
+    if not _UNSUBSCRIBE_RE.search(paragraph):
+        return False
+    if _LINK_RE.search(paragraph):
+        return True
+    in_footer = index > 0 and index >= total - FOOTER_PARAGRAPHS
+    return in_footer and bool(_LINK_CALL_RE.search(paragraph))
+
+
+def _cleanup(lines: List[str]) -> str:
+    text = "\n".join(_WS_RE.sub(" ", line).strip() for line in lines)
+    paragraphs = [paragraph.strip() for paragraph in text.split("\n\n") if paragraph.strip()]
+    kept = [
+        paragraph
+        for index, paragraph in enumerate(paragraphs)
+        if not any(p.search(paragraph) for p in _BOILERPLATE_RES)
+        and not _is_unsubscribe_footer(paragraph, index, len(paragraphs))
+    ]
+    return _BLANK_LINES_RE.sub("\n\n", "\n\n".join(kept)).strip()
@@ -5,10 +5,24 @@
 """
 from typing import List
 
-from pydantic import Field, field_validator
+from pydantic import BaseModel, Field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
+class MailAccountSettings(BaseModel):
+    """Дополнительный почтовый ящик (элемент JSON-списка MAIL_ACCOUNTS)."""
+
+    name: str
+    host: str
+    port: int = 993
+    use_ssl: bool = True
+    username: str
+    password: str
+    protocol: str = "imap"  # imap/pop3
+    # Telegram ID владельца персонального ящика; None — общий (командный) ящик.
+    owner_id: int | None = None
+
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -38,10 +52,75 @@ class Settings(BaseSettings):
     openai_model: str = Field(default="gpt-4o-mini", env="OPENAI_MODEL")
     context_window_messages: int = Field(default=20, env="CONTEXT_WINDOW_MESSAGES")
     context_max_chars: int = Field(default=8000, env="CONTEXT_MAX_CHARS")
+    # Хранение истории: после CONTEXT_TTL_DAYS без сообщений история удаляется.
+    context_ttl_days: int = Field(default=30, env="CONTEXT_TTL_DAYS")
+    context_maintenance_interval: int = Field(
+        default=3600, env="CONTEXT_MAINTENANCE_INTERVAL"
+    )
+    # Только PostgreSQL: секционирование context_history по месяцам.
+    context_partitioning: bool = Field(default=False, env="CONTEXT_PARTITIONING")
+
+    # Диагностика БД
+    db_slow_query_ms: int = Field(default=200, env="DB_SLOW_QUERY_MS")
+    # Сколько повторов одного запроса за апдейт считать признаком N+1.
+    db_n_plus_one_threshold: int = Field(default=10, env="DB_N_PLUS_ONE_THRESHOLD")
+
+    # Транспорт: polling или webhook (aiohttp-сервер, WEBHOOK_WORKERS процессов на порту).
+    transport: str = Field(default="polling", env="TRANSPORT")
+    webhook_url: str | None = Field(default=None, env="WEBHOOK_URL")
+    webhook_path: str = Field(default="/telegram/webhook", env="WEBHOOK_PATH")
+    webhook_host: str = Field(default="0.0.0.0", env="WEBHOOK_HOST")
+    webhook_port: int = Field(default=8080, env="WEBHOOK_PORT")
+    webhook_secret: str = Field(default="", env="WEBHOOK_SECRET")
+    webhook_workers: int = Field(default=1, env="WEBHOOK_WORKERS")
+    # Сколько секунд при остановке ждать апдейты, которые уже в обработке.
+    webhook_drain_timeout: float = Field(default=30.0, env="WEBHOOK_DRAIN_TIMEOUT")
+
+    # Ограничения вызовов модулей из AI-ядра: одновременных вызовов на модуль,
+    # дедлайн вызова (секунды) и доля ошибок, при которой модуль обходится стороной.
+    module_concurrency: int = Field(default=4, env="MODULE_CONCURRENCY")
+    module_timeout: float = Field(default=60.0, env="MODULE_TIMEOUT")
+    module_error_rate: float = Field(default=0.5, env="MODULE_ERROR_RATE")
+    # Сколько секунд при остановке ждать незавершённые запросы к модулям.
+    module_drain_timeout: float = Field(default=30.0, env="MODULE_DRAIN_TIMEOUT")
+
+    # Режим супервизора: один процесс принимает апдейты и распределяет их по
+    # SHARD_WORKERS процессам по id пользователя (0 — один процесс).
+    shard_workers: int = Field(default=0, env="SHARD_WORKERS")
+
+    # Эндпоинт /metrics (формат Prometheus); METRICS_PORT=0 отключает его.
+    metrics_host: str = Field(default="127.0.0.1", env="METRICS_HOST")
+    metrics_port: int = Field(default=9100, env="METRICS_PORT")
+
+    # Сводка по памяти подсистем в лог раз в MEMORY_LOG_INTERVAL секунд (0 — отключить)
+    # и предупреждение администраторам, если RSS воркера выше MEMORY_ALERT_MB
+    # (0 — память всего контейнера выше 90% его лимита, если он известен).
+    memory_log_interval: float = Field(default=300.0, env="MEMORY_LOG_INTERVAL")
+    memory_alert_mb: int = Field(default=0, env="MEMORY_ALERT_MB")
+
+    # Сколько апдейтов разных пользователей обрабатывается одновременно; апдейты
+    # одного пользователя всегда идут по одному.
+    update_workers: int = Field(default=16, env="UPDATE_WORKERS")
+
+    # Исходящие сообщения: общий лимит (сообщений в секунду), интервал между
+    # сообщениями в один чат и в группу (секунды), повторы при flood control.
+    outbound_global_rate: float = Field(default=30.0, env="OUTBOUND_GLOBAL_RATE")
+    outbound_chat_interval: float = Field(default=1.0, env="OUTBOUND_CHAT_INTERVAL")
+    outbound_group_interval: float = Field(default=3.0, env="OUTBOUND_GROUP_INTERVAL")
+    outbound_max_retries: int = Field(default=3, env="OUTBOUND_MAX_RETRIES")
 
     # Безопасность и ограничения
     allowed_users: List[int] = Field(default_factory=list, env="ALLOWED_USERS")
+    # Кому доступны служебные команды (/profile, /memory); пустой список — никому.
+    admin_users: List[int] = Field(default_factory=list, env="ADMIN_USERS")
     rate_limit_per_user_per_minute: int = Field(default=20, env="RATE_LIMIT_PER_MIN")
+    # memory — счётчики в процессе; redis — общие для всех реплик (нужен REDIS_URL).
+    rate_limit_backend: str = Field(default="memory", env="RATE_LIMIT_BACKEND")
+    redis_url: str | None = Field(default=None, env="REDIS_URL")
+    # Хранилище состояний многошаговых диалогов: memory/redis/sql. Для нескольких
+    # реплик нужен redis или sql; брошенный диалог истекает через FSM_TTL_SECONDS.
+    fsm_storage: str = Field(default="memory", env="FSM_STORAGE")
+    fsm_ttl_seconds: int = Field(default=86400, env="FSM_TTL_SECONDS")
     fernet_secret: str = Field(default="", env="FERNET_SECRET")
 
     # Почта
@@ -51,6 +130,42 @@ class Settings(BaseSettings):
     mail_username: str | None = Field(default=None, env="MAIL_USERNAME")
     mail_password: str | None = Field(default=None, env="MAIL_PASSWORD")
     mail_protocol: str = Field(default="imap", env="MAIL_PROTOCOL")  # imap/pop3
+    # Куда отправлять уведомления о новых письмах (IMAP IDLE).
+    mail_notify_chats: List[int] = Field(default_factory=list, env="MAIL_NOTIFY_CHATS")
+    # RFC 2177 рекомендует перезапускать IDLE не реже чем раз в 29 минут.
+    mail_idle_timeout: int = Field(default=25 * 60, env="MAIL_IDLE_TIMEOUT")
+    # Дополнительные ящики (командный + персональные), JSON-список.
+    mail_accounts: List[MailAccountSettings] = Field(
+        default_factory=list, env="MAIL_ACCOUNTS"
+    )
+    # Одновременных сетевых операций с почтой на все ящики.
+    mail_max_connections: int = Field(default=4, env="MAIL_MAX_CONNECTIONS")
+    # Период опроса POP3-ящиков (у POP3 нет push), секунды.
+    mail_poll_interval: int = Field(default=300, env="MAIL_POLL_INTERVAL")
+    # Кэш AI-анализа писем: срок хранения и максимальное число записей.
+    mail_analysis_ttl_days: int = Field(default=30, env="MAIL_ANALYSIS_TTL_DAYS")
+    mail_analysis_max_entries: int = Field(default=5000, env="MAIL_ANALYSIS_MAX_ENTRIES")
+    # Локальный архив писем с полнотекстовым поиском (FTS5 / tsvector).
+    mail_archive_enabled: bool = Field(default=True, env="MAIL_ARCHIVE_ENABLED")
+    mail_archive_body_chars: int = Field(default=20000, env="MAIL_ARCHIVE_BODY_CHARS")
+    mail_archive_search_limit: int = Field(default=5, env="MAIL_ARCHIVE_SEARCH_LIMIT")
+    # Извлечение текста из вложений (PDF, DOCX, HTML, TXT) в пуле процессов.
+    mail_extract_enabled: bool = Field(default=True, env="MAIL_EXTRACT_ENABLED")
+    mail_extract_workers: int = Field(default=2, env="MAIL_EXTRACT_WORKERS")
+    mail_extract_timeout: float = Field(default=10.0, env="MAIL_EXTRACT_TIMEOUT")
+    mail_extract_max_bytes: int = Field(default=5 * 1024 * 1024, env="MAIL_EXTRACT_MAX_BYTES")
+    # Сколько байт вложений одного письма сохраняется для извлечения текста в сумме.
+    mail_extract_max_total_bytes: int = Field(
+        default=16 * 1024 * 1024, env="MAIL_EXTRACT_MAX_TOTAL_BYTES"
+    )
+    mail_extract_max_chars: int = Field(default=4000, env="MAIL_EXTRACT_MAX_CHARS")
+    # Локальная предклассификация: рассылки, уведомления, автоответы и недоставки
+    # описываются шаблоном без обращения к LLM.
+    mail_classifier_enabled: bool = Field(default=True, env="MAIL_CLASSIFIER_ENABLED")
+    mail_classifier_threshold: float = Field(default=0.9, env="MAIL_CLASSIFIER_THRESHOLD")
+    # /mail digest: бюджет токенов на пачку писем и число параллельных запросов к LLM.
+    mail_digest_chunk_tokens: int = Field(default=2500, env="MAIL_DIGEST_CHUNK_TOKENS")
+    mail_digest_concurrency: int = Field(default=4, env="MAIL_DIGEST_CONCURRENCY")
 
     @field_validator("fernet_secret", mode="before")
     def _ensure_fernet_key(cls, value: str):  # noqa: N805 - pydantic validator
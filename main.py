@@ -1,13 +1,46 @@
 """Точка входа Telegram-бота."""
+import time
+
+# Отметка до остальных импортов: их длительность входит в отчёт о запуске.
+_STARTED = time.perf_counter()
+
 import asyncio
 import logging
+import signal
+from multiprocessing.connection import Connection
+from typing import Optional
 
 from aiogram import Dispatcher
 
-from app.core.db import create_db, dispose_engine, init_engine
-from app.core.loader import create_bot, create_dispatcher
-from app.core.modules import ModuleRegistry
-from app.core.security import AccessMiddleware, ContextInjectorMiddleware, RateLimitMiddleware
+from app.core import admin
+from app.core.db import create_db, dispose_engine, get_engine, init_engine, session_stats
+from app.core.loader import create_bot, create_dispatcher, fsm_memory_usage
+from app.core.maintenance import ContextMaintenance, enable_incremental_vacuum
+from app.core.memory import MemoryMonitor, memory
+from app.core.metrics import (
+    HandlerMetricsMiddleware,
+    db_metrics,
+    memory_metrics,
+    metrics,
+    module_metrics,
+    outbound_metrics,
+    start_metrics_server,
+    update_metrics,
+)
+from app.core.modules import ModuleRegistry, module_update_types
+from app.core.outbound import OutboundScheduler, OutboundScopeMiddleware
+from app.core.ratelimit import create_rate_limit_backend
+from app.core.sql_stats import query_stats
+from app.core.startup import StartupTimer
+from app.core.supervisor import consume_updates, run_supervisor
+from app.core.webhook import run_workers, serve_webhook
+from app.core.security import (
+    AccessMiddleware,
+    ContextInjectorMiddleware,
+    DbSessionMiddleware,
+    HandlerTagMiddleware,
+    RateLimitMiddleware,
+)
 from config import get_settings
 
 logging.basicConfig(
@@ -17,30 +50,225 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def main():
+async def main(
+    worker_index: int = 0, create_schema: bool = True, updates: Optional[Connection] = None
+):
+    """Запуск бота. ``worker_index`` > 0 — дополнительный webhook-воркер.
+
+    С ``updates`` бот работает воркером супервизора: апдейты приходят из канала,
+    а не из Telegram.
+    """
+
+    timer = StartupTimer(_STARTED)
+    timer.mark("импорт", _STARTED)
     settings = get_settings()
+    primary = worker_index == 0
+    # Общий лимит исходящих делится между воркерами супервизора.
+    outbound_share = settings.shard_workers if updates is not None else 1
 
-    init_engine(settings.database_url)
-    await create_db()
+    init_engine(
+        settings.database_url,
+        slow_query_ms=settings.db_slow_query_ms,
+        n_plus_one_threshold=settings.db_n_plus_one_threshold,
+    )
+    if create_schema:
+        with timer.phase("схема БД"):
+            await create_db(partition_context_history=settings.context_partitioning)
+            await enable_incremental_vacuum(get_engine())
+    maintenance = ContextMaintenance(
+        get_engine(),
+        ttl_days=settings.context_ttl_days,
+        max_rows_per_user=settings.context_window_messages,
+        interval_seconds=settings.context_maintenance_interval,
+        partitioning=settings.context_partitioning,
+    )
 
     bot = create_bot(settings.bot_token)
-    dispatcher: Dispatcher = create_dispatcher()
+    # Все send*-запросы бота идут через очередь с лимитами Telegram.
+    outbound = OutboundScheduler(
+        global_rate=settings.outbound_global_rate / max(1, outbound_share),
+        chat_interval=settings.outbound_chat_interval,
+        group_interval=settings.outbound_group_interval,
+        max_retries=settings.outbound_max_retries,
+    )
+    bot.session.middleware(outbound)
+    # Одна сессия БД на апдейт (и для message, и для callback_query). Сессия открывается
+    # после очереди планировщика и до FSM: SQLStorage читает состояние в ней же.
+    dispatcher: Dispatcher = create_dispatcher(settings, before_fsm=[DbSessionMiddleware()])
 
+    # Команды администраторов раньше модулей: их FSM-состояния не перехватят /profile.
+    admin.setup(dispatcher, settings)
     registry = ModuleRegistry(dispatcher, settings)
-    registry.load_modules()
+    with timer.phase("модули"):
+        registry.load_modules()
+    # Запуск и остановка модулей по зависимостям (Module.startup/warmup/shutdown).
+    dispatcher.startup.register(registry.startup)
+    dispatcher.shutdown.register(registry.shutdown)
+    # Последний startup-хук: отчёт пишется после запуска модулей.
+    dispatcher.startup.register(timer.on_ready)
 
+    # Склеиваются только сообщения одного апдейта.
+    dispatcher.update.outer_middleware(OutboundScopeMiddleware())
+    dispatcher.message.middleware(HandlerTagMiddleware())
+    dispatcher.callback_query.middleware(HandlerTagMiddleware())
+    dispatcher.message.middleware(HandlerMetricsMiddleware())
+    dispatcher.callback_query.middleware(HandlerMetricsMiddleware())
     dispatcher.message.middleware(AccessMiddleware(settings.allowed_users))
-    dispatcher.message.middleware(RateLimitMiddleware(settings.rate_limit_per_user_per_minute))
+    rate_limit_backend = create_rate_limit_backend(settings.rate_limit_backend, settings.redis_url)
+    dispatcher.message.middleware(
+        RateLimitMiddleware(settings.rate_limit_per_user_per_minute, rate_limit_backend)
+    )
     dispatcher.message.middleware(ContextInjectorMiddleware(settings, registry))
 
+    metrics.register_collector(db_metrics)
+    metrics.register_collector(outbound_metrics(outbound))
+    metrics.register_collector(update_metrics(dispatcher["update_scheduler"]))
+    metrics.register_collector(module_metrics(registry))
+    metrics.register_collector(memory_metrics(memory))
+
+    # Учёт памяти: что хранится в процессе и сколько занимает.
+    memory.register("ratelimit", rate_limit_backend.memory_usage)
+    memory.register("fsm", lambda: fsm_memory_usage(dispatcher.storage))
+    memory.register("update_scheduler", dispatcher["update_scheduler"].memory_usage)
+    memory.register("outbound", outbound.memory_usage)
+    memory.register("sql_stats", query_stats.memory_usage)
+    memory.register("metrics", metrics.memory_usage)
+    for name, module in registry.modules.items():
+        memory.register(f"module.{name}", module.memory_usage)
+    memory_monitor = MemoryMonitor(
+        memory,
+        interval_seconds=settings.memory_log_interval,
+        alert_bytes=settings.memory_alert_mb * 1024 * 1024 or None,
+        # Порог от лимита контейнера общий для всех воркеров — проверяет один.
+        watch_container=primary,
+        notify=lambda text: admin.notify_admins(
+            bot, settings.admin_users, f"Воркер {worker_index}: {text}"
+        ),
+    )
+
+    # Обслуживание БД выполняет только основной процесс.
+    maintenance_task = asyncio.create_task(maintenance.run_forever()) if primary else None
+    memory_task = (
+        asyncio.create_task(memory_monitor.run_forever())
+        if settings.memory_log_interval > 0
+        else None
+    )
+    metrics_runner = None
     try:
+        if settings.metrics_port:
+            # У каждого воркера свой порт: METRICS_PORT + номер воркера.
+            metrics_runner = await start_metrics_server(
+                settings.metrics_host, settings.metrics_port + worker_index
+            )
         logger.info("Бот запущен. Ожидаем обновления...")
-        await dispatcher.start_polling(bot)
+        if updates is not None:
+            await consume_updates(
+                dispatcher,
+                bot,
+                updates,
+                primary=primary,
+                drain_timeout=settings.webhook_drain_timeout,
+            )
+        elif settings.transport == "webhook":
+            await serve_webhook(dispatcher, bot, settings, primary=primary)
+        else:
+            await dispatcher.start_polling(bot)
     finally:
         logger.info("Остановка бота...")
+        if maintenance_task is not None:
+            maintenance_task.cancel()
+        if memory_task is not None:
+            memory_task.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await rate_limit_backend.close()
+        await dispatcher.storage.close()
+        await outbound.close()
         await bot.session.close()
         await dispose_engine()
+        logger.info(
+            "Сессий БД: %s, соединений выдано: %s, апдейтов: %s (с повторными соединениями: %s)",
+            session_stats.sessions,
+            session_stats.checkouts,
+            session_stats.units_of_work,
+            session_stats.multi_checkout_units,
+        )
+        scheduler = dispatcher["update_scheduler"]
+        logger.info(
+            "Апдейтов обработано: %s, ожидание очереди сред. %.1f мс, макс. %.1f мс",
+            scheduler.stats.processed,
+            scheduler.stats.wait.avg_ms,
+            scheduler.stats.wait.max_ms,
+        )
+        logger.info(
+            "Исходящие: отправлено %s, склеено %s, повторов %s, ошибок %s, "
+            "задержка сред. %.1f мс, макс. %.1f мс",
+            outbound.stats.sent,
+            outbound.stats.merged,
+            outbound.stats.retries,
+            outbound.stats.failed,
+            outbound.stats.latency.avg_ms,
+            outbound.stats.latency.max_ms,
+        )
+        logger.info(
+            "SQL: медленных запросов %s, подозрений на N+1 %s",
+            query_stats.slow_queries,
+            query_stats.n_plus_one_detected,
+        )
+        for statement, histogram in query_stats.top(5):
+            logger.info(
+                "SQL %s раз, сред. %.1f мс, макс. %.1f мс: %s",
+                histogram.count,
+                histogram.avg_ms,
+                histogram.max_ms,
+                statement,
+            )
+
+
+async def prepare_database() -> None:
+    """Создаёт схему один раз до запуска webhook-воркеров."""
+
+    settings = get_settings()
+    init_engine(settings.database_url)
+    try:
+        await create_db(partition_context_history=settings.context_partitioning)
+        await enable_incremental_vacuum(get_engine())
+    finally:
+        await dispose_engine()
+
+
+def run_worker(index: int) -> None:
+    asyncio.run(main(worker_index=index, create_schema=False))
+
+
+def run_shard(index: int, updates: Connection) -> None:
+    # Ctrl+C получает супервизор и останавливает воркеры по порядку.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(main(worker_index=index, create_schema=False, updates=updates))
+
+
+async def supervise() -> None:
+    """Процесс приёма апдейтов в режиме ``SHARD_WORKERS`` > 0."""
+
+    settings = get_settings()
+    bot = create_bot(settings.bot_token)
+    dispatcher = create_dispatcher(settings)
+    # Апдейты обрабатывают воркеры: здесь модули не создаются, нужны только типы апдейтов.
+    allowed_updates = module_update_types(settings, extra=[admin.router])
+    try:
+        await run_supervisor(settings, dispatcher, bot, run_shard, allowed_updates)
+    finally:
+        await dispatcher.storage.close()
+        await bot.session.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    startup_settings = get_settings()
+    if startup_settings.shard_workers > 0:
+        asyncio.run(prepare_database())
+        asyncio.run(supervise())
+    elif startup_settings.transport == "webhook" and startup_settings.webhook_workers > 1:
+        asyncio.run(prepare_database())
+        run_workers(startup_settings.webhook_workers, run_worker)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,106 @@
+"""Срок жизни записей ``SQLStorage``."""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import func, select
+
+from app.core import fsm
+from app.core.db import create_db, create_session, dispose_engine, init_engine
+from app.core.fsm import SQLStorage
+from app.models import FSMRecord
+
+TTL = 60
+START = datetime(2024, 1, 1, 12, 0)
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+OTHER = StorageKey(bot_id=1, chat_id=20, user_id=20)
+
+
+class FrozenDatetime(datetime):
+    now = START
+
+    @classmethod
+    def utcnow(cls):
+        return cls.now
+
+
+def _at(**delta) -> None:
+    FrozenDatetime.now = START + timedelta(**delta)
+
+
+def _run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+async def _rows() -> int:
+    async with create_session() as session:
+        return await session.scalar(select(func.count()).select_from(FSMRecord))
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(fsm, "datetime", FrozenDatetime)
+    FrozenDatetime.now = START
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    init_engine(f"sqlite+aiosqlite:///{tmp_path / 'fsm.db'}")
+    loop.run_until_complete(create_db())
+    yield SQLStorage(ttl_seconds=TTL)
+    loop.run_until_complete(dispose_engine())
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def test_record_expires_after_ttl(storage):
+    _run(storage.set_state(KEY, "form:name"))
+    _run(storage.set_data(KEY, {"name": "Иван"}))
+
+    _at(seconds=TTL - 1)
+    assert _run(storage.get_state(KEY)) == "form:name"
+    assert _run(storage.get_data(KEY)) == {"name": "Иван"}
+
+    _at(seconds=2 * TTL)
+    assert _run(storage.get_state(KEY)) is None
+    assert _run(storage.get_data(KEY)) == {}
+
+
+def test_write_extends_ttl(storage):
+    _run(storage.set_state(KEY, "form:name"))
+    _at(seconds=TTL - 1)
+    _run(storage.set_data(KEY, {"step": 2}))
+
+    _at(seconds=2 * TTL - 2)
+    assert _run(storage.get_state(KEY)) == "form:name"
+
+
+def test_write_after_expiry_drops_stale_data(storage):
+    _run(storage.set_data(KEY, {"name": "Иван"}))
+    _at(seconds=TTL)
+    _run(storage.set_state(KEY, "form:phone"))
+
+    assert _run(storage.get_state(KEY)) == "form:phone"
+    assert _run(storage.get_data(KEY)) == {}
+
+
+def test_clear_deletes_record(storage):
+    _run(storage.set_state(KEY, "form:name"))
+    _run(storage.set_data(KEY, {"name": "Иван"}))
+    _run(storage.set_state(KEY, None))
+    _run(storage.set_data(KEY, {}))
+
+    assert _run(_rows()) == 0
+
+
+def test_purge_removes_expired_records_once_per_interval(storage):
+    _run(storage.set_state(KEY, "form:name"))
+
+    # Запись уже истекла, но следующий проход очистки ещё не наступил.
+    _at(minutes=30)
+    _run(storage.set_state(OTHER, "form:name"))
+    assert _run(_rows()) == 2
+
+    _at(hours=1)
+    _run(storage.set_state(OTHER, "form:phone"))
+    assert _run(_rows()) == 1
+    assert _run(storage.get_state(OTHER)) == "form:phone"
@@ -0,0 +1,91 @@
+"""Границы скользящего окна в бэкендах rate limit."""
+import asyncio
+
+import pytest
+
+from app.core.ratelimit import MemoryRateLimitBackend, RedisRateLimitBackend
+
+LIMIT = 10
+WINDOW = 60.0
+# Начало окна, далёкое от нуля: часы в бэкендах — monotonic/time.
+START = 100 * WINDOW
+
+
+class FakeClock:
+    def __init__(self, now: float = START):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _hits(backend, count: int, key: str = "user") -> int:
+    """Число пропущенных запросов из ``count`` подряд."""
+
+    async def run() -> int:
+        return sum([await backend.hit(key, LIMIT, WINDOW) for _ in range(count)])
+
+    return asyncio.run(run())
+
+
+def _check_window_boundaries(backend, clock: FakeClock) -> None:
+    assert _hits(backend, LIMIT + 1) == LIMIT
+
+    # Сразу после границы окна предыдущее учитывается целиком.
+    clock.now = START + WINDOW
+    assert _hits(backend, 1) == 0
+
+    # На середине следующего окна вес предыдущего — половина.
+    clock.now = START + 1.5 * WINDOW
+    assert _hits(backend, LIMIT) == LIMIT // 2
+
+    # Перед концом окна от предыдущего остаётся меньше одного запроса.
+    clock.now = START + 2 * WINDOW - 1
+    assert _hits(backend, LIMIT) == LIMIT - LIMIT // 2
+
+
+def test_memory_window_boundaries():
+    clock = FakeClock()
+    _check_window_boundaries(MemoryRateLimitBackend(clock=clock), clock)
+
+
+def test_memory_keys_are_independent():
+    backend = MemoryRateLimitBackend(clock=FakeClock())
+    assert _hits(backend, LIMIT, key="a") == LIMIT
+    assert _hits(backend, 1, key="a") == 0
+    assert _hits(backend, 1, key="b") == 1
+
+
+def test_memory_resets_after_idle_window():
+    clock = FakeClock()
+    backend = MemoryRateLimitBackend(clock=clock)
+    _hits(backend, LIMIT)
+    # Целое окно без запросов: прошлый счётчик уже не в предыдущем окне.
+    clock.now = START + 2 * WINDOW
+    assert _hits(backend, LIMIT + 1) == LIMIT
+
+
+def test_memory_sweeps_stale_keys():
+    clock = FakeClock()
+    backend = MemoryRateLimitBackend(clock=clock)
+    _hits(backend, 1, key="idle")
+    clock.now = START + 2 * WINDOW
+    _hits(backend, 1, key="active")
+    assert len(backend) == 2
+
+    clock.now = START + 3 * WINDOW
+    _hits(backend, 1, key="active")
+    assert len(backend) == 1
+
+
+def test_redis_window_boundaries(monkeypatch):
+    pytest.importorskip("lupa")  # Lua-скрипты в fakeredis
+    fakeredis = pytest.importorskip("fakeredis")
+    from redis.asyncio import Redis
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        Redis, "from_url", classmethod(lambda cls, url: fakeredis.FakeAsyncRedis(server=server))
+    )
+    clock = FakeClock()
+    _check_window_boundaries(RedisRateLimitBackend("redis://test", clock=clock), clock)